@@ -0,0 +1,143 @@
+
+# Headless bulk ingestion of chess.com users from a file of usernames, resumable through a persistent job queue
+#
+# Usage: python src/ChessIngest.py usernames.txt [--requeue] [--stall-wait 60] [--max-attempts 5]
+#
+# Every downloaded month is checkpointed, so an interrupted or crashed run picks up where it stopped when run again.
+
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from threading import Event
+from typing import List
+
+from aiohttp import ClientError
+from chessdotcom.aio import ChessDotComError
+
+from chessproc.chessclient import get_client
+from chessproc.jobqueue import IngestJobQueue
+from chessproc.locks import user_lock
+from chessproc.pgnproc import download_and_parse_months, downloaded_dates, get_player_months, global_pgn_directory, make_directory, write_player_parquet
+
+
+# Logging level
+logging.basicConfig(level=logging.ERROR, format="%(asctime)s - %(levelname)s - %(message)s", datefmt="%H:%M:%S")
+
+
+class IngestStats:
+
+    """
+    Running totals for the throughput of an ingestion run
+    """
+
+    def __init__(self) -> None:
+        self.start = time.time()
+        self.users = 0
+        self.months = 0
+        self.bytes = 0
+        self.games = 0
+
+    def line(self) -> str:
+        """Summary of the totals and rates so far"""
+        elapsed = max(time.time() - self.start, 1e-9)
+        return (f"{self.users} users, {self.months} months, {self.bytes / 1e6:.1f} MB, {self.games} games in {elapsed:.0f}s "
+                f"({self.months / elapsed:.2f} months/s, {self.bytes / 1e6 / elapsed:.2f} MB/s, {self.games / elapsed:.1f} games/s)")
+
+
+def read_usernames(filepath: str) -> List[str]:
+    """Read usernames from a file, one per line, ignoring blank lines and # comments"""
+    with open(filepath) as fh:
+        lines = [line.split('#', 1)[0].strip() for line in fh]
+    return list(dict.fromkeys([line for line in lines if line]))
+
+
+def ingest_user(queue: IngestJobQueue, username: str, stats: IngestStats, cancel: Event, pgn_directory: str = global_pgn_directory) -> int:
+    """Download the months of the user missing from the checkpoints, parsing them as they arrive, and write the parquet, return the game count"""
+    archive_dates = get_player_months([username])[username]["Dates"]
+    if not archive_dates:
+        return 0
+    # The app, its scheduler or a pgn import may be writing the files of the user at the same time
+    with user_lock(username, pgn_directory):
+        make_directory(username=username, pgn_directory=pgn_directory)
+
+        # Months checkpointed and still on disk are read from the cache, the latest month is still being played so it is always requested.
+        # Every other stored file is read too(chunks imported from local pgns), as the parquet is written from all of them
+        stored_dates = downloaded_dates(username=username, base_directory_name=pgn_directory)
+        done_dates = set(queue.done_months(username)).intersection(stored_dates)
+        download_dates = [date for date in archive_dates if date not in done_dates or date == archive_dates[-1]]
+        read_dates = [date for date in stored_dates if date not in download_dates]
+
+        def on_downloaded(date: str, size: int) -> None:
+            queue.mark_month(username, date, size)
+            stats.months += 1
+            stats.bytes += size
+
+        month_dfs = get_client().submit(download_and_parse_months(username=username, download_dates=download_dates, read_dates=read_dates, base_directory_name=pgn_directory, cancel=cancel, on_downloaded=on_downloaded)).result()
+        if not month_dfs:
+            return 0
+
+        return write_player_parquet(username=username, month_dfs=month_dfs, base_directory_name=pgn_directory, cancel=cancel)
+
+
+def run(args: argparse.Namespace) -> None:
+    """Work through the queue until every user is done, invalid or out of attempts"""
+    queue = IngestJobQueue(args.queue or args.pgn_directory + "ingest.sqlite")
+    queue.add_users(read_usernames(args.usernames), requeue=args.requeue)
+    stats = IngestStats()
+    cancel = Event()
+    stall_wait = args.stall_wait
+
+    while (username := queue.next_user()) is not None:
+        user_start = time.time()
+        try:
+            games = ingest_user(queue=queue, username=username, stats=stats, cancel=cancel, pgn_directory=args.pgn_directory)
+        except KeyboardInterrupt:
+            cancel.set()
+            print("Interrupted, progress has been saved and the run can be resumed.")
+            break
+        except (ChessDotComError, ClientError, asyncio.TimeoutError) as err:
+            status_code = getattr(err, "status_code", None)
+            if status_code == 404:
+                queue.set_user_status(username, "invalid", message="Username not found")
+                print(f"{username}: not found, skipped.")
+                continue
+
+            # Rate limited, server or network error, back off and try again later
+            status = "stalled" if queue.attempts(username) + 1 < args.max_attempts else "failed"
+            queue.set_user_status(username, status, message=str(err))
+            print(f"{username}: {status} ({status_code or type(err).__name__}), waiting {stall_wait:.0f}s.")
+            time.sleep(stall_wait)
+            stall_wait = min(stall_wait * 2, args.max_stall_wait)
+            continue
+        except Exception as err:
+            queue.set_user_status(username, "failed", message=repr(err))
+            print(f"{username}: failed with {err!r}.")
+            continue
+
+        queue.set_user_status(username, "done", games=games)
+        stall_wait = args.stall_wait
+        stats.users += 1
+        stats.games += games
+        print(f"{username}: {games} games in {time.time() - user_start:.1f}s.  Total {stats.line()}")
+
+    print(f"Finished: {stats.line()}")
+    print(f"Queue: {queue.status_counts()}")
+    queue.close()
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Download and process the chess.com games of every username in a file.")
+    parser.add_argument("usernames", help="File with one chess.com username per line")
+    parser.add_argument("--pgn-directory", default=global_pgn_directory, help="Directory for the pgn and parquet files")
+    parser.add_argument("--queue", default=None, help="Job queue database, defaults to ingest.sqlite in the pgn directory")
+    parser.add_argument("--requeue", action="store_true", help="Ingest the listed users again even if they are done, picking up new months")
+    parser.add_argument("--stall-wait", type=float, default=60, help="Seconds to wait after a rate limit or network error, doubled on each stall")
+    parser.add_argument("--max-stall-wait", type=float, default=900, help="Longest wait after a stall")
+    parser.add_argument("--max-attempts", type=int, default=5, help="Attempts per user before it is marked failed")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    run(parse_args(sys.argv[1:]))
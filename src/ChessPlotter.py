@@ -2,6 +2,8 @@
 import sys
 from functools import wraps
 import logging
+from threading import Event
+from typing import Callable, Dict
 
 from PyQt6 import QtCore, QtWidgets
 import matplotlib
@@ -12,9 +14,13 @@ from PyQt6.QtWidgets import (
     QApplication,
 )
 
+from ChessPlotterGameTable import ChessPlotterGameTable
 from ChessPlotterModel import ChessPlotterModel
 from ChessPlotterView import ChessPlotterView
+from ChessPlotterWorker import ChessPlotterNotifier, ChessPlotterWorker
 from chessproc.ChessPlots import ChessPlots
+from chessproc.openingtree import format_moves
+from chessproc.scheduler import RefreshScheduler
 from chessproc.ChessPlotterColourScheme import ChessPlotterColourScheme as cpcs
 
 
@@ -29,6 +35,10 @@ def update_view_counts(method):
         game_count, filtered_game_count = method(self, *method_args, **method_kwargs)
         self.view.game_count_label.setText(f"Total Games: {game_count}")
         self.view.filtered_game_count_label.setText(f"Remaining Games: {filtered_game_count}")
+        sample_count = self.model.update_sample_count()
+        self.view.sample_count_label.setText("" if sample_count is None else f"Sampled Games: {sample_count}")
+        self.game_table.set_games(self.model.filtered_data)
+        self.update_opponent_names()
     return _int
 
 class ChessPlotter:
@@ -41,17 +51,41 @@ class ChessPlotter:
         self.model: ChessPlotterModel = ChessPlotterModel(plotter=ChessPlots())
         self.view:  ChessPlotterView  = view
 
+        # Workers downloading and processing data, by username
+        self.workers: Dict[str, ChessPlotterWorker] = {}
+
+        # Table of the filtered games shown in the game browser
+        self.game_table = ChessPlotterGameTable()
+        self.view.game_table.setModel(self.game_table)
+
+        # Opponent index the opponent completion was given the names of
+        self.completer_index = None
+
+        # Every stored user is checked for new games in the background, the shown user is reloaded when it has new games
+        self.notifier = ChessPlotterNotifier()
+        self.notifier.refreshed.connect(self.user_refreshed)
+        self.scheduler = RefreshScheduler(on_refreshed=lambda username, games: self.notifier.refreshed.emit(username))
+
         # Make signal -> slot connections
         self.make_connections()
         
         # Update plot list
         self.update_plot_list()
 
-        # Populate the username list
-        self.username_selection_setup()
+        # Show the plot of the last session at once and read its games in the background
+        session = self.model.load_session()
+        if session is not None:
+            self.resume_session(session)
+        else:
+            # Populate the username list
+            self.username_selection_setup()
 
-        # Generate the first plot, will error if there is no data
-        self.change_plot()
+            # Generate the first plot, will error if there is no data
+            self.change_plot()
+
+        self.scheduler.start()
+        if self.model.username is not None:
+            self.scheduler.refresh_now(self.model.username)
 
     
     def make_connections(self):
@@ -63,15 +97,24 @@ class ChessPlotter:
 
         # Link game filter controls
         self.view.player_colour_select.currentIndexChanged.connect(self.change_to_colour)
+        self.view.time_class_select.currentIndexChanged.connect(self.change_to_time_class)
         self.view.opponents_combo.currentIndexChanged.connect(self.change_to_opponent_combo)
         self.view.opponents.editingFinished.connect(self.change_to_opponent)
         self.view.opening_select_combo.currentIndexChanged.connect(self.change_to_opening_combo)
         self.view.opening_select.editingFinished.connect(self.change_to_opening_select)
         self.view.number_select.editingFinished.connect(self.change_to_number_select)
+        self.view.moves_select.editingFinished.connect(self.change_to_moves_select)
+        self.view.date_from.editingFinished.connect(self.change_to_date_range)
+        self.view.date_to.editingFinished.connect(self.change_to_date_range)
+        self.view.sample_size_select.editingFinished.connect(self.change_to_sample_size)
 
         # Link plot selection
         self.view.generate_plot.clicked.connect(self.change_plot)
 
+        # Link game browser
+        self.view.show_games.clicked.connect(self.toggle_game_browser)
+        self.view.game_table.doubleClicked.connect(self.show_game_pgn)
+
         # Link plot save
         self.view.save_plot.clicked.connect(self.save_figure)
 
@@ -80,17 +123,27 @@ class ChessPlotter:
 
         # Link user add button
         self.view.adduser.username_add.clicked.connect(self.add_user)
+
+        # Link user add cancel button
+        self.view.adduser.username_cancel.clicked.connect(self.cancel_add_user)
     
     @update_view_counts
     def change_to_username(self, idx):
-        """Call model setter for username"""
-        return self.model.set_username(idx)
+        """Call model setter for username, the stored games are shown at once and checked for new games in the background"""
+        counts = self.model.set_username(idx)
+        self.scheduler.refresh_now(self.model.username)
+        return counts
 
     @update_view_counts
     def change_to_colour(self, idx):
         """Call model setter for colour"""
         return self.model.set_colour(idx)
 
+    @update_view_counts
+    def change_to_time_class(self, idx):
+        """Call model setter for time class"""
+        return self.model.set_time_class(idx)
+
     @update_view_counts
     def change_to_opponent_combo(self, idx):
         """Call model setter for number selection"""
@@ -116,6 +169,20 @@ class ChessPlotter:
         """Call model setter for number selection"""
         return self.model.set_number_items(self.view.number_select.text())
     
+    @update_view_counts
+    def change_to_date_range(self):
+        """Call model setter for the date range"""
+        return self.model.set_date_range(self.view.date_from.text(), self.view.date_to.text())
+
+    @update_view_counts
+    def change_to_sample_size(self):
+        """Call model setter for the size of the sample interactive plots are drawn from"""
+        return self.model.set_sample_size(self.view.sample_size_select.text())
+
+    def change_to_moves_select(self):
+        """Call model setter for the move sequence of the opening explorer"""
+        self.model.set_moves(self.view.moves_select.text())
+    
     def username_selection_setup(self):
         """Initialize the model for reading parquet files, if no parquet files to read then the Add User window is opened."""
 
@@ -131,6 +198,7 @@ class ChessPlotter:
             self.view.adduser.exec()
             if self.model.username_list is None:
                 print("Exiting as no user was added.")
+                self.shutdown()
                 sys.exit()
 
     def update_username_list(self):
@@ -154,17 +222,153 @@ class ChessPlotter:
         combo_input = self.view.plot_select.currentText()
 
         # Remove previous figure and insert new figure
+        self.remove_canvas()
+        self.view.add_canvas(self.model.set_plot(combo_input=combo_input))
+
+    def remove_canvas(self):
+        """Remove the figure shown in the window"""
         self.view.centralLayout.removeWidget(self.view.canvas)
         self.view.canvas.setParent(None) # This is important so that the figure is actually removed from display
-        self.view.add_canvas(self.model.set_plot(combo_input=combo_input))
+
+    def resume_session(self, session: Dict):
+        """Set the controls to the last session and show its plot image, the model reads the games on a worker thread meanwhile"""
+        self.show_session_controls(session)
+        if session["image"] is not None:
+            self.remove_canvas()
+            self.view.add_image(session["image"])
+
+        # The controls wait for the model, they would otherwise change it while it is being read
+        self.view.centralWidget().setEnabled(False)
+        self.view.statusBar().showMessage(f"{session['username']}: Resuming session...")
+        self.start_worker(session["username"], lambda username, progress, cancel: self.model.restore_session(session),
+                          lambda username, success: self.resume_finished(username, success, session["image"] is not None))
+
+    def show_session_controls(self, session: Dict):
+        """Set the controls to the user and filters of the session without calling the model"""
+        controls = [self.view.username_input, self.view.player_colour_select, self.view.time_class_select, self.view.opponents_combo, self.view.opponents,
+                    self.view.opening_select_combo, self.view.opening_select, self.view.number_select, self.view.moves_select,
+                    self.view.date_from, self.view.date_to, self.view.sample_size_select, self.view.plot_select]
+        for control in controls:
+            control.blockSignals(True)
+
+        usernames = self.model.list_usernames()
+        self.view.username_input.clear()
+        self.view.username_input.addItems(usernames)
+        self.view.username_input.setCurrentIndex(usernames.index(session["username"]))
+        self.view.player_colour_select.setCurrentIndex(0 if session["colour"][0] else 1 if session["colour"][1] == "White" else 2)
+        self.view.time_class_select.setCurrentIndex(0 if session["time_class"] is None else session["time_class"] + 1)
+        self.view.opponents_combo.setCurrentIndex(0 if session["opponents_is_whitelist"] else 1)
+        self.view.opponents.setText(" ".join(session["opponents"]))
+        self.view.opening_select_combo.setCurrentIndex(0 if session["opening_is_whitelist"] else 1)
+        self.view.opening_select.setText(" ".join(session["opening"]))
+        self.view.number_select.setText(session["number_items"])
+        self.view.moves_select.setText(format_moves(session["moves"]))
+        self.view.date_from.setText("" if session["date_range"][0] is None else session["date_range"][0][:10])
+        self.view.date_to.setText("" if session["date_range"][1] is None else session["date_range"][1][:10])
+        self.view.sample_size_select.setText("" if session["sample_size"] is None else str(session["sample_size"]))
+        if session["plot_selection"] is not None:
+            self.view.plot_select.setCurrentText(session["plot_selection"])
+
+        for control in controls:
+            control.blockSignals(False)
+
+    def resume_finished(self, username: str, success: bool, image_shown: bool):
+        """Show the counts once the games of the session are read, draw the plot if no image was shown"""
+        self.view.centralWidget().setEnabled(True)
+        if not success:
+            # Start as without a session
+            self.view.statusBar().showMessage(f"{username}: Could not resume session.")
+            self.username_selection_setup()
+            self.change_plot()
+            return
+
+        self.view.statusBar().showMessage(f"{username}: Session resumed.")
+        self.scheduler.refresh_now(username)
+        self.show_counts()
+        if not image_shown:
+            self.change_plot()
+
+    @update_view_counts
+    def show_counts(self):
+        """Show the game counts of the model"""
+        return (self.model.update_game_dataframe_count(), self.model.update_filtered_game_dataframe_count())
+
+    def update_opponent_names(self):
+        """Give the opponent completion the opponents of the current user, once per opponent index loaded"""
+        if self.completer_index is not self.model.opponent_index:
+            self.completer_index = self.model.opponent_index
+            self.view.opponent_completer.set_names(self.model.opponent_names())
+
+    def toggle_game_browser(self):
+        """Show or hide the game browser, showing the filtered games"""
+        if self.view.game_browser.isVisible():
+            self.view.game_browser.hide()
+        else:
+            if self.model.filtered_data is not None:
+                self.game_table.set_games(self.model.filtered_data)
+            self.view.game_browser.show()
+
+    def show_game_pgn(self, index: QtCore.QModelIndex):
+        """Read the pgn of the double clicked game from its month file and show it"""
+        pgn = self.model.game_pgn(self.game_table.game_id(index.row()))
+        self.view.game_pgn.setPlainText("Could not read the pgn of the game." if pgn is None else pgn)
+
+    def start_worker(self, username: str, task: Callable[[str, Callable[[str], None], Event], bool], on_finished: Callable[[str, bool], None]) -> bool:
+        """Run the task for the username on a worker thread, only one task runs per username at a time"""
+        if username in self.workers:
+            self.view.statusBar().showMessage(f"{username}: already being updated.")
+            return False
+
+        worker = ChessPlotterWorker(username=username, task=task)
+        worker.progress.connect(self.show_progress)
+        worker.finished.connect(on_finished)
+        # Keep the worker until its thread has stopped
+        worker.worker_thread.finished.connect(lambda: self.workers.pop(username, None))
+        self.workers[username] = worker
+        worker.start()
+        return True
+
+    def show_progress(self, username: str, message: str):
+        """Show worker progress in the status bar, and in the Add User window if it is showing the same username"""
+        self.view.statusBar().showMessage(f"{username}: {message}")
+        if self.view.adduser.username_input.text() == username:
+            self.view.adduser.username_data.setText(message)
+
+    def shutdown(self):
+        """Stop the scheduler, cancel all running workers, wait for their threads to stop and save the session"""
+        self.scheduler.stop()
+        for worker in list(self.workers.values()):
+            worker.cancel.set()
+            worker.worker_thread.wait()
+
+        # Keep the session for the next launch
+        self.model.save_session()
 
     def refresh_username(self):
-        """Refresh the currently selected player/username"""
-        return self.model.refresh_user_parquet()
+        """Refresh the currently selected player/username in the background"""
+        self.start_worker(self.model.username, self.model.refresh_user_parquet, self.refresh_finished)
+
+    def user_refreshed(self, username: str):
+        """Reload the data and the plot when the background scheduler found new games of the selected user"""
+        self.view.statusBar().showMessage(f"{username}: New games found.")
+        if username == self.model.username and username not in self.workers:
+            self.reload_game_dataframe()
+            self.change_plot()
+
+    def refresh_finished(self, username: str, success: bool):
+        """Reload the data once a refresh has finished, if the refreshed user is still selected"""
+        self.view.statusBar().showMessage(f"{username}: {'Refreshed.' if success else 'Refresh failed or cancelled.'}")
+        if success and username == self.model.username:
+            self.reload_game_dataframe()
+
+    @update_view_counts
+    def reload_game_dataframe(self):
+        """Call model to reload the data of the selected username"""
+        return self.model.reload_game_dataframe()
 
     def show_dialog(self):
-        """Show Add User dialog when the main window Add button is pushed"""
-        self.view.adduser.exec()
+        """Show Add User dialog when the main window Add button is pushed, the main window stays usable"""
+        self.view.adduser.show()
     
     def save_figure(self):
         """Save figure when button is pushed"""
@@ -188,27 +392,44 @@ class ChessPlotter:
             self.view.adduser.username_data.setText("Username not checked.")
             return
 
-        # Download the files once confirmed valid
+        # Download and process the files in the background once confirmed valid
         self.view.adduser.username_data.setText("Valid Username, fetching...")
-        if not self.model.download_by_username(username=username):
-            self.view.adduser.username_data.setText("Error on download")
+        if self.start_worker(username, self.add_user_task, self.add_user_finished):
+            self.view.adduser.username_cancel.setEnabled(True)
+
+    def add_user_task(self, username: str, progress: Callable[[str], None], cancel: Event) -> bool:
+        """Download the files and create the parquet file, each month is parsed as it arrives, run on a worker thread"""
+        if not self.model.ingest_by_username(username=username, progress=progress, cancel=cancel):
+            progress("Cancelled." if cancel.is_set() else "Error adding user")
+            return False
+
+        progress("Data is ready.")
+        return True
+
+    def add_user_finished(self, username: str, success: bool):
+        """Update the username list once a user has been added"""
+        self.view.adduser.username_cancel.setEnabled(False)
+        if not success:
             return
 
-        # Create the parquet file
-        self.view.adduser.username_data.setText("Data downloaded, processing...")
-
-        if not self.model.create_parquet(username=username):
-            self.view.adduser.username_data.setText("Error on parquet")
-            return
-        self.view.adduser.username_data.setText("Data is ready.")
-
-        # Update the username select combobox
+        # Update the username select combobox, keeping the current selection
+        selected_username = self.model.username
         self.model.init_usernames()
         self.update_username_list()
+        if selected_username in self.model.username_list:
+            self.view.username_input.setCurrentIndex(self.model.username_list.index(selected_username))
+
+    def cancel_add_user(self):
+        """Cancel adding the username entered in the Add User window, completed month files are kept and partial ones are never written"""
+        worker = self.workers.get(self.view.adduser.username_input.text())
+        if worker is not None:
+            worker.cancel.set()
+            self.view.adduser.username_data.setText("Cancelling...")
 
 
 if __name__ == '__main__':
     app = QApplication([])
     window = ChessPlotterView()
     obj = ChessPlotter(window)
+    app.aboutToQuit.connect(obj.shutdown)
     sys.exit(app.exec())
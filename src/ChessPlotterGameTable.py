@@ -0,0 +1,117 @@
+
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+
+# Header of each column of the game table and the values shown in it, from the games
+game_columns: List[Tuple[str, Callable[[pd.DataFrame], pd.Series]]] = [
+    ("Date", lambda games: games["UTCDate"] + games["UTCTime"]),
+    ("White", lambda games: games["White"]),
+    ("Black", lambda games: games["Black"]),
+    ("Result", lambda games: games["Result"]),
+    ("White Elo", lambda games: games["WhiteElo"]),
+    ("Black Elo", lambda games: games["BlackElo"]),
+    ("ECO", lambda games: games["ECO"]),
+    ("Time Control", lambda games: games["TimeControl"]),
+    ("Termination", lambda games: games["Termination"]),
+    ("Moves", lambda games: (games["game_length"] + 1) // 2),
+]
+
+
+def sort_key(values: pd.Series) -> np.ndarray:
+    """Values of a column as an array sorting like the shown values, categories by their name with missing values last"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        ranks = np.argsort(np.argsort(values.cat.categories.astype(str).to_numpy(), kind="stable"))
+        return np.append(ranks, len(ranks))[values.cat.codes.to_numpy()]
+    return values.to_numpy()
+
+
+class ChessPlotterGameTable(QAbstractTableModel):
+
+    """
+    Table of the filtered games for the game browser.
+
+    The view only asks for the rows it shows, they are formatted a block at a time from the games and the last blocks
+    are kept.  Sorting by a column orders the rows by an argsort of the column, computed once per column for the games.
+    """
+
+    block_size = 128
+    cached_blocks = 64
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.games: pd.DataFrame = pd.DataFrame()
+
+        # Positions of the rows in the games, None while the games are shown in their own order
+        self.order: Optional[np.ndarray] = None
+        self.sort_column: Optional[int] = None
+        self.sort_order = Qt.SortOrder.AscendingOrder
+        self.argsorts: Dict[int, np.ndarray] = {}
+        self.blocks: "OrderedDict[int, List[List[str]]]" = OrderedDict()
+
+    def set_games(self, games: pd.DataFrame) -> None:
+        """Show the games, in the sort order already selected"""
+        self.beginResetModel()
+        self.games = games
+        self.argsorts = {}
+        self.blocks = OrderedDict()
+        self.order = self.sorted_positions()
+        self.endResetModel()
+
+    def sorted_positions(self) -> Optional[np.ndarray]:
+        """Positions of the games in the selected sort order"""
+        if self.sort_column is None or not len(self.games):
+            return None
+        if self.sort_column not in self.argsorts:
+            self.argsorts[self.sort_column] = np.argsort(sort_key(game_columns[self.sort_column][1](self.games)), kind="stable")
+        positions = self.argsorts[self.sort_column]
+        return positions if self.sort_order == Qt.SortOrder.AscendingOrder else positions[::-1]
+
+    def position(self, row: int) -> int:
+        """Position in the games of the game shown in the row"""
+        return row if self.order is None else int(self.order[row])
+
+    def game_id(self, row: int) -> int:
+        return self.games.index[self.position(row)]
+
+    def block(self, number: int) -> List[List[str]]:
+        """Shown values of the rows of a block, formatted from the games of the block only"""
+        if number in self.blocks:
+            self.blocks.move_to_end(number)
+            return self.blocks[number]
+
+        rows = np.arange(number * self.block_size, min((number + 1) * self.block_size, len(self.games)))
+        window = self.games.iloc[rows if self.order is None else self.order[rows]]
+        values = [column(window) for _, column in game_columns]
+        self.blocks[number] = [list(row) for row in zip(*[column.astype(str).where(column.notna(), "").tolist() for column in values])]
+        while len(self.blocks) > self.cached_blocks:
+            self.blocks.popitem(last=False)
+        return self.blocks[number]
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.games)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(game_columns)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole or not index.isValid():
+            return None
+        return self.block(index.row() // self.block_size)[index.row() % self.block_size][index.column()]
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        return game_columns[section][0] if orientation == Qt.Orientation.Horizontal else section + 1
+
+    def sort(self, column: int, order: Qt.SortOrder = Qt.SortOrder.AscendingOrder) -> None:
+        """Order the rows by the column, called by the view when a header is clicked"""
+        self.beginResetModel()
+        self.sort_column, self.sort_order = column, order
+        self.blocks = OrderedDict()
+        self.order = self.sorted_positions()
+        self.endResetModel()
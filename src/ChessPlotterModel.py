@@ -1,15 +1,23 @@
 
 from datetime import datetime
 import logging
-from typing import List, Optional
+from threading import Event
+from typing import Callable, Dict, List, Optional, Tuple
 
 from functools import wraps
 from matplotlib.figure import Figure
+import numpy as np
 import os
 import pandas as pd
 import plotnine as gg
 
-from chessproc.pgnproc import construct_parquet_by_username, get_parquet_by_username, download_by_username_list_better, get_player_game_count
+from chessproc.activity import activity_grid
+from chessproc.dfproc import sort_by_start_time, stratified_sample
+from chessproc.openingtree import parse_moves
+from chessproc.positions import games_reaching
+from chessproc.session import load_session, save_session
+from chessproc.timecontrol import time_classes
+from chessproc.pgnproc import game_pgn, global_pgn_directory, IngestCancelled, get_cube_by_username, get_opponents_by_username, get_parquet_by_username, get_tree_by_username, get_player_game_count, ingest_by_username
 
 def update_game_count(method):
     """Decorator for all ChessPlot methods that update the data filters, applies filters and updates counts"""
@@ -36,6 +44,9 @@ class ChessPlotterModel:
         self.opening_is_whitelist = True
         self.opening: List[str] = []
         self.number_items: int = 6
+        self.moves: List[str] = []
+        self.date_range: Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]] = (None, None)
+        self.time_class: Optional[int] = None
         self.valid_usernames = set() 
 
         # Usernames hold usernames, data holds the dataframe of the current user, plot holds the plot
@@ -44,6 +55,31 @@ class ChessPlotterModel:
         self.data: Optional[pd.DataFrame] = None
         self.filtered_data: Optional[pd.DataFrame] = None
 
+        # Start times of the games in data, data is kept sorted by them so date ranges are binary searched
+        self.timestamps: Optional[np.ndarray] = None
+
+        # Sorted positions in data of the games of each time class, sliced by the date range positions
+        self.time_class_positions: Dict[int, np.ndarray] = {}
+
+        # Cube of game counts of the current user, filtered alongside the data when the filters allow
+        self.cube: Optional[pd.DataFrame] = None
+        self.filtered_cube: Optional[pd.DataFrame] = None
+
+        # Opening tree of the current user, filtered by colour when the filters allow
+        self.tree: Optional[pd.DataFrame] = None
+        self.filtered_tree: Optional[pd.DataFrame] = None
+
+        # Games, scores and last game against each opponent of the current user, most played first
+        self.opponent_index: Optional[pd.DataFrame] = None
+
+        # Hour by weekday grids of the filtered games, by filter state, cleared when the data changes
+        self.activity_cache: Dict[tuple, pd.DataFrame] = {}
+
+        # Interactive plots are drawn from a stratified sample of at most sample_size games when set, saved plots from all games
+        self.sample_size: Optional[int] = None
+        self.sample_cache: Dict[tuple, pd.DataFrame] = {}
+        self.plot_selection: Optional[str] = None
+
         # Game counting
         self.data_count: Optional[int] = None
         self.filtered_data_count: Optional[int] = None
@@ -53,14 +89,21 @@ class ChessPlotterModel:
         self.plot: Optional[gg.ggplot] = None # Potentially set up spash screen?
         self.figure: Optional[Figure] = None
     
+    def list_usernames(self) -> List[str]:
+        """Usernames with a parquet file"""
+        return sorted([file[:-8] for file in os.listdir(self.filepath) if file.endswith('.parquet')])
+
     def init_usernames(self) -> List:
         """Try to read parquet files, if nothing then do nothing, return nothing"""
         # If there are parquet files, initialize username list, username, data, filtered data, and counts
-        if len([file for file in os.listdir(self.filepath) if file.endswith('.parquet')]):
-            available_usernames = sorted([file[:-8] for file in os.listdir(self.filepath) if file.endswith('.parquet')])
+        if len(self.list_usernames()):
+            available_usernames = self.list_usernames()
             self.username_list = available_usernames
             self.username = self.username_list[0]
-            self.data = get_parquet_by_username(self.username)
+            self.set_data(get_parquet_by_username(self.username))
+            self.cube = get_cube_by_username(self.username, self.data)
+            self.tree = get_tree_by_username(self.username, self.data)
+            self.opponent_index = get_opponents_by_username(self.username, self.data)
             self.filtered_data = self.data
             self.apply_filters()
             self.data_count = len(self.data)
@@ -74,8 +117,9 @@ class ChessPlotterModel:
         # Get the new plot, save and convert to figure
         # self.plot = self.plotter(combo_input, self.filtered_data, self.username, self.colour, self.remove, self.opening, self.number_items)
         # self.figure = self.plot.draw()
+        self.plot_selection = combo_input
         try:
-            self.plot = self.plotter(combo_input, self.filtered_data, self.username, self.colour, self.opponents, self.opening, self.number_items)
+            self.plot = self.draw_plot(combo_input, self.sampled_data())
             self.figure = self.plot.draw()
         except:
             logging.warning("Error generating plot, error plot shown.")
@@ -85,6 +129,11 @@ class ChessPlotterModel:
         # return the figure to the controller for display to the view
         return self.figure
     
+    def draw_plot(self, combo_input: str, game_data: pd.DataFrame) -> gg.ggplot:
+        """Call the plotter with the games and the aggregates of the filtered games"""
+        activity = self.filtered_activity() if combo_input in self.plotter.activity_plots else None
+        return self.plotter(combo_input, game_data, self.username, self.colour, self.opponents, self.opening, self.number_items, cube=self.filtered_cube, tree=self.filtered_tree, moves=self.moves, activity=activity)
+
     def get_plot_list(self):
         """Update plot list with available plots"""
         return self.plotter.plots.keys()
@@ -138,41 +187,218 @@ class ChessPlotterModel:
             self.number_items = line_input
         logging.warning(f"Number updated to {self.number_items} with input {line_input}.")
 
+    @update_game_count
+    def set_date_range(self, start_input, end_input):
+        self.date_range = (self.parse_date(start_input), self.parse_date(end_input))
+        logging.warning(f"Date range updated to {self.date_range} with input {start_input} - {end_input}.")
+
+    @update_game_count
+    def set_time_class(self, idx):
+        self.time_class = None if idx == 0 else idx - 1
+        logging.warning(f"Time class updated to {self.time_class} with index {idx}.")
+
+    @staticmethod
+    def parse_date(line_input: str) -> Optional[pd.Timestamp]:
+        """Read a date from the view, None for an empty or unreadable date"""
+        if line_input.strip() == "":
+            return None
+        try:
+            return pd.Timestamp(line_input.strip())
+        except ValueError:
+            logging.warning(f"Could not read date {line_input}, ignored.")
+            return None
+
+    @update_game_count
+    def set_sample_size(self, line_input):
+        self.sample_size = int(line_input) if line_input.strip().isdigit() and int(line_input) > 0 else None
+        logging.warning(f"Sample size updated to {self.sample_size} with input {line_input}.")
+
+    def set_moves(self, line_input):
+        self.moves = parse_moves(line_input)
+        logging.warning(f"Moves updated to {self.moves} with input {line_input}.")
+
+    def set_data(self, data: pd.DataFrame):
+        """Keep the games sorted by start time, with the positions of the games of each time class, for the indexed filters"""
+        self.data, self.timestamps = sort_by_start_time(data)
+        self.activity_cache = {}
+        self.sample_cache = {}
+        time_class = self.data["time_class"].to_numpy()
+        self.time_class_positions = {code: np.flatnonzero(time_class == code) for code in range(len(time_classes))}
+
     def update_game_dataframe(self):
         """Load a different parquet file as view is updated"""
         logging.warning(f"Username changed to {self.username}.")
-        self.data = get_parquet_by_username(self.username)
+        self.set_data(get_parquet_by_username(self.username))
+        self.cube = get_cube_by_username(self.username, self.data)
+        self.tree = get_tree_by_username(self.username, self.data)
+        self.opponent_index = get_opponents_by_username(self.username, self.data)
         logging.warning(f"Data updated: {self.data['Black'].value_counts().keys()[0]}")
     
-    def apply_filters(self):
-        """Apply selection filters to the raw dataframe"""
-        # Filter by colour
-        if not self.colour[0]:
-            self.filtered_data = self.data.query('player_colour == @self.colour[1]')
+    def apply_filters(self, positions: Optional[np.ndarray] = None):
+        """Apply selection filters to the raw dataframe, and to the cube when there is no opponent or date filter(the cube does not hold opponents or days).
+
+        Positions of the filtered games in the data, saved with a session for the same filters, are used instead of filtering the games again.
+        """
+        if positions is not None:
+            self.filtered_data = self.data.iloc[positions]
         else:
-            self.filtered_data = self.data
+            # Filter by date range and time class then colour
+            self.filtered_data = self.filter_colour_opening(self.filter_indexed(), opening=False)
 
-        logging.warning(f"After colour: {len(self.filtered_data)}")
+            logging.warning(f"After colour: {len(self.filtered_data)}")
 
-        # Select by username white/blacklist
-        if (len(self.opponents) > 0 and len(self.opponents[0]) > 0):
-            if self.opponents_is_whitelist:
-                self.filtered_data = self.filtered_data.query("(White in @self.opponents) | (Black in @self.opponents)")
-            else:
-                self.filtered_data = self.filtered_data.query("White not in @self.opponents & Black not in @self.opponents")
+            # Select by username white/blacklist
+            if (len(self.opponents) > 0 and len(self.opponents[0]) > 0):
+                if self.opponents_is_whitelist:
+                    self.filtered_data = self.filtered_data.query("(White in @self.opponents) | (Black in @self.opponents)")
+                else:
+                    self.filtered_data = self.filtered_data.query("White not in @self.opponents & Black not in @self.opponents")
+
+            logging.warning(f"After opponents: {len(self.filtered_data)}")
+
+            # Select by ECO white/blacklist
+            self.filtered_data = self.filter_colour_opening(self.filtered_data, colour=False)
+
+            logging.warning(f"After opening: {len(self.filtered_data)}")
+
+        date_filtered = self.date_range != (None, None)
+        if self.cube is not None and not date_filtered and not (len(self.opponents) > 0 and len(self.opponents[0]) > 0):
+            self.filtered_cube = self.filter_colour_opening(self.cube)
+            if self.time_class is not None:
+                self.filtered_cube = self.filtered_cube[self.filtered_cube.time_class == self.time_class]
+        else:
+            self.filtered_cube = None
+
+        # The tree only holds colours, with date, time class, opponent or opening filters the explorer builds a tree of the filtered games
+        if self.tree is not None and not date_filtered and self.time_class is None and not (len(self.opponents) > 0 and len(self.opponents[0]) > 0) and not (len(self.opening) > 0 and len(self.opening[0]) > 0):
+            self.filtered_tree = self.filter_colour_opening(self.tree, opening=False)
+        else:
+            self.filtered_tree = None
+
+        # TODO: Add filter for number of items, could require more thought
+
+    def filter_indexed(self) -> pd.DataFrame:
+        """Slice the games in the date range and time class out of the sorted data by binary search, the end date is included.
+
+        The date range is found on the start times, the games of the time class within it on the positions of the time class.
+        """
+        start, end = self.date_range
+        if start is None and end is None and self.time_class is None:
+            return self.data
+        start_idx = 0 if start is None else np.searchsorted(self.timestamps, np.datetime64(start, "ns"), side="left")
+        end_idx = len(self.data) if end is None else np.searchsorted(self.timestamps, np.datetime64(end + pd.Timedelta(days=1), "ns"), side="left")
+        if self.time_class is None:
+            return self.data.iloc[start_idx:end_idx]
+
+        positions = self.time_class_positions[self.time_class]
+        return self.data.iloc[positions[np.searchsorted(positions, start_idx):np.searchsorted(positions, end_idx)]]
+
+    def filter_state(self) -> tuple:
+        """Key of the current filters, equal keys select the same games"""
+        return (self.username, self.colour, self.date_range, self.time_class, self.opponents_is_whitelist, tuple(self.opponents), self.opening_is_whitelist, tuple(self.opening))
 
-        logging.warning(f"After opponents: {len(self.filtered_data)}")
+    @staticmethod
+    def cached(cache: Dict[tuple, pd.DataFrame], key: tuple, build: Callable[[], pd.DataFrame], cache_size: int = 32) -> pd.DataFrame:
+        """Return the cached frame for the key, building it and dropping the oldest entry of a full cache if missing"""
+        if key not in cache:
+            if len(cache) >= cache_size:
+                del cache[next(iter(cache))]
+            cache[key] = build()
+        return cache[key]
 
-        # Select by ECO white/blacklist
-        if (len(self.opening) > 0 and len(self.opening[0]) > 0):
+    def filtered_activity(self) -> pd.DataFrame:
+        """Return the hour by weekday grid of the filtered games, computed once per filter state"""
+        return self.cached(self.activity_cache, self.filter_state(), lambda: activity_grid(self.filtered_data))
+
+    def sampled_data(self) -> pd.DataFrame:
+        """Return the stratified sample of the filtered games drawn once per filter state and size, the filtered games when sampling is off or they fit"""
+        if self.sample_size is None or len(self.filtered_data) <= self.sample_size:
+            return self.filtered_data
+        return self.cached(self.sample_cache, (*self.filter_state(), self.sample_size), lambda: stratified_sample(self.filtered_data, self.sample_size))
+
+    def filter_colour_opening(self, frame: pd.DataFrame, colour: bool = True, opening: bool = True) -> pd.DataFrame:
+        """Apply the colour and ECO white/blacklist filters to the games or the cube"""
+        if colour and not self.colour[0]:
+            frame = frame[frame.player_is_white == (self.colour[1] == "White")]
+
+        if opening and (len(self.opening) > 0 and len(self.opening[0]) > 0):
             if self.opening_is_whitelist:
-                self.filtered_data = self.filtered_data.query('ECO in @self.opening')
+                frame = frame[frame.ECO.isin(self.opening)]
             else:
-                self.filtered_data = self.filtered_data.query('ECO not in @self.opening')
+                frame = frame[~frame.ECO.isin(self.opening)]
 
-        logging.warning(f"After opening: {len(self.filtered_data)}")
+        return frame
 
-        # TODO: Add filter for number of items, could require more thought
+    def game_pgn(self, game_id: int) -> Optional[str]:
+        """Read the pgn of a filtered game of the current user, None if it cannot be read"""
+        try:
+            return game_pgn(self.filtered_data, game_id)
+        except:
+            logging.warning(f"Error reading pgn of game {game_id}.")
+            return None
+
+    def session_state(self) -> Dict:
+        """Selected user, filters and plot choice, as written to the session file"""
+        return {"username": self.username, "colour": list(self.colour), "time_class": self.time_class,
+                "date_range": [None if date is None else date.isoformat() for date in self.date_range],
+                "opponents": self.opponents, "opponents_is_whitelist": self.opponents_is_whitelist,
+                "opening": self.opening, "opening_is_whitelist": self.opening_is_whitelist,
+                "number_items": str(self.number_items), "moves": self.moves, "sample_size": self.sample_size, "plot_selection": self.plot_selection}
+
+    def save_session(self):
+        """Save the session state with the shown figure and the positions of the filtered games, nothing is saved before a user is loaded"""
+        if self.username is None or self.data is None or self.filtered_data is None:
+            return
+        try:
+            positions = self.data.index.get_indexer(self.filtered_data.index)
+            save_session(self.session_state(), self.figure, positions, self.filepath)
+            logging.warning(f"Session of {self.username} saved.")
+        except:
+            logging.warning("Error saving session, session not saved.")
+
+    def load_session(self) -> Optional[Dict]:
+        """Read the last session, None if there is none to resume"""
+        session = load_session(self.filepath)
+        if session is not None and session["username"] not in self.list_usernames():
+            return None
+        return session
+
+    def restore_session(self, session: Dict) -> bool:
+        """Set the user and filters of the session and read its games, the saved positions stand in for filtering when they fit the games"""
+        try:
+            self.username_list = self.list_usernames()
+            self.username = session["username"]
+            self.colour = tuple(session["colour"])
+            self.time_class = session["time_class"]
+            self.date_range = tuple(None if date is None else pd.Timestamp(date) for date in session["date_range"])
+            self.opponents, self.opponents_is_whitelist = session["opponents"], session["opponents_is_whitelist"]
+            self.opening, self.opening_is_whitelist = session["opening"], session["opening_is_whitelist"]
+            self.number_items = session["number_items"]
+            self.moves = session["moves"]
+            self.sample_size = session["sample_size"]
+            self.plot_selection = session["plot_selection"]
+
+            self.update_game_dataframe()
+            positions = session["positions"]
+            if positions is not None and len(positions) and (positions.min() < 0 or positions.max() >= len(self.data)):
+                positions = None
+            self.apply_filters(positions=positions)
+            self.update_game_dataframe_count()
+            self.update_filtered_game_dataframe_count()
+            return True
+        except:
+            logging.warning("Error restoring session.")
+            return False
+
+    def opponent_names(self) -> List[str]:
+        """Names of the opponents of the current user sorted case insensitively, for completion"""
+        if self.opponent_index is None:
+            return []
+        return sorted(self.opponent_index.index, key=str.lower)
+
+    def games_reaching(self, fen: str) -> pd.DataFrame:
+        """Return the filtered games of the current user that reached the position given as FEN, with the ply it was reached at"""
+        return games_reaching(self.username, fen, global_pgn_directory, game_data=self.filtered_data)
 
     def update_game_dataframe_count(self):
         """Update game count for the unfiltered dataframe"""
@@ -180,15 +406,33 @@ class ChessPlotterModel:
         return self.data_count
 
     
+    def update_sample_count(self) -> Optional[int]:
+        """Number of games in the sample the plots are drawn from, None when they are drawn from all filtered games"""
+        sampled_data = self.sampled_data()
+        return None if sampled_data is self.filtered_data else len(sampled_data)
+
     def update_filtered_game_dataframe_count(self):
         """Update the game count for the filtered dataframe"""
         self.filtered_data_count = len(self.filtered_data)
         return self.filtered_data_count
     
+    def refresh_user_parquet(self, username: str, progress: Optional[Callable[[str], None]] = None, cancel: Optional[Event] = None) -> bool:
+        """Make requests for archives and upsert the downloaded months into the parquet file, does not touch the loaded data so it can run in a worker thread"""
+        try:
+            # A scheduled refresh of the same username finishes first, the ingest holds the lock of the username
+            ingest_by_username(username=username, progress=progress, cancel=cancel)
+            logging.warning(f"Data refreshed for {username}")
+            return True
+        except IngestCancelled:
+            logging.warning(f"Refresh cancelled for {username}")
+            return False
+        except:
+            logging.warning(f"Data NOT refreshed for {username}")
+            return False
+
     @update_game_count
-    def refresh_user_parquet(self):
-        """Make requests for archives, update parquet file and dataframe"""
-        download_by_username_list_better([self.username])
+    def reload_game_dataframe(self):
+        """Reload the dataframe of the current user after its parquet file was updated"""
         self.update_game_dataframe()
     
     def check_username(self, username: str) -> str:
@@ -207,36 +451,35 @@ class ChessPlotterModel:
         """A check if the username given is in the valid username list"""
         return username in self.valid_usernames
     
-    def download_by_username(self, username: str) -> bool:
-        """Download the pgns for the given username"""
+    def ingest_by_username(self, username: str, progress: Optional[Callable[[str], None]] = None, cancel: Optional[Event] = None) -> bool:
+        """Download the pgns for the given username and construct its parquet, parsing each month as it is downloaded"""
         try:
-            download_by_username_list_better(usernames=[username])
-            logging.warning(f"Data downloaded for {username}")
+            ingest_by_username(username=username, progress=progress, cancel=cancel)
+            logging.warning(f"Data ingested for {username}")
             return True
-        except:
-            logging.warning(f"Data NOT downloaded for {username}")
+        except IngestCancelled:
+            logging.warning(f"Ingest cancelled for {username}")
             return False
-    
-    def create_parquet(self, username: str) -> bool:
-        """Construct parquet for given username"""
-        try:
-            construct_parquet_by_username(username=username)
-            logging.warning(f"Constructed parquet for {username}")
-            return True
         except:
-            logging.warning(f"Error constructing parquet for {username}")
+            logging.warning(f"Data NOT ingested for {username}")
             return False
-    
+
     def save_figure(self, selected_filename):
-        """Given filename selected in view QFileDialog, save figure as png"""
+        """Given filename selected in view QFileDialog, save figure as png, a plot drawn from a sample or shown from a session image is drawn from all filtered games"""
+        plot = self.plot
+        if self.plot_selection is not None and (plot is None or self.sampled_data() is not self.filtered_data):
+            try:
+                plot = self.draw_plot(self.plot_selection, self.filtered_data)
+            except:
+                logging.warning("Error drawing plot from all games, sampled plot saved.")
         save_filepath = self.filepath + "../plots/"
         filename = save_filepath + self.username + "---" + datetime.now().isoformat() + ".png"
         try:
-            self.plot.save(filename=selected_filename, format="png", width=20, height=10)
+            plot.save(filename=selected_filename, format="png", width=20, height=10)
             logging.warning("Plot saved with selected filename.")
         except:
             try:
-                self.plot.save(filename=filename, format="png", width=20, height=10)
+                plot.save(filename=filename, format="png", width=20, height=10)
                 logging.warning("Plot saved with default filename.")
             except:
                 logging.warning("Plot not saved, error saving.")
@@ -5,6 +5,8 @@ import sys
 import matplotlib
 matplotlib.use('Qt5Agg')
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from matplotlib.figure import Figure
+import matplotlib.image as mpimg
 import numpy as np
 import pandas as pd
 import plotnine as gg
@@ -22,6 +24,11 @@ from PyQt6.QtWidgets import (
     QPushButton,
     QComboBox,
     QFileDialog,
+    QDockWidget,
+    QTableView,
+    QHeaderView,
+    QPlainTextEdit,
+    QCompleter,
 )
 
 from chessproc.ChessPlotterColourScheme import ChessPlotterColourScheme as cpcs
@@ -71,12 +78,18 @@ class ChessPlotterView(QMainWindow):
         # Create the plot area
         self.add_canvas()
 
+        # Create the game browser, hidden until opened
+        self.add_game_browser()
+
         # Set up the add user dialog
         self.adduser = AddUserPopUp(self)
 
         # Set up the filesave dialog
         self.file_save = FileSaveDialog(self)
 
+        # Status bar for download and processing progress
+        self.statusBar().setStyleSheet(f"color: {cpcs.white}")
+
         # Show all the widgets
         self.show()
     
@@ -90,18 +103,21 @@ class ChessPlotterView(QMainWindow):
         self.username_input = QComboBox()
         self.username_refresh = QPushButton("&Refresh")
         self.add_dialog = QPushButton("&Add")
+        self.show_games = QPushButton("&Games")
         self.game_count_label = QLabel()
 
         # Set dimensions of controls
         self.username_input.setFixedSize(COMBO_WIDTH, COMBO_HEIGHT)
         self.username_refresh.setFixedSize(BUTTON_WIDTH, BUTTON_HEIGHT)
         self.add_dialog.setFixedSize(BUTTON_WIDTH, BUTTON_HEIGHT)
+        self.show_games.setFixedSize(BUTTON_WIDTH, BUTTON_HEIGHT)
         self.game_count_label.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
 
         # Add controls to layout
         self.userLayout.addWidget(self.username_input)
         self.userLayout.addWidget(self.username_refresh)
         self.userLayout.addWidget(self.add_dialog)
+        self.userLayout.addWidget(self.show_games)
         self.userLayout.addWidget(self.game_count_label)
 
     def add_plot_inputs(self):
@@ -113,12 +129,17 @@ class ChessPlotterView(QMainWindow):
         self.player_colour_select = QComboBox()
         self.player_colour_select.addItems(["White and Black", "White", "Black"])
         self.player_colour_select.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
+        self.time_class_select = QComboBox()
+        self.time_class_select.addItems(["All Time Classes", "Bullet", "Blitz", "Rapid", "Daily"])
+        self.time_class_select.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
         self.opponents_combo = QComboBox()
         self.opponents_combo.setFixedSize(GAMES_WIDTH + 20, BUTTON_HEIGHT)
         self.opponents_combo.addItems(["Opponent Whitelist", "Opponent Blacklist"])
         self.opponents_combo.setCurrentIndex(1)
         self.opponents = QLineEdit()
         self.opponents.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
+        self.opponent_completer = OpponentCompleter(self.opponents)
+        self.opponents.setCompleter(self.opponent_completer)
         # self.remove_opponents.setPlaceholderText("MagnusCarlsen FabianoCaruana ...")
         self.opening_select_combo = QComboBox()
         self.opening_select_combo.setFixedSize(GAMES_WIDTH + 20, BUTTON_HEIGHT)
@@ -129,12 +150,32 @@ class ChessPlotterView(QMainWindow):
         # self.opening_select.setPlaceholderText("B10 D00 ...")
         self.number_select = QLineEdit("6")
         self.number_select.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
+        self.moves_select = QLineEdit()
+        self.moves_select.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
+        self.moves_select.setPlaceholderText("1.e4 c5 2.Nf3")
+        self.date_from = QLineEdit()
+        self.date_from.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
+        self.date_from.setPlaceholderText("2020-01-01")
+        self.date_to = QLineEdit()
+        self.date_to.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
+        self.date_to.setPlaceholderText("2020-12-31")
+        self.date_layout = QHBoxLayout()
+        self.date_layout.addWidget(self.date_from)
+        self.date_layout.addWidget(self.date_to)
+        self.date_layout.addStretch()
+        self.sample_size_select = QLineEdit()
+        self.sample_size_select.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
+        self.sample_size_select.setPlaceholderText("Off")
 
         # Add controls to layout
         self.plot_inputs_layout.addRow("Colour:", self.player_colour_select)
+        self.plot_inputs_layout.addRow("Time Class:", self.time_class_select)
         self.plot_inputs_layout.addRow(self.opponents_combo, self.opponents)
         self.plot_inputs_layout.addRow(self.opening_select_combo, self.opening_select)
         self.plot_inputs_layout.addRow("Number of Items:", self.number_select)
+        self.plot_inputs_layout.addRow("Moves:", self.moves_select)
+        self.plot_inputs_layout.addRow("Dates:", self.date_layout)
+        self.plot_inputs_layout.addRow("Sample Size:", self.sample_size_select)
 
     def add_plot_select(self):
         # Set up layout
@@ -146,19 +187,49 @@ class ChessPlotterView(QMainWindow):
         self.generate_plot = QPushButton("Plot")
         self.save_plot = QPushButton("Save")
         self.filtered_game_count_label = QLabel()
+        self.sample_count_label = QLabel()
 
         # Set dimensions of controls
         self.plot_select.setFixedSize(COMBO_WIDTH, COMBO_HEIGHT)
         self.generate_plot.setFixedSize(BUTTON_WIDTH, BUTTON_HEIGHT)
         self.save_plot.setFixedSize(BUTTON_WIDTH, BUTTON_HEIGHT)
         self.filtered_game_count_label.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
+        self.sample_count_label.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
 
         # Add controls to layout
         self.plot_select_layout.addWidget(self.plot_select)
         self.plot_select_layout.addWidget(self.generate_plot)
         self.plot_select_layout.addWidget(self.save_plot)
         self.plot_select_layout.addWidget(self.filtered_game_count_label)
+        self.plot_select_layout.addWidget(self.sample_count_label)
     
+    def add_game_browser(self):
+        """Create the game browser panel, a table of the filtered games above the pgn of the selected game"""
+        self.game_browser = QDockWidget("Games", self)
+        self.game_browser.setAllowedAreas(Qt.Qt.DockWidgetArea.RightDockWidgetArea | Qt.Qt.DockWidgetArea.BottomDockWidgetArea)
+        browser = QWidget()
+        browser_layout = QVBoxLayout()
+        browser.setLayout(browser_layout)
+
+        # Create controls, rows have a fixed height so the table never measures rows it does not show
+        self.game_table = QTableView()
+        self.game_table.setSortingEnabled(True)
+        self.game_table.horizontalHeader().setSortIndicator(-1, Qt.Qt.SortOrder.AscendingOrder)
+        self.game_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.game_table.setSelectionMode(QTableView.SelectionMode.SingleSelection)
+        self.game_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.game_table.verticalHeader().setDefaultSectionSize(BUTTON_HEIGHT - 8)
+        self.game_pgn = QPlainTextEdit()
+        self.game_pgn.setReadOnly(True)
+        self.game_pgn.setPlaceholderText("Double click a game to show its pgn")
+
+        # Add controls to layout
+        browser_layout.addWidget(self.game_table, stretch=3)
+        browser_layout.addWidget(self.game_pgn, stretch=1)
+        self.game_browser.setWidget(browser)
+        self.addDockWidget(Qt.Qt.DockWidgetArea.RightDockWidgetArea, self.game_browser)
+        self.game_browser.hide()
+
     def add_canvas(self, fig = None):
         # Make placeholder figure
         if fig is None:
@@ -171,11 +242,47 @@ class ChessPlotterView(QMainWindow):
         self.canvas = FigureCanvasQTAgg(fig)
         self.centralLayout.addWidget(self.canvas)
 
+    def add_image(self, filepath: str):
+        """Show a saved plot image on the canvas, until a plot is drawn"""
+        fig = Figure(facecolor=cpcs.background)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.imshow(mpimg.imread(filepath))
+        ax.set_axis_off()
+        self.add_canvas(fig)
+
     def popup(self):
         wind = AddUserPopUp(self)
         wind.exec()
 
 
+class OpponentCompleter(QCompleter):
+
+    """
+    Completes the last name of the space separated opponent list from the opponents of the current user.
+
+    Names are given sorted case insensitively so completion is a binary search, however many opponents there are.
+    """
+
+    def __init__(self, parent) -> None:
+        super().__init__(parent)
+        self.setModel(Qt.QStringListModel(self))
+        self.setCaseSensitivity(Qt.Qt.CaseSensitivity.CaseInsensitive)
+        self.setModelSorting(QCompleter.ModelSorting.CaseInsensitivelySortedModel)
+        self.setMaxVisibleItems(10)
+
+    def set_names(self, names) -> None:
+        self.model().setStringList(names)
+
+    def splitPath(self, path: str):
+        """Complete only the last name of the list"""
+        return [path.split(' ')[-1]]
+
+    def pathFromIndex(self, index) -> str:
+        """Replace the last name of the list with the completion"""
+        names = self.widget().text().split(' ')[:-1]
+        return " ".join(names + [super().pathFromIndex(index)])
+
+
 class AddUserPopUp(QDialog):
 
     """
@@ -197,6 +304,9 @@ class AddUserPopUp(QDialog):
         self.username_data.setFixedSize(GAMES_WIDTH, BUTTON_HEIGHT)
         self.username_add = QPushButton("Add")
         self.username_add.setFixedSize(BUTTON_WIDTH, BUTTON_HEIGHT)
+        self.username_cancel = QPushButton("Cancel")
+        self.username_cancel.setFixedSize(BUTTON_WIDTH, BUTTON_HEIGHT)
+        self.username_cancel.setEnabled(False)
 
         # Set up layouts
         self.popup_layout = QVBoxLayout()
@@ -209,6 +319,7 @@ class AddUserPopUp(QDialog):
         self.check_layout.addWidget(self.username_check)
         self.add_layout.addWidget(self.username_data)
         self.add_layout.addWidget(self.username_add)
+        self.add_layout.addWidget(self.username_cancel)
         self.setLayout(self.popup_layout)
     
 
@@ -0,0 +1,48 @@
+
+from threading import Event
+from typing import Callable
+
+from PyQt6.QtCore import QObject, QThread, pyqtSignal
+
+
+class ChessPlotterNotifier(QObject):
+
+    """
+    Carries the usernames refreshed by the background scheduler to the GUI thread, the signal is emitted from any thread.
+    """
+
+    refreshed = pyqtSignal(str)
+
+
+class ChessPlotterWorker(QObject):
+
+    """
+    Runs a long model task(download, parquet construction) for a username on its own thread.
+
+    The task is called with the username, a progress callback and a cancel event and returns whether it succeeded.
+    Progress and the result are sent back to the GUI thread through signals carrying the username.
+    """
+
+    progress = pyqtSignal(str, str)
+    finished = pyqtSignal(str, bool)
+
+    def __init__(self, username: str, task: Callable[[str, Callable[[str], None], Event], bool]) -> None:
+        super().__init__()
+        self.username = username
+        self.task = task
+        self.cancel = Event()
+
+        # Move to a thread of its own, the thread stops once the task has finished
+        self.worker_thread = QThread()
+        self.moveToThread(self.worker_thread)
+        self.worker_thread.started.connect(self.run)
+        self.finished.connect(self.worker_thread.quit)
+
+    def start(self) -> None:
+        """Start the task on the worker thread"""
+        self.worker_thread.start()
+
+    def run(self) -> None:
+        """Run the task, emitting progress messages as they are reported"""
+        success = self.task(self.username, lambda message: self.progress.emit(self.username, message), self.cancel)
+        self.finished.emit(self.username, success)
@@ -0,0 +1,209 @@
+# Headless HTTP server for the plots, for dashboards requesting plots of many users at once
+#
+# Usage: python src/ChessServer.py [--port 8080] [--workers 4] [--pgn-directory pgns/]
+#
+# Endpoints, the filters are query parameters named like the view controls:
+#   GET /plots                  names of the plots
+#   GET /users                  usernames with a parquet file
+#   GET /plot/<username>        plot as png or svg, ?plot=Top Openings&format=svg&colour=white&time_class=blitz...
+#   GET /data/<username>        table the plot is drawn from as JSON, same parameters
+#
+# Plots are drawn in a bounded pool of worker processes, each keeping the games of the users it has drawn in memory.
+# Responses are cached by an ETag made of the request and the parquet file of the user, a request for an ETag being
+# drawn waits for that drawing, and a request with a matching If-None-Match is answered without drawing.  A failed
+# drawing is answered with a 500 and not cached.  Workers loading a user whose files need rebuilding or upgrading
+# take the lock of the user(locks.user_lock), so the first one writes them and the others read the result.
+
+import argparse
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+from io import BytesIO
+import logging
+import os
+import re
+import sys
+from typing import Dict, List, Tuple
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from aiohttp import web
+
+from chessproc.ChessPlots import ChessPlots
+from chessproc.pgnproc import get_cube_by_username, get_parquet_by_username, get_tree_by_username, global_pgn_directory
+from chessproc.timecontrol import time_classes
+from ChessPlotterModel import ChessPlotterModel
+
+
+# Logging level
+logging.basicConfig(level=logging.ERROR, format="%(asctime)s - %(levelname)s - %(message)s", datefmt="%H:%M:%S")
+
+# Query parameters taken as filters, anything else is ignored and does not change the ETag
+filter_names = ["colour", "time_class", "from", "to", "opponents", "opponents_mode", "opening", "opening_mode", "number", "moves"]
+content_types = {"png": "image/png", "svg": "image/svg+xml", "json": "application/json"}
+
+# Users kept in memory by each worker process, least recently drawn users are dropped first
+worker_users = 8
+_models: "OrderedDict[str, Tuple[int, ChessPlotterModel]]" = OrderedDict()
+
+
+def parquet_filepath(username: str, base_directory_name: str) -> str:
+    return base_directory_name + username + ".parquet"
+
+
+def load_model(username: str, base_directory_name: str) -> ChessPlotterModel:
+    """Return the model holding the games of the username in this worker, read again when the parquet file changed"""
+    mtime_ns = os.stat(parquet_filepath(username, base_directory_name)).st_mtime_ns
+    if username in _models and _models[username][0] == mtime_ns:
+        _models.move_to_end(username)
+        return _models[username][1]
+
+    model = ChessPlotterModel(plotter=ChessPlots(), filepath=base_directory_name)
+    model.username = username
+    model.set_data(get_parquet_by_username(username, base_directory_name=base_directory_name))
+    model.cube = get_cube_by_username(username, model.data, base_directory_name=base_directory_name)
+    model.tree = get_tree_by_username(username, model.data, base_directory_name=base_directory_name)
+    _models[username] = (mtime_ns, model)
+    _models.move_to_end(username)
+    while len(_models) > worker_users:
+        _models.popitem(last=False)
+
+    return model
+
+
+def apply_query(model: ChessPlotterModel, filters: Dict[str, str]) -> None:
+    """Set every filter of the model from the query filters, filters missing from the query are reset"""
+    model.colour = {"white": (False, "White"), "black": (False, "Black")}.get(filters.get("colour", "").lower(), (True, ""))
+    time_class = filters.get("time_class", "").capitalize()
+    model.time_class = time_classes.index(time_class) if time_class in time_classes else None
+    model.date_range = (model.parse_date(filters.get("from", "")), model.parse_date(filters.get("to", "")))
+    model.opponents = filters.get("opponents", "").split(' ')
+    model.opponents_is_whitelist = filters.get("opponents_mode", "blacklist") == "whitelist"
+    model.opening = filters.get("opening", "").split(' ')
+    model.opening_is_whitelist = filters.get("opening_mode", "whitelist") == "whitelist"
+    model.number_items = filters.get("number", "6") or "6"
+    model.set_moves(filters.get("moves", ""))
+    model.apply_filters()
+
+
+def plot_columns(plot) -> List[str]:
+    """Columns of the plot data used by its aesthetics"""
+    names = set(re.findall(r'[A-Za-z_][A-Za-z0-9_]*', " ".join(str(value) for value in plot.mapping.values())))
+    return [col for col in plot.data.columns if col in names]
+
+
+def render(username: str, plot_name: str, fmt: str, filters: Dict[str, str], base_directory_name: str) -> bytes:
+    """Draw the plot of the username with the filters in a worker process, as png, svg or the plot data as JSON.
+
+    Errors are raised rather than drawn as the error plot of the app, so they are answered with a 500 and never cached.
+    """
+    model = load_model(username, base_directory_name)
+    apply_query(model, filters)
+    plot = model.draw_plot(plot_name, model.filtered_data)
+    if fmt == "json":
+        return plot.data[plot_columns(plot)].to_json(orient="records", date_format="iso").encode()
+    figure = plot.draw()
+    try:
+        buffer = BytesIO()
+        figure.savefig(buffer, format=fmt)
+        return buffer.getvalue()
+    finally:
+        plt.close(figure)
+
+
+class PlotServer:
+
+    """
+    Request handlers, the response cache and the render pool
+    """
+
+    def __init__(self, base_directory_name: str, workers: int, cache_size: int) -> None:
+        self.base_directory_name = base_directory_name
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.plot_names = list(ChessPlots().plots.keys())
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self.pending: Dict[str, asyncio.Future] = {}
+
+    def etag(self, username: str, plot_name: str, fmt: str, filters: Dict[str, str]) -> str:
+        """ETag of the response, changes with the request and with the parquet file of the user"""
+        stat = os.stat(parquet_filepath(username, self.base_directory_name))
+        key = repr((username, plot_name, fmt, sorted(filters.items()), stat.st_mtime_ns, stat.st_size))
+        return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+    async def draw(self, etag: str, username: str, plot_name: str, fmt: str, filters: Dict[str, str]) -> bytes:
+        """Return the cached response or draw it in the pool, concurrent requests for the same ETag share one drawing"""
+        if etag in self.cache:
+            self.cache.move_to_end(etag)
+            return self.cache[etag]
+        if etag not in self.pending:
+            loop = asyncio.get_running_loop()
+            self.pending[etag] = loop.run_in_executor(self.pool, render, username, plot_name, fmt, filters, self.base_directory_name)
+        try:
+            body = await asyncio.shield(self.pending[etag])
+        finally:
+            self.pending.pop(etag, None)
+
+        self.cache[etag] = body
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return body
+
+    async def respond(self, request: web.Request, fmt: str) -> web.Response:
+        username = request.match_info["username"]
+        plot_name = request.query.get("plot", self.plot_names[0])
+        if plot_name not in self.plot_names:
+            raise web.HTTPNotFound(text=f"Unknown plot {plot_name}")
+        if fmt not in content_types:
+            raise web.HTTPBadRequest(text=f"Unknown format {fmt}")
+        if not os.path.isfile(parquet_filepath(username, self.base_directory_name)):
+            raise web.HTTPNotFound(text=f"No games for {username}")
+
+        filters = {name: request.query[name] for name in filter_names if name in request.query}
+        etag = self.etag(username, plot_name, fmt, filters)
+        if etag in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers={"ETag": etag})
+
+        body = await self.draw(etag, username, plot_name, fmt, filters)
+        return web.Response(body=body, content_type=content_types[fmt], headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    async def plot(self, request: web.Request) -> web.Response:
+        return await self.respond(request, request.query.get("format", "png"))
+
+    async def data(self, request: web.Request) -> web.Response:
+        return await self.respond(request, "json")
+
+    async def plots(self, request: web.Request) -> web.Response:
+        return web.json_response(self.plot_names)
+
+    async def users(self, request: web.Request) -> web.Response:
+        return web.json_response(sorted([file[:-8] for file in os.listdir(self.base_directory_name) if file.endswith('.parquet')]))
+
+    async def close(self, app: web.Application) -> None:
+        self.pool.shutdown(cancel_futures=True)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([web.get("/plots", self.plots),
+                        web.get("/users", self.users),
+                        web.get("/plot/{username}", self.plot),
+                        web.get("/data/{username}", self.data)])
+        app.on_cleanup.append(self.close)
+        return app
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve the plots of the stored users over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--pgn-directory", default=global_pgn_directory, help="Directory for the pgn and parquet files")
+    parser.add_argument("--workers", type=int, default=4, help="Number of processes drawing plots")
+    parser.add_argument("--cache-size", type=int, default=512, help="Number of responses kept in memory")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    web.run_app(PlotServer(args.pgn_directory, workers=args.workers, cache_size=args.cache_size).app(), host=args.host, port=args.port)
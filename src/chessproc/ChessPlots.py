@@ -1,12 +1,19 @@
 
 from functools import partialmethod
 import logging
-from typing import List
+from typing import List, Optional
 
+import numpy as np
 import pandas as pd
 import plotnine as gg
 
+from .activity import activity_grid
 from .ChessPlotterColourScheme import ChessPlotterColourScheme as cpcs
+from .clocks import time_by_move, time_by_phase, time_trouble_results, time_trouble_seconds
+from .cube import elo_bin_width, elo_bins
+from .dfproc import start_times
+from .openingtree import build_tree, format_moves, next_moves
+from .opponents import opponent_names
 from .PlotnineElements import PlotnineElements as pe, blank
 
 
@@ -18,6 +25,10 @@ class ChessPlots:
     There is a single 'public' method __call__ which is to be used by the ChessPlotterModel to generate
     a ggplot object.  Additional plots can be added by including the method which accepts a dataframe and
     adding an entry to the self.plots list.
+
+    Plots listed in self.cube_plots only count games, they are drawn from the cube of game counts when one is given.
+    The opening explorer reads the opening tree when one is given, otherwise it builds the tree of the given games.
+    Plots listed in self.activity_plots draw the hour by weekday grid of the given games, or the grid given as activity.
     """
 
     def __init__(self):
@@ -28,9 +39,22 @@ class ChessPlots:
                  "Top Openings - Fill":             ChessPlots._opening_top_partial_fill,
                  "Single Opening Results":          ChessPlots._opening_single,
                  "Game Termination Type":           ChessPlots._termination_type_partial,
-                 "Game Termination Type - Fill":    ChessPlots._termination_type_partial_fill}
+                 "Game Termination Type - Fill":    ChessPlots._termination_type_partial_fill,
+                 "Opening Explorer":                ChessPlots._opening_explorer,
+                 "Time Used by Move":               ChessPlots._time_by_move,
+                 "Time Trouble Results":            ChessPlots._time_trouble_results,
+                 "Time per Move by Phase":          ChessPlots._time_by_phase,
+                 "Rating History - Day":            ChessPlots._rating_history_day,
+                 "Rating History - Week":           ChessPlots._rating_history_week,
+                 "Rating History - Month":          ChessPlots._rating_history_month,
+                 "Activity - Game Count":           ChessPlots._activity_games,
+                 "Activity - Score":                ChessPlots._activity_score,
+                 "Top Opponents":                   ChessPlots._opponents_top}
+
+        self.activity_plots = {"Activity - Game Count", "Activity - Score"}
+        self.cube_plots = {"ELO Difference Histogram", "Top Openings", "Top Openings - Fill", "Single Opening Results", "Game Termination Type", "Game Termination Type - Fill"}
         
-        self.username = self.colour = self.remove = self.opening = self.number_items = None
+        self.username = self.colour = self.remove = self.opening = self.number_items = self.tree = self.moves = self.activity = None
     
     def __call__(self, plot_selection: str, 
                        game_data: pd.DataFrame, 
@@ -38,16 +62,34 @@ class ChessPlots:
                        colour: tuple[bool, str], 
                        remove: List[str], 
                        opening: List[str], 
-                       number_items: int) -> gg.ggplot:
-        """On call, check which plot has been selected and return the result of the function"""
+                       number_items: int,
+                       cube: Optional[pd.DataFrame] = None,
+                       tree: Optional[pd.DataFrame] = None,
+                       moves: Optional[List[str]] = None,
+                       activity: Optional[pd.DataFrame] = None) -> gg.ggplot:
+        """On call, check which plot has been selected and return the result of the function, drawn from the cube if it is given and the plot allows"""
 
         self.username = username
         self.colour = colour[1]
         self.remove = remove
         self.opening = opening
         self.number_items = number_items
+        self.tree = tree
+        self.moves = moves or []
+        self.activity = activity
 
+        if cube is not None and plot_selection in self.cube_plots:
+            return self.plots[plot_selection](self, cube)
         return self.plots[plot_selection](self, game_data)
+
+    @staticmethod
+    def _counts(game_data: pd.DataFrame, by: List[str]) -> pd.DataFrame:
+        """Count the games by the columns, game_data holds either games or a cube of game counts(with a count column)"""
+        if "count" in game_data:
+            counts = game_data.groupby(by, observed=True)["count"].sum()
+        else:
+            counts = game_data.groupby(by, observed=True).size()
+        return counts.rename("count").reset_index()
     
     def error_plot(self):
         """This plot is just used as a replacement image if there is an error generating the plot."""
@@ -100,9 +142,13 @@ class ChessPlots:
 
     def _elo_difference_histogram(self, game_data: pd.DataFrame) -> gg.ggplot:
         """Plot a histogram of elo difference, coloured by result"""
-        return (gg.ggplot(game_data, gg.aes(x="elo_difference", fill='factor(player_result)')) 
-                    + gg.geom_histogram(colour="gray", binwidth=8)
-                    + gg.scale_fill_manual(values=["black", "lightgray", "white"], name=f"{game_data.Username.iloc[0]} Result", labels=("Loss", "Draw", "Win"))
+        if "elo_bin" not in game_data:
+            game_data = game_data.assign(elo_bin=elo_bins(game_data["elo_difference"]))
+        plot_data = self._counts(game_data, ["elo_bin", "player_result"])
+
+        return (gg.ggplot(plot_data, gg.aes(x="elo_bin", y="count", fill='factor(player_result)')) 
+                    + gg.geom_col(colour="gray", width=elo_bin_width)
+                    + gg.scale_fill_manual(values=["black", "lightgray", "white"], name=f"{self.username} Result", labels=("Loss", "Draw", "Win"))
 
                     + gg.ggtitle("ELO Difference Histogram")
                     + gg.xlab("ELO Difference")
@@ -149,18 +195,15 @@ class ChessPlots:
     def _opening_top(self, game_data: pd.DataFrame, geom_bar_position: str, xlab: str) -> gg.ggplot:
         """Plot stacked horizontal bars for the top n openings for a given colour for a player"""
 
-        # Reorder ECO column by popularity but now considering colour
-        # - Gets the value counts(ordered), gets the index(ECO), as strings to remove existing category
-        plot_data = game_data.copy(deep=True)
-        plot_data['ECO'] = game_data['ECO'].values.reorder_categories(new_categories=game_data['ECO'].value_counts().index.astype(str), ordered=True)
+        # Count games by opening and result, then keep the top 'n' openings ordered by popularity
+        # - The ECO column is made of the top openings as strings to remove the existing categories
+        plot_data = self._counts(game_data, ["ECO", "Result"])
+        top_n_openings = list(plot_data.groupby("ECO", observed=True)["count"].sum().sort_values(ascending=False, kind="stable")[:int(self.number_items)].index.astype(str))
+        plot_data = plot_data[plot_data.ECO.isin(top_n_openings)].copy()
+        plot_data['ECO'] = pd.Categorical(plot_data['ECO'].astype(str), categories=top_n_openings, ordered=True)
 
-        # Filter out all openings not in the top 'n'
-        # This will be limited by the min of the listed openings or number
-        top_n_openings = list(game_data.ECO.value_counts()[:min(len(plot_data.ECO.unique()), int(self.number_items))].keys())
-
-        
-        return (gg.ggplot(plot_data.query('ECO in @top_n_openings'), gg.aes(x='ECO', fill="factor(Result)")) 
-                    + gg.geom_bar(position=geom_bar_position, colour="black")
+        return (gg.ggplot(plot_data, gg.aes(x='ECO', y='count', fill="factor(Result)")) 
+                    + gg.geom_col(position=geom_bar_position, colour="black")
                     + gg.scale_fill_manual(values=["white", "gray", "black"], name="Result", labels=("White", "Draw", "Black"))
                     + gg.coord_flip()
 
@@ -191,25 +234,22 @@ class ChessPlots:
         # - if there is something in eco then apply filter
         # - If eco is empty then fall back to most common
         # - If after filter it the dataframe has no length then fall back to most common
-        plot_data = game_data.copy(deep=True)
-        if len(self.opening) > 0 and len(self.opening[0]) > 0:
-            eco_data = plot_data.query('ECO == @self.opening[0]')
-            if len(eco_data) > 0:
-                plot_data = eco_data
-            else:
-                common = plot_data['ECO'].value_counts().keys()[0]
-                plot_data = plot_data.query('ECO == @common')
+        counts = self._counts(game_data, ["ECO", "player_is_white", "player_result"])
+        eco_counts = counts.groupby("ECO", observed=True)["count"].sum().sort_values(ascending=False, kind="stable")
+        if len(self.opening) > 0 and len(self.opening[0]) > 0 and self.opening[0] in eco_counts.index:
+            opening = self.opening[0]
         else:
-            common = plot_data['ECO'].value_counts().keys()[0]
-            plot_data = plot_data.query('ECO == @common')
+            opening = eco_counts.index[0]
+        plot_data = counts[counts.ECO == opening]
         
         """Plot results of opening(given by ECO) for black and white"""
-        return (gg.ggplot(plot_data, gg.aes('player_colour', fill='factor(player_result)'))
-                + gg.geom_bar(position='stack', colour="black")
-                + gg.scale_fill_manual(values=["black", "lightgray", "white"], name=f"{plot_data.Username.iloc[0]} Result", labels=("Loss", "Draw", "Win"))
+        return (gg.ggplot(plot_data, gg.aes('factor(player_is_white)', y='count', fill='factor(player_result)'))
+                + gg.geom_col(position='stack', colour="black")
+                + gg.scale_fill_manual(values=["black", "lightgray", "white"], name=f"{self.username} Result", labels=("Loss", "Draw", "Win"))
+                + gg.scale_x_discrete(labels=lambda breaks: [cpcs.legend_colour[int(b)] for b in breaks])
                 + gg.coord_flip()
                 
-                + gg.ggtitle(f"Results of Opening {plot_data.ECO.iloc[0]}")
+                + gg.ggtitle(f"Results of Opening {opening}")
                 + gg.xlab("Player Colour")
                 + gg.ylab("Game Count")
 
@@ -227,13 +267,14 @@ class ChessPlots:
 
     def _termination_type(self, game_data: pd.DataFrame, geom_bar_position: str, xlab: str) -> gg.ggplot:
         """Plot of termination type by result for a player"""
-        plot_data = game_data.copy(deep=True)
-        plot_data["Termination"] = plot_data["Termination"].apply(lambda x: x.split(' ', 1)[1])
-        return (gg.ggplot(plot_data, gg.aes('factor(player_result)', fill='Termination')) 
-                    + gg.geom_bar(position=geom_bar_position, alpha=0.6)
+        plot_data = self._counts(game_data, ["player_result", "Termination"])
+        # Chess.com terminations start with the winner or 'Game'('Game drawn by repetition'), other terminations are kept whole
+        plot_data["Termination"] = plot_data["Termination"].astype(str).str.replace(r'^\S+ (?=(?:won|drawn|lost)\b)', '', regex=True)
+        return (gg.ggplot(plot_data, gg.aes('factor(player_result)', y='count', fill='Termination')) 
+                    + gg.geom_col(position=geom_bar_position, alpha=0.6)
                     + gg.coord_flip()
 
-                    + gg.scale_x_discrete(name=f"{plot_data.Username.iloc[0]} Result", labels=["Loss", "Draw", "Win"])
+                    + gg.scale_x_discrete(name=f"{self.username} Result", labels=["Loss", "Draw", "Win"])
                     + gg.scale_fill_manual(values=[*cpcs.colour5, *cpcs.colour4], labels=["Draw - Agreement", "Draw - Insufficient Material", "Draw - Repetition", "Draw - Stalemate", "Draw - Timeout vs. Insufficient Material", "Won - Abandoned", "Won - Checkmate", "Won - Resignation", "Won - Time"])
 
                     + gg.ggtitle("Game Termination Type")
@@ -254,3 +295,202 @@ class ChessPlots:
     # _termination_type partial methods
     _termination_type_partial = partialmethod(_termination_type, geom_bar_position='stack', xlab="Game Count")
     _termination_type_partial_fill = partialmethod(_termination_type, geom_bar_position='fill', xlab="Game Fraction")
+
+    def _opening_explorer(self, game_data: pd.DataFrame) -> gg.ggplot:
+        """Plot stacked horizontal bars of the results of the top n moves played after the move sequence"""
+        tree = self.tree if self.tree is not None else build_tree(game_data, depth=len(self.moves) + 1)
+
+        # Count games by move and result over both colours, then keep the top 'n' moves ordered by popularity
+        plot_data = next_moves(tree, self.moves).groupby(["move", "player_result"])["count"].sum().reset_index()
+        top_n_moves = list(plot_data.groupby("move")["count"].sum().sort_values(ascending=False, kind="stable")[:int(self.number_items)].index)
+        plot_data = plot_data[plot_data.move.isin(top_n_moves)].copy()
+        plot_data["move"] = pd.Categorical(plot_data["move"], categories=top_n_moves, ordered=True)
+
+        return (gg.ggplot(plot_data, gg.aes(x='move', y='count', fill='factor(player_result)'))
+                    + gg.geom_col(position='stack', colour="black")
+                    + gg.scale_fill_manual(values=["black", "lightgray", "white"], name=f"{self.username} Result", labels=("Loss", "Draw", "Win"))
+                    + gg.coord_flip()
+
+                    + gg.ggtitle(f'Moves after {format_moves(self.moves) if self.moves else "the start"} for {self.username} {f"playing {self.colour}" if len(self.colour) > 0 else ""}')
+                    + gg.xlab("Move")
+                    + gg.ylab("Game Count")
+
+                    + gg.theme(text=gg.element_text(colour=cpcs.text, size=cpcs.label_size))
+                    + gg.theme(plot_title=gg.element_text(size=cpcs.title_size, ha='left'))
+                    + gg.theme(axis_title=gg.element_text(size=cpcs.axis_size))
+                    + gg.theme(axis_text=gg.element_text(size=cpcs.label_size))
+                    + gg.theme(panel_grid_major_x=gg.element_line(colour=cpcs.axis))
+                    + gg.theme(figure_size=cpcs.figure_size)
+                    + gg.theme(legend_position=cpcs.legend_position, legend_title=gg.element_text(size=cpcs.legend_title_size), legend_text=gg.element_text(size=cpcs.legend_text_size))
+
+                    + pe.background_colour(colour=cpcs.background)
+                    + pe.remove_grid(minor=True, y_major=True)
+                    + pe.remove_ticks(major=True, minor=True))
+
+    def _time_by_move(self, game_data: pd.DataFrame) -> gg.ggplot:
+        """Plot the mean time spent on each move number by the player and the opponent"""
+        plot_data = time_by_move(game_data)
+
+        return (gg.ggplot(plot_data, gg.aes(x='move', y='spent', colour='player'))
+                    + gg.geom_line(size=1)
+                    + gg.scale_colour_manual(values=["gray", "black"], name="Player", labels=("Opponent", self.username))
+
+                    + gg.ggtitle(f'Time Used by Move for {self.username} {f"playing {self.colour}" if len(self.colour) > 0 else ""}')
+                    + gg.xlab("Move")
+                    + gg.ylab("Mean Time Spent [s]")
+
+                    + gg.scale_x_continuous(expand=(0,0))
+
+                    + gg.theme(text=gg.element_text(colour=cpcs.text, size=cpcs.label_size))
+                    + gg.theme(plot_title=gg.element_text(size=cpcs.title_size, ha='left'))
+                    + gg.theme(axis_title=gg.element_text(size=cpcs.axis_size))
+                    + gg.theme(axis_text=gg.element_text(size=cpcs.label_size))
+                    + gg.theme(panel_grid_major_x=gg.element_line(colour=cpcs.axis))
+                    + gg.theme(figure_size=cpcs.figure_size)
+                    + gg.theme(legend_position=cpcs.legend_position, legend_title=gg.element_text(size=cpcs.legend_title_size), legend_text=gg.element_text(size=cpcs.legend_text_size))
+
+                    + pe.background_colour(colour=cpcs.background)
+                    + pe.remove_grid(minor=True, y_major=True)
+                    + pe.remove_ticks(major=True, minor=True))
+
+    def _time_trouble_results(self, game_data: pd.DataFrame) -> gg.ggplot:
+        """Plot the results of the player in games where its clock went below time_trouble_seconds against the other games"""
+        plot_data = time_trouble_results(game_data)
+        labels = {False: f"Never under {time_trouble_seconds}s", True: f"Under {time_trouble_seconds}s"}
+        plot_data["time_trouble"] = pd.Categorical(plot_data["time_trouble"].map(labels), categories=list(labels.values()))
+
+        return (gg.ggplot(plot_data, gg.aes(x='time_trouble', y='count', fill='factor(player_result)'))
+                    + gg.geom_col(position='fill', colour="black")
+                    + gg.scale_fill_manual(values=["black", "lightgray", "white"], name=f"{self.username} Result", labels=("Loss", "Draw", "Win"))
+                    + gg.coord_flip()
+
+                    + gg.ggtitle(f"Results in Time Trouble for {self.username}")
+                    + gg.xlab("Lowest Clock")
+                    + gg.ylab("Game Fraction")
+
+                    + gg.theme(text=gg.element_text(colour=cpcs.text, size=cpcs.label_size))
+                    + gg.theme(plot_title=gg.element_text(size=cpcs.title_size, ha='left'))
+                    + gg.theme(axis_title=gg.element_text(size=cpcs.axis_size))
+                    + gg.theme(axis_text=gg.element_text(size=cpcs.label_size))
+                    + gg.theme(panel_grid_major_x=gg.element_line(colour=cpcs.axis))
+                    + gg.theme(figure_size=cpcs.figure_size)
+                    + gg.theme(legend_position=cpcs.legend_position, legend_title=gg.element_text(size=cpcs.legend_title_size), legend_text=gg.element_text(size=cpcs.legend_text_size))
+
+                    + pe.background_colour(colour=cpcs.background)
+                    + pe.remove_grid(minor=True, y_major=True)
+                    + pe.remove_ticks(major=True, minor=True))
+
+    def _time_by_phase(self, game_data: pd.DataFrame) -> gg.ggplot:
+        """Plot the mean time spent per move in the opening, middlegame and endgame by the player and the opponent"""
+        plot_data = time_by_phase(game_data)
+
+        return (gg.ggplot(plot_data, gg.aes(x='phase', y='spent', fill='player'))
+                    + gg.geom_col(position='dodge', colour="black")
+                    + gg.scale_fill_manual(values=["lightgray", "black"], name="Player", labels=("Opponent", self.username))
+
+                    + gg.ggtitle(f'Time per Move by Phase for {self.username} {f"playing {self.colour}" if len(self.colour) > 0 else ""}')
+                    + gg.xlab("Phase")
+                    + gg.ylab("Mean Time Spent [s]")
+
+                    + gg.theme(text=gg.element_text(colour=cpcs.text, size=cpcs.label_size))
+                    + gg.theme(plot_title=gg.element_text(size=cpcs.title_size, ha='left'))
+                    + gg.theme(axis_title=gg.element_text(size=cpcs.axis_size))
+                    + gg.theme(axis_text=gg.element_text(size=cpcs.label_size))
+                    + gg.theme(panel_grid_major_x=gg.element_line(colour=cpcs.axis))
+                    + gg.theme(figure_size=cpcs.figure_size)
+                    + gg.theme(legend_position=cpcs.legend_position, legend_title=gg.element_text(size=cpcs.legend_title_size), legend_text=gg.element_text(size=cpcs.legend_text_size))
+
+                    + pe.background_colour(colour=cpcs.background)
+                    + pe.remove_grid(minor=True, y_major=True)
+                    + pe.remove_ticks(major=True, minor=True))
+
+    def _rating_history(self, game_data: pd.DataFrame, rule: str, window: str, period: str) -> gg.ggplot:
+        """Plot the rating of the player at the end of each period and its mean over a rolling time window"""
+        ratings = pd.Series(np.where(game_data["player_is_white"], game_data["WhiteElo"], game_data["BlackElo"]).astype(np.float64), index=pd.DatetimeIndex(start_times(game_data)))
+        ratings = ratings[ratings.index.notnull()].sort_index()
+
+        # The rolling mean is taken over the games, both series are then sampled at the last game of each period
+        plot_data = pd.DataFrame({"Rating": ratings.resample(rule).last(), f"{window} Mean": ratings.rolling(window).mean().resample(rule).last()}).dropna()
+        plot_data = plot_data.rename_axis("date").reset_index().melt(id_vars="date", var_name="series", value_name="rating")
+
+        return (gg.ggplot(plot_data, gg.aes(x='date', y='rating', colour='series'))
+                    + gg.geom_line(size=1)
+                    + gg.scale_colour_manual(values=["black", "lightgray"], name=self.username)
+
+                    + gg.ggtitle(f'Rating History by {period} for {self.username} {f"playing {self.colour}" if len(self.colour) > 0 else ""}')
+                    + gg.xlab("Date")
+                    + gg.ylab("Rating")
+
+                    + gg.theme(text=gg.element_text(colour=cpcs.text, size=cpcs.label_size))
+                    + gg.theme(plot_title=gg.element_text(size=cpcs.title_size, ha='left'))
+                    + gg.theme(axis_title=gg.element_text(size=cpcs.axis_size))
+                    + gg.theme(axis_text=gg.element_text(size=cpcs.label_size))
+                    + gg.theme(panel_grid_major_x=gg.element_line(colour=cpcs.axis))
+                    + gg.theme(figure_size=cpcs.figure_size)
+                    + gg.theme(legend_position=cpcs.legend_position, legend_title=gg.element_text(size=cpcs.legend_title_size), legend_text=gg.element_text(size=cpcs.legend_text_size))
+
+                    + pe.background_colour(colour=cpcs.background)
+                    + pe.remove_grid(minor=True, y_major=True)
+                    + pe.remove_ticks(major=True, minor=True))
+
+    # _rating_history partial methods
+    _rating_history_day = partialmethod(_rating_history, rule="D", window="7D", period="Day")
+    _rating_history_week = partialmethod(_rating_history, rule="W", window="28D", period="Week")
+    _rating_history_month = partialmethod(_rating_history, rule="M", window="91D", period="Month")
+
+    def _activity(self, game_data: pd.DataFrame, value: str, name: str) -> gg.ggplot:
+        """Plot a heatmap of the game count or score of the player by hour of day and day of week"""
+        plot_data = self.activity if self.activity is not None else activity_grid(game_data)
+
+        return (gg.ggplot(plot_data, gg.aes(x='hour', y='weekday', fill=value))
+                    + gg.geom_tile(colour=cpcs.background)
+                    + gg.scale_fill_gradient(low="black", high="white", name=name, na_value=cpcs.background)
+
+                    + gg.ggtitle(f'{name} by Hour and Weekday for {self.username} {f"playing {self.colour}" if len(self.colour) > 0 else ""}')
+                    + gg.xlab("Hour [local time]")
+                    + gg.ylab("Weekday")
+
+                    + gg.scale_x_continuous(breaks=range(0, 24, 2), expand=(0,0))
+
+                    + gg.theme(text=gg.element_text(colour=cpcs.text, size=cpcs.label_size))
+                    + gg.theme(plot_title=gg.element_text(size=cpcs.title_size, ha='left'))
+                    + gg.theme(axis_title=gg.element_text(size=cpcs.axis_size))
+                    + gg.theme(axis_text=gg.element_text(size=cpcs.label_size))
+                    + gg.theme(figure_size=cpcs.figure_size)
+                    + gg.theme(legend_position=cpcs.legend_position, legend_title=gg.element_text(size=cpcs.legend_title_size), legend_text=gg.element_text(size=cpcs.legend_text_size))
+
+                    + pe.background_colour(colour=cpcs.background)
+                    + pe.remove_grid(minor=True, y_major=True)
+                    + pe.remove_ticks(major=True, minor=True))
+
+    def _opponents_top(self, game_data: pd.DataFrame) -> gg.ggplot:
+        """Plot stacked horizontal bars of the results of the player against the top n opponents by game count"""
+        plot_data = self._counts(game_data.assign(opponent=opponent_names(game_data)), ["opponent", "player_result"])
+        top_n_opponents = list(plot_data.groupby("opponent")["count"].sum().sort_values(ascending=False, kind="stable")[:int(self.number_items)].index)
+        plot_data = plot_data[plot_data.opponent.isin(top_n_opponents)].copy()
+        plot_data["opponent"] = pd.Categorical(plot_data["opponent"], categories=top_n_opponents[::-1], ordered=True)
+
+        return (gg.ggplot(plot_data, gg.aes(x='opponent', y='count', fill='factor(player_result)'))
+                    + gg.geom_col(position='stack', colour="black")
+                    + gg.scale_fill_manual(values=["black", "lightgray", "white"], name=f"{self.username} Result", labels=("Loss", "Draw", "Win"))
+                    + gg.coord_flip()
+
+                    + gg.ggtitle(f'Top Opponents of {self.username} {f"playing {self.colour}" if len(self.colour) > 0 else ""}')
+                    + gg.xlab("Opponent")
+                    + gg.ylab("Game Count")
+
+                    + gg.theme(text=gg.element_text(colour=cpcs.text, size=cpcs.label_size))
+                    + gg.theme(plot_title=gg.element_text(size=cpcs.title_size, ha='left'))
+                    + gg.theme(axis_title=gg.element_text(size=cpcs.axis_size))
+                    + gg.theme(axis_text=gg.element_text(size=cpcs.label_size))
+                    + gg.theme(panel_grid_major_x=gg.element_line(colour=cpcs.axis))
+                    + gg.theme(figure_size=cpcs.figure_size)
+                    + gg.theme(legend_position=cpcs.legend_position, legend_title=gg.element_text(size=cpcs.legend_title_size), legend_text=gg.element_text(size=cpcs.legend_text_size))
+
+                    + pe.background_colour(colour=cpcs.background)
+                    + pe.remove_grid(minor=True, y_major=True)
+                    + pe.remove_ticks(major=True, minor=True))
+
+    # _activity partial methods
+    _activity_games = partialmethod(_activity, value="games", name="Game Count")
+    _activity_score = partialmethod(_activity, value="score", name="Score")
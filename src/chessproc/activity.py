@@ -0,0 +1,41 @@
+
+# Activity of a player by hour of day and day of week, in the local timezone of the machine by default
+#
+# The start times of the games are converted from UTC in one vectorized step and counted over the 7x24 grid with a
+# single bincount, so the plots only receive the 168 cells.
+
+from datetime import datetime, tzinfo
+import os
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .dfproc import start_times
+
+weekdays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def local_timezone() -> Union[str, tzinfo]:
+    """Name of the local timezone from TZ or /etc/localtime, so conversions keep daylight saving, else the current UTC offset"""
+    if os.environ.get("TZ"):
+        return os.environ["TZ"]
+    localtime = os.path.realpath("/etc/localtime")
+    if "zoneinfo/" in localtime:
+        return localtime.split("zoneinfo/", 1)[1]
+    return datetime.now().astimezone().tzinfo
+
+
+def activity_grid(game_data: pd.DataFrame, timezone: Optional[Union[str, tzinfo]] = None) -> pd.DataFrame:
+    """Game count and mean score of the player for each weekday and hour of the start times, in the given or local timezone"""
+    times = pd.DatetimeIndex(start_times(game_data)).tz_localize("UTC").tz_convert(timezone or local_timezone())
+    started = times.notna()
+    cells = (times.dayofweek.to_numpy()[started] * 24 + times.hour.to_numpy()[started]).astype(np.int64)
+
+    counts = np.bincount(cells, minlength=7 * 24)
+    scores = np.bincount(cells, weights=game_data["player_result"].to_numpy(dtype=np.float64)[started] / 2, minlength=7 * 24)
+
+    return pd.DataFrame({"weekday": pd.Categorical(np.repeat(weekdays, 24), categories=weekdays[::-1], ordered=True),
+                         "hour": np.tile(np.arange(24), 7),
+                         "games": counts,
+                         "score": np.divide(scores, counts, out=np.full(7 * 24, np.nan), where=counts > 0)})
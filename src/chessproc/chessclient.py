@@ -0,0 +1,130 @@
+
+# Long lived client for the chess.com api, keeps one event loop and one pooled http session for the life of the app
+
+import asyncio
+import atexit
+from concurrent.futures import Future
+import threading
+import time
+from typing import Coroutine, Optional
+
+import aiohttp
+
+from chessdotcom.aio import ChessDotComError, ChessDotComResponse, get_player_game_archives, get_player_games_by_month_pgn, get_player_stats
+from chessdotcom.types import Resource
+
+
+class RequestBudget:
+
+    """
+    Token bucket bounding the requests per second of the client, bursts of up to burst requests are let through at once.
+
+    Requests waiting for a token are served in order, it is only used from the client event loop.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait for a token and take it"""
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens, self.updated = 1.0, time.monotonic()
+            self.tokens -= 1
+
+
+class ChessComClient:
+
+    """
+    Client for the chess.com public api running its own event loop on a dedicated thread.
+
+    Requests share a keep-alive connection pool, so repeated checks and refreshes reuse connections and TLS sessions.
+    Work is submitted from any thread with submit, which returns a concurrent.futures.Future.  The request coroutines
+    reuse the endpoint definitions of the chessdotcom package(the undecorated functions return the Resource to request).
+    """
+
+    user_agent = "ChessPlotter"
+
+    def __init__(self, connection_limit: int = 4, retries: int = 4, tts: float = 2, keepalive_timeout: float = 60) -> None:
+        self.connection_limit = connection_limit
+        self.retries = retries
+        self.tts = tts
+        self.keepalive_timeout = keepalive_timeout
+
+        # Budget every request waits on when set, shared by all requests of the app
+        self.budget: Optional[RequestBudget] = None
+
+        # Start the event loop thread, the session has to be created from within the loop
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="ChessComClient", daemon=True)
+        self.thread.start()
+        self.session: aiohttp.ClientSession = self.submit(self._make_session()).result()
+
+    async def _make_session(self) -> aiohttp.ClientSession:
+        """Create the pooled session, limited to a few connections to stay clear of the api rate limit"""
+        connector = aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=self.keepalive_timeout)
+        return aiohttp.ClientSession(connector=connector, headers={"User-Agent": self.user_agent})
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Schedule the coroutine on the client event loop, return a future for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def close(self) -> None:
+        """Close the session and stop the event loop"""
+        if self.loop.is_running():
+            self.submit(self.session.close()).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    async def request(self, resource: Resource) -> ChessDotComResponse:
+        """Make the request for the resource, retrying after a wait on a 429 response"""
+        if resource.tts:
+            await asyncio.sleep(resource.tts)
+
+        while True:
+            if self.budget is not None:
+                await self.budget.acquire()
+            async with self.session.get(**resource.request_config) as r:
+                text = await r.text()
+                resource.times_requested += 1
+
+                if r.status == 200:
+                    return ChessDotComResponse(text, resource.top_level_attr, resource.no_json)
+                if r.status == 429 and resource.times_requested <= self.retries:
+                    await asyncio.sleep(self.tts)
+                    continue
+                raise ChessDotComError(status_code=r.status, response_text=text, headers=r.headers)
+
+    async def get_player_game_archives(self, username: str) -> ChessDotComResponse:
+        """Request the list of month archives of the player"""
+        return await self.request(get_player_game_archives.__wrapped__(username))
+
+    async def get_player_games_by_month_pgn(self, username: str, year: str, month: str, tts: float = 0) -> ChessDotComResponse:
+        """Request the pgn of all games of the player in the month"""
+        return await self.request(get_player_games_by_month_pgn.__wrapped__(username, year, month, tts=tts))
+
+    async def get_player_stats(self, username: str) -> ChessDotComResponse:
+        """Request the stats of the player"""
+        return await self.request(get_player_stats.__wrapped__(username))
+
+
+_client: Optional[ChessComClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ChessComClient:
+    """Return the shared client, starting it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ChessComClient()
+            atexit.register(_client.close)
+    return _client
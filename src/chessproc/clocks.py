@@ -0,0 +1,101 @@
+
+# Clock analytics, the time spent on each move from the [%clk] comments of the games
+#
+# The clock after every ply is parsed to seconds once when a month is parsed and stored as a float32 array per game.
+# The aggregates flatten the arrays of all games into one ply table and work on it with numpy, so they take no
+# Python loop over the games.  Time spent on a ply is the clock of the side before it minus the clock after it plus
+# the increment, the clock before the first move of each side is the base time of the time control.
+
+import numpy as np
+import pandas as pd
+
+# Clock of the side to move below which it is in time trouble, in seconds
+time_trouble_seconds = 10
+
+# Last move number of the opening and of the middlegame, for time per move by phase
+phase_moves = [10, 30]
+phase_names = ["Opening", "Middlegame", "Endgame"]
+
+
+def parse_clocks(moves: pd.Series) -> pd.Series:
+    """Parse the clock strings of the move tuples of each game to a float32 array of seconds, NaN where a clock is unreadable"""
+    lengths = moves.map(len).to_numpy()
+    codes, clock_strings = pd.factorize(pd.Series([move[2] for game_moves in moves for move in game_moves], dtype=object))
+
+    # Clocks repeat across games, each distinct clock string is parsed once
+    seconds = pd.to_timedelta(pd.Series(clock_strings, dtype=object), errors="coerce").dt.total_seconds().to_numpy(dtype=np.float32)[codes]
+
+    return pd.Series(np.split(seconds, np.cumsum(lengths)[:-1]) if len(lengths) else [], index=moves.index, dtype=object)
+
+
+def ply_table(game_data: pd.DataFrame) -> pd.DataFrame:
+    """Flatten the clocks of the player game dataframe to one row per ply.
+
+    Rows hold the position of the game in the dataframe, the ply, whether the player of interest made it, the clock
+    after it and the time spent on it.
+    """
+    lengths = game_data["game_length"].to_numpy(dtype=np.int64)
+    clock = np.concatenate(list(game_data["clocks"])).astype(np.float32) if len(game_data) else np.array([], dtype=np.float32)
+    game = np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)
+    starts = np.cumsum(lengths) - lengths
+    ply = (np.arange(len(clock)) - np.repeat(starts, lengths)).astype(np.int16)
+
+    # The clock of the same side two plies earlier, the base time before the first move of each side
+    before = np.empty_like(clock)
+    before[2:] = clock[:-2]
+    before = np.where(ply < 2, game_data["base_time"].to_numpy()[game], before)
+    spent = (before - clock + game_data["increment"].to_numpy()[game]).astype(np.float32)
+
+    player = (ply % 2 == 0) == game_data["player_is_white"].to_numpy()[game]
+    return pd.DataFrame({"game": game, "ply": ply, "player": player, "clock": clock, "spent": spent})
+
+
+def time_by_move(game_data: pd.DataFrame, max_move: int = 60) -> pd.DataFrame:
+    """Mean time spent by move number for the player and the opponent, up to max_move"""
+    plies = ply_table(game_data)
+    plies = plies[plies.spent.notnull().to_numpy() & (plies.ply < 2 * max_move).to_numpy()]
+    move = (plies["ply"].to_numpy() // 2 + 1).astype(np.int64)
+    side = plies["player"].to_numpy().astype(np.int64)
+
+    # Sum and count by side and move number with a single bincount each
+    key = side * (max_move + 1) + move
+    sums = np.bincount(key, weights=plies["spent"].to_numpy(dtype=np.float64), minlength=2 * (max_move + 1))
+    counts = np.bincount(key, minlength=2 * (max_move + 1))
+    keys = np.nonzero(counts)[0]
+
+    return pd.DataFrame({"move": keys % (max_move + 1), "player": keys >= max_move + 1, "spent": sums[keys] / counts[keys], "count": counts[keys]})
+
+
+def time_trouble(game_data: pd.DataFrame, seconds: float = time_trouble_seconds) -> np.ndarray:
+    """Whether the clock of the player of interest went below the given seconds in each game"""
+    plies = ply_table(game_data)
+    plies = plies[plies.player.to_numpy()]
+    lowest = np.full(len(game_data), np.inf, dtype=np.float32)
+    np.minimum.at(lowest, plies["game"].to_numpy(), np.nan_to_num(plies["clock"].to_numpy(), nan=np.inf))
+
+    return lowest < seconds
+
+
+def time_trouble_results(game_data: pd.DataFrame, seconds: float = time_trouble_seconds) -> pd.DataFrame:
+    """Game counts by player result for the games with and without time trouble, a sample of games(with a count column) is counted by its weights"""
+    trouble = time_trouble(game_data, seconds)
+    weights = game_data["count"].to_numpy(dtype=np.float64) if "count" in game_data else None
+    counts = np.bincount(trouble.astype(np.int64) * 3 + game_data["player_result"].to_numpy(dtype=np.int64), weights=weights, minlength=6)
+
+    return pd.DataFrame({"time_trouble": np.repeat([False, True], 3), "player_result": np.tile([0, 1, 2], 2), "count": counts})
+
+
+def time_by_phase(game_data: pd.DataFrame) -> pd.DataFrame:
+    """Mean time spent per move in the opening, middlegame and endgame for the player and the opponent"""
+    plies = ply_table(game_data)
+    plies = plies[plies.spent.notnull().to_numpy()]
+    phase = np.searchsorted(phase_moves, plies["ply"].to_numpy() // 2 + 1, side="left")
+    side = plies["player"].to_numpy().astype(np.int64)
+
+    key = side * len(phase_names) + phase
+    sums = np.bincount(key, weights=plies["spent"].to_numpy(dtype=np.float64), minlength=2 * len(phase_names))
+    counts = np.bincount(key, minlength=2 * len(phase_names))
+    keys = np.nonzero(counts)[0]
+
+    return pd.DataFrame({"phase": pd.Categorical(np.array(phase_names)[keys % len(phase_names)], categories=phase_names, ordered=True),
+                         "player": keys >= len(phase_names), "spent": sums[keys] / counts[keys], "count": counts[keys]})
@@ -0,0 +1,103 @@
+
+# Pre-aggregated game counts of a username, the bar and histogram plots are drawn from the cube instead of the games
+#
+# The cube counts games by colour, ECO, opponent rating band, result, player result, termination, month, elo
+# difference bin and time class.  It is written with the parquet of the username and updated with the games upserted into it.
+
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from . import schema
+from .locks import user_lock
+
+cube_directory = ".cubes/"
+elo_bin_width = 8
+opponent_band_width = 200
+
+dimensions = ["player_is_white", "ECO", "opponent_band", "Result", "player_result", "Termination", "month", "elo_bin", "time_class"]
+
+
+def cube_filepath(username: str, base_directory_name: str) -> str:
+    return f"{base_directory_name}{cube_directory}{username}.parquet"
+
+
+def elo_bins(elo_difference: pd.Series) -> np.ndarray:
+    """Bin the elo differences, bins are elo_bin_width wide, centred on multiples of the width and closed on the right like geom_histogram"""
+    return (np.ceil((elo_difference.to_numpy(dtype=np.float64) - elo_bin_width / 2) / elo_bin_width) * elo_bin_width).astype(np.int16)
+
+
+def build_cube(game_data: pd.DataFrame) -> pd.DataFrame:
+    """Count the games of the player game dataframe over the cube dimensions"""
+    opponent_elo = np.where(game_data["player_is_white"], game_data["BlackElo"], game_data["WhiteElo"])
+    dims = pd.DataFrame({"player_is_white": game_data["player_is_white"].to_numpy(),
+                         "ECO": game_data["ECO"].to_numpy(),
+                         "opponent_band": (opponent_elo // opponent_band_width * opponent_band_width).astype(np.int16),
+                         "Result": game_data["Result"].to_numpy(),
+                         "player_result": game_data["player_result"].to_numpy(),
+                         "Termination": game_data["Termination"].to_numpy(),
+                         "month": game_data["UTCDate"].to_numpy().astype("datetime64[M]"),
+                         "elo_bin": elo_bins(game_data["elo_difference"]),
+                         "time_class": game_data["time_class"].to_numpy()})
+
+    return format_cube(dims.groupby(dimensions, observed=True, dropna=False).size().rename("count").reset_index())
+
+
+def combine_cubes(cubes: List[pd.DataFrame], signs: Optional[List[int]] = None) -> pd.DataFrame:
+    """Add up the cubes(subtracting those with sign -1), dropping cells left without games"""
+    signs = signs or [1] * len(cubes)
+    cubes = [cube.assign(count=cube["count"] * sign) for cube, sign in zip(cubes, signs) if len(cube)]
+    if not cubes:
+        return pd.DataFrame(columns=dimensions + ["count"])
+
+    # Categories differ between cubes, combine the dimensions as plain values
+    combined = pd.concat([cube.astype({col: object for col in ["ECO", "Result", "Termination"]}) for cube in cubes])
+    combined = combined.groupby(dimensions, dropna=False)["count"].sum().reset_index()
+
+    return format_cube(combined[combined["count"] > 0].reset_index(drop=True))
+
+
+def format_cube(cube: pd.DataFrame) -> pd.DataFrame:
+    """Give the cube the dtypes of the game columns it counts"""
+    cube = cube.astype({"player_is_white": bool, "opponent_band": np.int16, "player_result": np.int8, "elo_bin": np.int16, "time_class": np.int8, "count": np.int64})
+    cube["Result"] = pd.Categorical(cube["Result"], categories=["1-0", "1/2-1/2", "0-1"])
+
+    return schema.enforce_schema(cube)
+
+
+def write_cube(username: str, cube: pd.DataFrame, base_directory_name: str) -> None:
+    """Write the cube of the username through a temporary file"""
+    filepath = cube_filepath(username, base_directory_name)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    schema.write_parquet(cube, filepath)
+
+
+def read_cube(username: str, base_directory_name: str) -> Optional[pd.DataFrame]:
+    """Read the cube of the username, None if it has none or it was written with another schema version"""
+    filepath = cube_filepath(username, base_directory_name)
+    if not os.path.isfile(filepath) or not schema.is_current(filepath):
+        return None
+    return format_cube(schema.read_parquet(filepath))
+
+
+def update_cube(username: str, removed: pd.DataFrame, added: pd.DataFrame, base_directory_name: str) -> None:
+    """Update the stored cube with games removed from and added to the parquet of the username, rebuilt on the next load if there is none"""
+    cube = read_cube(username, base_directory_name)
+    if cube is not None:
+        write_cube(username, combine_cubes([cube, build_cube(removed), build_cube(added)], signs=[1, -1, 1]), base_directory_name)
+
+
+def get_cube(username: str, game_data: pd.DataFrame, base_directory_name: str) -> pd.DataFrame:
+    """Return the cube of the username for the loaded games, rebuilding it when missing or when its count differs from the games"""
+    cube = read_cube(username, base_directory_name)
+    if cube is None or cube["count"].sum() != len(game_data):
+        # Read again under the lock, another process may have rebuilt it while this one waited
+        with user_lock(username, base_directory_name):
+            cube = read_cube(username, base_directory_name)
+            if cube is None or cube["count"].sum() != len(game_data):
+                cube = build_cube(game_data)
+                write_cube(username, cube, base_directory_name)
+
+    return cube
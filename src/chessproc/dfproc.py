@@ -1,4 +1,7 @@
 
+from typing import List, Optional, Tuple
+
+import numpy as np
 import pandas as pd
 
 
@@ -12,29 +15,26 @@ def add_player_specific_series(dataframe: pd.DataFrame, player: str, func):
     dataframe[f"{func.__name__}"] = dataframe.apply(lambda x: func(x, player), axis=1)
 
 
-def player_result(series: pd.Series, player: str):
-    """Return the score of the player of interest"""
-    res = series['Termination'].split()[0]
-    if res == player:
+def player_result(series: pd.Series, player: str) -> int:
+    """Return the result code of the player of interest, 0 for a loss, 1 for a draw and 2 for a win"""
+    if series['Result'] == "1/2-1/2":
         return 1
-    elif res == "Game":
-        return 0.5
+    elif (series['Result'] == "1-0") == (player.lower() == series['White'].lower()):
+        return 2
     else:
         return 0
 
 
-def player_colour(series: pd.Series, player: str) -> str:
-    """Return the colour of the player of interest"""
-    if player == series["White"]:
-        return "White"
-    else:
-        return "Black"
+def player_is_white(series: pd.Series, player: str) -> bool:
+    """Return whether the player of interest played white"""
+    return player.lower() == series["White"].lower()
 
 
 def elo_difference(series: pd.Series, player: str):
-    if player == series['Black']:
+    """Return the opponent elo minus the elo of the player of interest"""
+    if player.lower() == series['Black'].lower():
         return series['WhiteElo'] - series['BlackElo']
-    elif player == series['White']:
+    elif player.lower() == series['White'].lower():
         return series['BlackElo'] - series['WhiteElo']
     else:
         return None
@@ -45,6 +45,40 @@ def game_length(series: pd.Series):
     return len(series['moves'])
 
 
+def start_times(game_data: pd.DataFrame) -> np.ndarray:
+    """Return the UTC start time of each game, vectorized over the UTCDate and UTCTime columns"""
+    return (game_data["UTCDate"] + game_data["UTCTime"]).to_numpy(dtype="datetime64[ns]")
+
+
+def sort_by_start_time(game_data: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Sort the game dataframe by start time, return it with its sorted start times so date ranges can be found by binary search"""
+    times = start_times(game_data)
+    if not (times[1:] >= times[:-1]).all():
+        order = np.argsort(times, kind="stable")
+        game_data, times = game_data.iloc[order], times[order]
+
+    return game_data, times
+
+
+def stratified_sample(game_data: pd.DataFrame, size: int, by: Optional[List[str]] = None, seed: int = 0) -> pd.DataFrame:
+    """Sample about size games keeping the share of each result and colour, every stratum keeps at least one game.
+
+    Each sampled game gets a count column with the number of games it stands for, so counting plots estimate the full
+    counts, and the games keep their order.
+    """
+    strata = game_data.groupby(by or ["player_result", "player_is_white"], sort=False).ngroup().to_numpy()
+    sizes = np.bincount(strata)
+    allocation = np.minimum(sizes, np.ceil(sizes * size / len(game_data))).astype(np.int64)
+
+    # Order the games randomly within each stratum and keep the first games of each up to its allocation
+    order = np.lexsort((np.random.default_rng(seed).random(len(strata)), strata))
+    starts = np.cumsum(sizes) - sizes
+    keep = np.arange(len(order)) - starts[strata[order]] < allocation[strata[order]]
+    selected = np.sort(order[keep])
+
+    return game_data.iloc[selected].assign(count=(sizes / allocation)[strata[selected]])
+
+
 def remove_opponent(player_games: pd.DataFrame, *args):
     """Return player dataframe with all games including the listed players removed"""
     return player_games.query(f"White not in {list(args)} & Black not in {list(args)}")
@@ -0,0 +1,173 @@
+
+# Shared columnar dataset of the games of every tracked username, for queries across players
+#
+# Usage: python -m chessproc.gamestore [--pgn-directory pgns/] [--build] [--band 200] [--group ECO] [--usernames a b]
+#
+# The dataset is partitioned by username(hive layout, .dataset/username=<name>/games.parquet).  A game is stored once,
+# in the partition of the first tracked username to write it, and only with its player agnostic columns.  The player
+# specific columns are derived when the games of a player are queried, from the lowercased white_username and
+# black_username columns which are also used to push player filters down to the parquet scan.
+
+import argparse
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from . import schema
+from .locks import dataset_lock
+
+dataset_directory = ".dataset/"
+partition_name = "games.parquet"
+
+# Partitions are written through a temporary file whose '_' prefix the dataset discovery skips, so a write in progress
+# or left by a crash is never scanned
+temporary_prefix = "_"
+
+# Columns depending on the player of interest, derived at query time instead of stored
+player_columns = ["player_result", "player_is_white", "elo_difference", "Username"]
+
+
+def dataset_path(base_directory_name: str) -> str:
+    return base_directory_name + dataset_directory
+
+
+def partition_path(username: str, base_directory_name: str) -> str:
+    return f"{dataset_path(base_directory_name)}username={username}/{partition_name}"
+
+
+def dataset_usernames(base_directory_name: str) -> List[str]:
+    """Return the usernames with a partition in the dataset"""
+    if not os.path.isdir(dataset_path(base_directory_name)):
+        return []
+    return sorted([name[9:] for name in os.listdir(dataset_path(base_directory_name)) if name.startswith("username=")])
+
+
+def open_dataset(base_directory_name: str) -> ds.Dataset:
+    """Open the dataset, partitions are discovered from the directory names"""
+    return ds.dataset(dataset_path(base_directory_name), format="parquet", partitioning="hive")
+
+
+def stored_game_ids(base_directory_name: str, exclude: Optional[str] = None) -> np.ndarray:
+    """Return the game ids stored in the dataset, leaving out the partition of the exclude username"""
+    if not dataset_usernames(base_directory_name):
+        return np.array([], dtype=np.uint64)
+    scan_filter = None if exclude is None else ds.field("username") != exclude
+    return open_dataset(base_directory_name).to_table(columns=["game_id"], filter=scan_filter)["game_id"].to_numpy()
+
+
+def write_user_games(username: str, game_data: pd.DataFrame, base_directory_name: str) -> int:
+    """Write the games of the username to its partition, leaving out games stored by another username, return the number of games written"""
+    # Held by any process while it reads the stored game ids and writes its partition, so a game two users played
+    # against each other is stored by the first of two concurrent writers only
+    with dataset_lock(base_directory_name):
+        return _write_user_games(username, game_data, base_directory_name)
+
+
+def _write_user_games(username: str, game_data: pd.DataFrame, base_directory_name: str) -> int:
+    game_data = game_data[~game_data.index.isin(stored_game_ids(base_directory_name, exclude=username))].copy()
+    game_data = schema.enforce_schema(game_data.drop(columns=[col for col in player_columns if col in game_data]))
+    game_data["white_username"] = game_data["White"].astype(str).str.lower()
+    game_data["black_username"] = game_data["Black"].astype(str).str.lower()
+
+    # Dictionary columns are stored as plain strings so partitions written with other categories share one schema, as
+    # are the string columns of a partition left without games, which have no type
+    table = pa.Table.from_pandas(game_data.reset_index(), preserve_index=False)
+    table = table.cast(pa.schema([pa.field(field.name, field.type.value_type) if pa.types.is_dictionary(field.type)
+                                  else pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field for field in table.schema]))
+
+    filepath = partition_path(username, base_directory_name)
+    temporary_filepath = os.path.join(os.path.dirname(filepath), temporary_prefix + partition_name + ".tmp")
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    pq.write_table(table, temporary_filepath)
+    os.replace(temporary_filepath, filepath)
+
+    return len(game_data)
+
+
+def add_player_columns(game_data: pd.DataFrame, username: str) -> pd.DataFrame:
+    """Derive the player specific columns of the username from the game columns, vectorized"""
+    is_white = (game_data["white_username"] == username.lower()).to_numpy()
+    white_win = (game_data["Result"] == "1-0").to_numpy()
+    draw = (game_data["Result"] == "1/2-1/2").to_numpy()
+    elo_difference = game_data["BlackElo"].to_numpy(dtype=np.int16) - game_data["WhiteElo"].to_numpy(dtype=np.int16)
+
+    game_data["player_result"] = np.where(draw, 1, np.where(white_win == is_white, 2, 0)).astype(np.int8)
+    game_data["player_is_white"] = is_white
+    game_data["elo_difference"] = np.where(is_white, elo_difference, -elo_difference).astype(np.int16)
+    game_data["Username"] = username
+
+    return game_data
+
+
+def player_filter(usernames: List[str]) -> ds.Expression:
+    """Scan filter for the games played by any of the usernames"""
+    keys = [username.lower() for username in usernames]
+    return ds.field("white_username").isin(keys) | ds.field("black_username").isin(keys)
+
+
+def player_games(username: str, base_directory_name: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read the games of the username from every partition and derive its player specific columns"""
+    if columns is not None:
+        columns = list(dict.fromkeys(["game_id", "White", "Black", "WhiteElo", "BlackElo", "Result", "white_username", "black_username"] + columns))
+    table = open_dataset(base_directory_name).to_table(columns=columns, filter=player_filter([username]))
+    game_data = table.to_pandas().set_index("game_id").drop(columns="username", errors="ignore")
+
+    return schema.enforce_schema(add_player_columns(game_data, username))
+
+
+def player_perspectives(table: pa.Table, keys: List[str], group: str) -> pa.Table:
+    """One row per game and tracked player in it, with the group column, the rating and the score of that player"""
+    white_score = pc.if_else(pc.equal(table["Result"], "1-0"), 1.0, pc.if_else(pc.equal(table["Result"], "1/2-1/2"), 0.5, 0.0))
+    sides = []
+    for side, elo, score in [("white_username", "WhiteElo", white_score), ("black_username", "BlackElo", pc.subtract(1.0, white_score))]:
+        mask = pc.is_in(table[side], value_set=pa.array(keys))
+        sides.append(pa.table({group: table[group], "elo": table[elo], "score": score}).filter(mask))
+
+    return pa.concat_tables(sides)
+
+
+def score_by_rating_band(base_directory_name: str, group: str = "ECO", band: int = 200, usernames: Optional[List[str]] = None, min_games: int = 1) -> pd.DataFrame:
+    """Score and game count of the tracked players by the group column and rating band, over every partition.
+
+    Only the needed columns of the games of the usernames(default every username in the dataset) are scanned, the
+    scan runs over the partitions in parallel.
+    """
+    keys = [username.lower() for username in (usernames or dataset_usernames(base_directory_name))]
+    table = open_dataset(base_directory_name).to_table(columns=[group, "WhiteElo", "BlackElo", "Result", "white_username", "black_username"], filter=player_filter(keys), use_threads=True)
+
+    games = player_perspectives(table, keys, group)
+    games = games.append_column("band", pc.multiply(pc.divide(games["elo"], band), band))
+    counts = games.group_by([group, "band"]).aggregate([("score", "mean"), ("score", "count")])
+
+    result = counts.to_pandas().rename(columns={"score_mean": "score", "score_count": "games"})
+    return result[result.games >= min_games].sort_values([group, "band"]).reset_index(drop=True)
+
+
+def build_dataset(base_directory_name: str) -> int:
+    """Write the partition of every username with a parquet file, return the number of games stored"""
+    usernames = sorted([file[:-8] for file in os.listdir(base_directory_name) if file.endswith('.parquet')])
+    return sum(write_user_games(username, schema.read_parquet(base_directory_name + username + ".parquet"), base_directory_name) for username in usernames)
+
+
+if __name__ == "__main__":
+    from .pgnproc import global_pgn_directory
+
+    parser = argparse.ArgumentParser(description="Query the games of every tracked username together.")
+    parser.add_argument("--pgn-directory", default=global_pgn_directory, help="Directory for the pgn and parquet files")
+    parser.add_argument("--build", action="store_true", help="Write the dataset from the parquet file of every username")
+    parser.add_argument("--group", default="ECO", help="Column to group the scores by")
+    parser.add_argument("--band", type=int, default=200, help="Width of the rating bands")
+    parser.add_argument("--usernames", nargs="+", default=None, help="Players to include, defaults to every username in the dataset")
+    parser.add_argument("--min-games", type=int, default=10, help="Leave out groups with fewer games")
+    args = parser.parse_args()
+
+    if args.build:
+        print(f"Stored {build_dataset(args.pgn_directory)} games.")
+    with pd.option_context("display.max_rows", None):
+        print(score_by_rating_band(args.pgn_directory, group=args.group, band=args.band, usernames=args.usernames, min_games=args.min_games))
@@ -0,0 +1,71 @@
+
+# Persistent job queue for bulk ingestion, checkpoints every user and every downloaded month in a sqlite database
+
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class IngestJobQueue:
+
+    """
+    Queue of usernames to ingest, stored in sqlite so a run can be resumed after a crash or a stall.
+
+    Each user has a status(pending, done, stalled, failed, invalid) and each month downloaded for a user is recorded
+    as soon as its file has been written, so a resumed run only requests the months that are missing.  The queue
+    can be used from several threads.
+    """
+
+    def __init__(self, filepath: str) -> None:
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, games INTEGER, message TEXT, updated REAL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS months (username TEXT NOT NULL, date TEXT NOT NULL, bytes INTEGER, updated REAL, PRIMARY KEY (username, date))")
+
+    def add_users(self, usernames: List[str], requeue: bool = False) -> None:
+        """Add the usernames as pending, usernames already queued keep their status unless requeue is given"""
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO users (username, status, updated) VALUES (?, 'pending', ?)", [(username, time.time()) for username in usernames])
+            if requeue:
+                self.connection.executemany("UPDATE users SET status = 'pending', attempts = 0 WHERE username = ?", [(username,) for username in usernames])
+
+    def next_user(self, exclude: Optional[List[str]] = None) -> Optional[str]:
+        """Return the next user to ingest, pending users before stalled users, fewest attempts first"""
+        exclude = exclude or []
+        with self.lock:
+            rows = self.connection.execute("SELECT username FROM users WHERE status IN ('pending', 'stalled') ORDER BY status = 'stalled', attempts, rowid").fetchall()
+        return next((username for (username,) in rows if username not in exclude), None)
+
+    def set_user_status(self, username: str, status: str, games: Optional[int] = None, message: Optional[str] = None) -> None:
+        """Record the outcome of an attempt to ingest the user"""
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE users SET status = ?, attempts = attempts + (? != 'done'), games = COALESCE(?, games), message = ?, updated = ? WHERE username = ?", (status, status, games, message, time.time(), username))
+
+    def attempts(self, username: str) -> int:
+        """Return the number of failed attempts for the user"""
+        with self.lock:
+            row = self.connection.execute("SELECT attempts FROM users WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else 0
+
+    def mark_month(self, username: str, date: str, size: int) -> None:
+        """Checkpoint a month as downloaded"""
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO months (username, date, bytes, updated) VALUES (?, ?, ?, ?)", (username, date, size, time.time()))
+
+    def done_months(self, username: str) -> List[str]:
+        """Return the months checkpointed as downloaded for the user"""
+        with self.lock:
+            rows = self.connection.execute("SELECT date FROM months WHERE username = ? ORDER BY date", (username,)).fetchall()
+        return [date for (date,) in rows]
+
+    def status_counts(self) -> Dict[str, int]:
+        """Return the number of users in each status"""
+        with self.lock:
+            rows = self.connection.execute("SELECT status, COUNT(*) FROM users GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
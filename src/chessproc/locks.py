@@ -0,0 +1,88 @@
+
+# Locks on the stored files of a username, shared by the threads of a process and by every process using the directory
+#
+# The app, the scheduler, the bulk ingest, the pgn import and the server workers all write the parquet, cube, tree,
+# opponent index and dataset partition of a username through fixed temporary files.  Every path writing them holds
+# the lock of the username, a lock file under .locks/ locked with flock(or msvcrt on Windows) and a reentrant thread
+# lock, so the paths can call each other while holding it.  Writing a dataset partition also holds the dataset lock,
+# as it reads the game ids stored by every other username.
+
+from contextlib import contextmanager
+import os
+from threading import Lock, RLock
+import time
+from typing import Dict, IO, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+locks_directory = ".locks/"
+
+_thread_locks: Dict[str, RLock] = {}
+_thread_locks_lock = Lock()
+_depths: Dict[str, int] = {}
+_files: Dict[str, IO] = {}
+
+
+def lock_filepath(username: str, base_directory_name: str) -> str:
+    return f"{base_directory_name}{locks_directory}{username}.lock"
+
+
+def _lock_file(fh: IO) -> None:
+    """Block until the lock file is locked by this process"""
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        return
+    fh.seek(0)
+    while True:
+        try:
+            msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK gives up after 10 seconds
+            time.sleep(0.1)
+
+
+def _unlock_file(fh: IO) -> None:
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    else:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(filepath: str) -> Iterator[None]:
+    """Hold the lock file, reentrant within a thread, the file is locked by the outermost holder only"""
+    with _thread_locks_lock:
+        thread_lock = _thread_locks.setdefault(filepath, RLock())
+
+    with thread_lock:
+        if not _depths.get(filepath):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            fh = open(filepath, "a+")
+            _lock_file(fh)
+            _files[filepath] = fh
+        _depths[filepath] = _depths.get(filepath, 0) + 1
+        try:
+            yield
+        finally:
+            _depths[filepath] -= 1
+            if not _depths[filepath]:
+                fh = _files.pop(filepath)
+                _unlock_file(fh)
+                fh.close()
+
+
+def user_lock(username: str, base_directory_name: str):
+    """Lock held while the stored files of the username are written, so two writers never overlap"""
+    return file_lock(lock_filepath(username, base_directory_name))
+
+
+def dataset_lock(base_directory_name: str):
+    """Lock held while a partition of the shared dataset is written, taken after the lock of the username when both are held"""
+    # Usernames never start with a dot
+    return file_lock(lock_filepath(".dataset", base_directory_name))
@@ -0,0 +1,130 @@
+
+# Opening tree of a username, game counts by colour and result after every move sequence of the first plies
+#
+# The tree is a table with one row per move sequence(prefix, the space separated SAN moves), colour and result,
+# sorted by prefix so the node of a sequence and the moves played after it are found by binary search.  It is written
+# with the parquet of the username and updated with the games upserted into it, like the cube.
+
+import os
+import re
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from . import schema
+from .locks import user_lock
+
+tree_directory = ".trees/"
+tree_depth = 12
+
+dimensions = ["prefix", "player_is_white", "player_result"]
+
+
+def tree_filepath(username: str, base_directory_name: str) -> str:
+    return f"{base_directory_name}{tree_directory}{username}.parquet"
+
+
+def parse_moves(text: str) -> List[str]:
+    """Split a move sequence like '1.e4 c5 2.Nf3 d6' into SAN moves, move numbers are dropped"""
+    return re.sub(r'[0-9]+\.+', ' ', text).split()
+
+
+def format_moves(moves: List[str]) -> str:
+    """Write SAN moves as a numbered move sequence"""
+    return " ".join([f"{i // 2 + 1}.{move}" if i % 2 == 0 else move for i, move in enumerate(moves)])
+
+
+def format_tree(tree: pd.DataFrame) -> pd.DataFrame:
+    """Sort the tree by prefix and give it its dtypes"""
+    tree = tree.astype({"prefix": object, "player_is_white": bool, "player_result": np.int8, "count": np.int64})
+    tree["ply"] = (tree["prefix"].str.count(" ") + 1).astype(np.int8)
+    return tree.sort_values("prefix", kind="stable").reset_index(drop=True)
+
+
+def build_tree(game_data: pd.DataFrame, depth: int = tree_depth) -> pd.DataFrame:
+    """Count the games of the player game dataframe after each of their first depth plies, a sample of games(with a count column) is counted by its weights"""
+    weights = game_data["count"].to_numpy(dtype=np.float64) if "count" in game_data else np.ones(len(game_data))
+    prefixes, colours, results, counts = [], [], [], []
+    for moves, is_white, result, weight in zip(game_data["moves"], game_data["player_is_white"], game_data["player_result"], weights):
+        prefix = ""
+        for move in moves[:depth]:
+            prefix = f"{prefix} {move[1]}" if prefix else move[1]
+            prefixes.append(prefix)
+            colours.append(is_white)
+            results.append(result)
+            counts.append(weight)
+
+    nodes = pd.DataFrame({"prefix": prefixes, "player_is_white": colours, "player_result": results, "count": counts})
+    return format_tree(nodes.groupby(dimensions)["count"].sum().round().reset_index())
+
+
+def combine_trees(trees: List[pd.DataFrame], signs: Optional[List[int]] = None) -> pd.DataFrame:
+    """Add up the trees(subtracting those with sign -1), dropping nodes left without games"""
+    signs = signs or [1] * len(trees)
+    trees = [tree.assign(count=tree["count"] * sign) for tree, sign in zip(trees, signs) if len(tree)]
+    if not trees:
+        return format_tree(pd.DataFrame(columns=dimensions + ["count"]))
+
+    combined = pd.concat(trees).groupby(dimensions)["count"].sum().reset_index()
+    return format_tree(combined[combined["count"] > 0])
+
+
+def node_range(tree: pd.DataFrame, moves: List[str]) -> slice:
+    """Rows of the tree for the move sequence and every sequence continuing it, by binary search on the sorted prefixes"""
+    if not moves:
+        return slice(0, len(tree))
+    prefix = " ".join(moves)
+    prefixes = tree["prefix"].to_numpy()
+    start = np.searchsorted(prefixes, prefix, side="left")
+    end = np.searchsorted(prefixes, prefix + " \U0010ffff", side="right")
+    return slice(start, end)
+
+
+def node_counts(tree: pd.DataFrame, moves: List[str]) -> pd.DataFrame:
+    """Game counts by colour and result of the games reaching the move sequence"""
+    rows = tree.iloc[node_range(tree, moves)]
+    return rows[rows["prefix"] == " ".join(moves)][["player_is_white", "player_result", "count"]].reset_index(drop=True)
+
+
+def next_moves(tree: pd.DataFrame, moves: List[str]) -> pd.DataFrame:
+    """Game counts by colour and result for each move played after the move sequence"""
+    rows = tree.iloc[node_range(tree, moves)]
+    rows = rows[rows["ply"] == len(moves) + 1]
+    return rows.assign(move=rows["prefix"].str.rsplit(" ", n=1).str[-1])[["move", "player_is_white", "player_result", "count"]].reset_index(drop=True)
+
+
+def write_tree(username: str, tree: pd.DataFrame, base_directory_name: str) -> None:
+    """Write the tree of the username through a temporary file"""
+    filepath = tree_filepath(username, base_directory_name)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    schema.write_parquet(tree, filepath)
+
+
+def read_tree(username: str, base_directory_name: str) -> Optional[pd.DataFrame]:
+    """Read the tree of the username, None if it has none or it was written with another schema version"""
+    filepath = tree_filepath(username, base_directory_name)
+    if not os.path.isfile(filepath) or not schema.is_current(filepath):
+        return None
+    return format_tree(schema.read_parquet(filepath))
+
+
+def update_tree(username: str, removed: pd.DataFrame, added: pd.DataFrame, base_directory_name: str) -> None:
+    """Update the stored tree with games removed from and added to the parquet of the username, rebuilt on the next load if there is none"""
+    tree = read_tree(username, base_directory_name)
+    if tree is not None:
+        write_tree(username, combine_trees([tree, build_tree(removed), build_tree(added)], signs=[1, -1, 1]), base_directory_name)
+
+
+def get_tree(username: str, game_data: pd.DataFrame, base_directory_name: str) -> pd.DataFrame:
+    """Return the tree of the username for the loaded games, rebuilding it when missing or when its root count differs from the games"""
+    tree = read_tree(username, base_directory_name)
+    if tree is None or tree.loc[tree["ply"] == 1, "count"].sum() != (game_data["game_length"] > 0).sum():
+        # Read again under the lock, another process may have rebuilt it while this one waited
+        with user_lock(username, base_directory_name):
+            tree = read_tree(username, base_directory_name)
+            if tree is None or tree.loc[tree["ply"] == 1, "count"].sum() != (game_data["game_length"] > 0).sum():
+                tree = build_tree(game_data)
+                write_tree(username, tree, base_directory_name)
+
+    return tree
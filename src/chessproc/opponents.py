@@ -0,0 +1,79 @@
+
+# Opponent index of a username, the games, score by colour, mean elo difference and last game against each opponent
+#
+# The index is one groupby over the games, sorted by game count, and is written with the parquet of the username like
+# the cube.  It backs the opponent completion of the view, so it is kept small: one row per opponent.
+
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from . import schema
+from .dfproc import start_times
+from .locks import user_lock
+
+opponents_directory = ".opponents/"
+
+
+def index_filepath(username: str, base_directory_name: str) -> str:
+    return f"{base_directory_name}{opponents_directory}{username}.parquet"
+
+
+def opponent_names(game_data: pd.DataFrame) -> pd.Series:
+    """Name of the opponent of the player of interest in each game"""
+    return game_data["Black"].astype(object).where(game_data["player_is_white"].to_numpy(), game_data["White"].astype(object))
+
+
+def build_index(game_data: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate the player game dataframe by opponent, most played opponents first"""
+    is_white = game_data["player_is_white"].to_numpy()
+    points = game_data["player_result"].to_numpy(dtype=np.float64) / 2
+    frame = pd.DataFrame({"opponent": opponent_names(game_data).to_numpy(),
+                          "white_games": is_white,
+                          "black_games": ~is_white,
+                          "white_points": np.where(is_white, points, 0),
+                          "black_points": np.where(is_white, 0, points),
+                          "mean_elo_difference": game_data["elo_difference"].to_numpy(dtype=np.float64),
+                          "last_played": start_times(game_data)})
+    index = frame.groupby("opponent", sort=False).agg(games=("white_games", "size"), white_games=("white_games", "sum"), black_games=("black_games", "sum"),
+                                                      white_points=("white_points", "sum"), black_points=("black_points", "sum"),
+                                                      mean_elo_difference=("mean_elo_difference", "mean"), last_played=("last_played", "max"))
+
+    # Scores are points per game, NaN for a colour never played against the opponent
+    index["score"] = (index["white_points"] + index["black_points"]) / index["games"]
+    index["white_score"] = index["white_points"] / index["white_games"].where(index["white_games"] > 0)
+    index["black_score"] = index["black_points"] / index["black_games"].where(index["black_games"] > 0)
+    index = index.drop(columns=["white_points", "black_points"]).reset_index()
+
+    return index.sort_values(["games", "opponent"], ascending=[False, True], kind="stable").set_index("opponent")
+
+
+def write_index(username: str, index: pd.DataFrame, base_directory_name: str) -> None:
+    """Write the opponent index of the username through a temporary file"""
+    filepath = index_filepath(username, base_directory_name)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    schema.write_parquet(index, filepath)
+
+
+def read_index(username: str, base_directory_name: str) -> Optional[pd.DataFrame]:
+    """Read the opponent index of the username, None if it has none or it was written with another schema version"""
+    filepath = index_filepath(username, base_directory_name)
+    if not os.path.isfile(filepath) or not schema.is_current(filepath):
+        return None
+    return schema.read_parquet(filepath)
+
+
+def get_index(username: str, game_data: pd.DataFrame, base_directory_name: str) -> pd.DataFrame:
+    """Return the opponent index of the username for the loaded games, rebuilding it when missing or when its count differs from the games"""
+    index = read_index(username, base_directory_name)
+    if index is None or index["games"].sum() != len(game_data):
+        # Read again under the lock, another process may have rebuilt it while this one waited
+        with user_lock(username, base_directory_name):
+            index = read_index(username, base_directory_name)
+            if index is None or index["games"].sum() != len(game_data):
+                index = build_index(game_data)
+                write_index(username, index, base_directory_name)
+
+    return index
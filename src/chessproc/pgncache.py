@@ -0,0 +1,81 @@
+
+# Per-user manifest of the month pgn files and cache of their parsed dataframes, unchanged files are not parsed again
+
+import hashlib
+import json
+import logging
+import os
+from typing import Callable, Dict, Optional, Tuple
+
+import pandas as pd
+
+from . import pgnstore, schema
+
+manifest_name = "manifest.json"
+
+
+def cache_directory(username: str, base_directory_name: str) -> str:
+    """Directory holding the manifest and parsed month files of the username, creating it if needed"""
+    directory = f"{base_directory_name}.cache/{username}/"
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def load_manifest(username: str, base_directory_name: str) -> Dict[str, Dict]:
+    """Read the manifest of the username, empty if there is none or it cannot be read"""
+    filepath = cache_directory(username, base_directory_name) + manifest_name
+    try:
+        with open(filepath) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(username: str, manifest: Dict[str, Dict], base_directory_name: str) -> None:
+    """Write the manifest of the username, through a temporary file so a crash never leaves half a manifest"""
+    filepath = cache_directory(username, base_directory_name) + manifest_name
+    with open(filepath + ".tmp", 'w') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def file_digest(filepath: str) -> str:
+    """Hash the decompressed pgn of the month file a frame at a time, so recompressing or migrating a month keeps its hash"""
+    digest = hashlib.blake2b(digest_size=16)
+    for frame in pgnstore.iter_frames(filepath):
+        digest.update(frame.encode())
+    return digest.hexdigest()
+
+
+def cached_parse(username: str, date: str, filepath: str, manifest: Dict[str, Dict], parse: Callable[[str], pd.DataFrame], base_directory_name: str) -> Tuple[pd.DataFrame, bool]:
+    """Return the parsed dataframe of the month file and whether it had to be parsed, updates the manifest entry in place.
+
+    The file is unchanged if its size and mtime match the manifest, or failing that if its content hash matches.
+    """
+    cache_filepath = cache_directory(username, base_directory_name) + date + ".parquet"
+    stat = os.stat(filepath)
+    entry = manifest.get(date)
+    usable = entry is not None and entry.get("schema_version") == schema.schema_version and os.path.isfile(cache_filepath)
+
+    # Same size and mtime, trust the cache without reading the file
+    if usable and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return schema.read_parquet(cache_filepath), False
+
+    # Touched but same content(rewritten by a refresh), update the stat and use the cache
+    digest = file_digest(filepath)
+    if usable and entry["hash"] == digest:
+        entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        return schema.read_parquet(cache_filepath), False
+
+    logging.warning(f"Parsing {date} for {username}.")
+    month_df = parse(filepath)
+    store_parsed(username=username, date=date, filepath=filepath, manifest=manifest, month_df=month_df, base_directory_name=base_directory_name, digest=digest)
+
+    return month_df, True
+
+
+def store_parsed(username: str, date: str, filepath: str, manifest: Dict[str, Dict], month_df: pd.DataFrame, base_directory_name: str, digest: Optional[str] = None) -> None:
+    """Cache the dataframe parsed from the month file and record the file in the manifest, used when the pgn was parsed before being read back"""
+    schema.write_parquet(month_df, cache_directory(username, base_directory_name) + date + ".parquet")
+    stat = os.stat(filepath)
+    manifest[date] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest or file_digest(filepath), "schema_version": schema.schema_version}
@@ -0,0 +1,155 @@
+
+# Streaming import of local pgn files(plain, gzip, bz2 or zstd compressed) into the datasets of tracked usernames
+#
+# Usage: python -m chessproc.pgnimport dump1.pgn.zst dump2.pgn.bz2 [--usernames a b] [--workers 4]
+#
+# Games of a tracked username are written in chunks to pgns/<username>/import-<file>-<path hash>-<chunk>.pgn.zst
+# files, which are parsed and cached like the month files and upserted into the parquet of the username.
+
+import argparse
+import bz2
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import hashlib
+import io
+import logging
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+import zstandard
+
+from . import pgncache, pgnstore
+from .locks import user_lock
+from .pgnproc import global_pgn_directory, make_directory, parse_month_file, update_parquet_by_username, write_month_file
+
+chunk_size = 5000
+player_header = re.compile(r'\[(White|Black) \"(.*?)\"\]')
+
+
+def open_pgn(filepath: str) -> TextIO:
+    """Open a pgn file as a text stream, decompressing by file extension"""
+    if filepath.endswith(".gz"):
+        return gzip.open(filepath, 'rt', errors="replace")
+    elif filepath.endswith(".bz2"):
+        return bz2.open(filepath, 'rt', errors="replace")
+    elif filepath.endswith(".zst"):
+        # read_across_frames so files made of several zstd frames are read to the end
+        reader = zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb'), read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, errors="replace")
+    else:
+        return open(filepath, errors="replace")
+
+
+def iter_games(lines: Iterable[str]) -> Iterator[str]:
+    """Split a stream of pgn lines into game texts, a game ends where the header block of the next game starts"""
+    game: List[str] = []
+    in_moves = False
+    for line in lines:
+        if line.startswith('[') and in_moves:
+            yield "".join(game).strip()
+            game = []
+            in_moves = False
+        elif line.strip() and not line.startswith('['):
+            in_moves = True
+        game.append(line)
+
+    if "".join(game).strip():
+        yield "".join(game).strip()
+
+
+def game_players(game: str) -> List[str]:
+    """Return the lowercased White and Black usernames from the game headers"""
+    return [player.lower() for _, player in player_header.findall(game)]
+
+
+def import_file(filepath: str, usernames: List[str], base_directory_name: str = global_pgn_directory) -> Dict[str, Dict[str, Dict]]:
+    """Stream a pgn file, writing the games of the usernames in chunks and caching the parsed chunks.
+
+    Only one chunk of games per username is held in memory.  Chunks are parsed here so parsing runs in the worker
+    processes, return the manifest entries of the new chunks by username for the caller to record.
+    """
+    tracked = {username.lower(): username for username in usernames}
+    # Chunks are named from the file name and a hash of its full path, so files with the same name never share chunks
+    stem = re.sub(r'[^0-9a-zA-Z_-]', '_', os.path.basename(filepath).split('.')[0])
+    stem = f"{stem}-{hashlib.sha1(os.path.abspath(filepath).encode()).hexdigest()[:8]}"
+    buffers: Dict[str, List[str]] = {username: [] for username in usernames}
+    chunk_counts: Dict[str, int] = {username: 0 for username in usernames}
+    manifests: Dict[str, Dict[str, Dict]] = {username: {} for username in usernames}
+
+    def flush(username: str) -> None:
+        """Write, parse and cache the buffered games of the username, a chunk that cannot be parsed is removed and skipped"""
+        date = f"import-{stem}-{chunk_counts[username]:05d}"
+        chunk_filepath = pgnstore.month_filepath(username, date, base_directory_name)
+        pgn = "\n\n\n".join(buffers[username]) + "\n"
+        buffers[username] = []
+        chunk_counts[username] += 1
+
+        # The games are located in the written chunk, so it is parsed after writing and removed again if parsing fails,
+        # a chunk left behind would fail every later rebuild of the username
+        write_month_file(chunk_filepath, pgn)
+        try:
+            month_df = parse_month_file(chunk_filepath)
+            pgncache.store_parsed(username=username, date=date, filepath=chunk_filepath, manifest=manifests[username], month_df=month_df, base_directory_name=base_directory_name)
+        except Exception as err:
+            os.remove(chunk_filepath)
+            manifests[username].pop(date, None)
+            logging.warning(f"Skipped chunk {date} of {filepath} for {username}, it could not be parsed: {err!r}.")
+
+    with open_pgn(filepath) as fh:
+        for game in iter_games(fh):
+            for player in set(game_players(game)):
+                username = tracked.get(player)
+                if username is not None:
+                    buffers[username].append(game)
+                    if len(buffers[username]) >= chunk_size:
+                        flush(username)
+
+    for username in usernames:
+        if buffers[username]:
+            flush(username)
+    logging.warning(f"Imported {filepath}: {({username: count for username, count in chunk_counts.items() if count})} chunks.")
+
+    return manifests
+
+
+def import_files(filepaths: List[str], usernames: List[str], base_directory_name: str = global_pgn_directory, workers: Optional[int] = None) -> Dict[str, int]:
+    """Import the pgn files in parallel, one file per worker process, then upsert the new games into the parquet of each username.
+
+    Return the number of games stored for each username that had games imported.
+    """
+    for username in usernames:
+        make_directory(username=username, pgn_directory=base_directory_name)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(import_file, filepaths, [usernames] * len(filepaths), [base_directory_name] * len(filepaths)))
+
+    # Record the chunks parsed by the workers so they are served from the cache, then upsert them
+    game_counts = {}
+    for username in usernames:
+        new_entries = {date: entry for result in results for date, entry in result[username].items()}
+        if not new_entries:
+            continue
+        with user_lock(username, base_directory_name):
+            manifest = pgncache.load_manifest(username=username, base_directory_name=base_directory_name)
+            manifest.update(new_entries)
+            pgncache.save_manifest(username=username, manifest=manifest, base_directory_name=base_directory_name)
+            game_counts[username] = update_parquet_by_username(username=username, dates=sorted(new_entries), base_directory_name=base_directory_name)
+
+    return game_counts
+
+
+def tracked_usernames(base_directory_name: str = global_pgn_directory) -> List[str]:
+    """Return the usernames that have a parquet file"""
+    return sorted([file[:-8] for file in os.listdir(base_directory_name) if file.endswith('.parquet')])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import games of tracked usernames from local pgn files, optionally gzip, bz2 or zstd compressed.")
+    parser.add_argument("files", nargs="+", help="pgn files to import")
+    parser.add_argument("--usernames", nargs="+", default=None, help="Usernames to import games for, defaults to the usernames with a parquet file")
+    parser.add_argument("--pgn-directory", default=global_pgn_directory, help="Directory for the pgn and parquet files")
+    parser.add_argument("--workers", type=int, default=None, help="Number of files imported at once")
+    args = parser.parse_args()
+
+    print(import_files(args.files, args.usernames or tracked_usernames(args.pgn_directory), base_directory_name=args.pgn_directory, workers=args.workers))
@@ -2,78 +2,74 @@
 # A collection of functions to create a dataframe from a pgn and write to and read from parquet files
 
 import asyncio
+import logging
 import os
 from pathlib import Path
 import re
-from typing import Coroutine, Dict, List, Optional
+from threading import Event
+from typing import Callable, Coroutine, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
-from chessdotcom.aio import ChessDotComError, Client, get_player_game_archives, get_player_games_by_month_pgn, get_player_stats
-from . import dfproc
+from chessdotcom.aio import ChessDotComError
+from . import clocks, cube, dfproc, gamestore, openingtree, opponents, pgncache, pgnstore, schema, timecontrol
+from .chessclient import get_client
+from .locks import user_lock
 
-read_size = 1000000
 global_pgn_directory = str(Path(__file__).parent.parent.parent) + "/pgns/"
 
-Client.rate_limit_handler.retries = 4
-Client.rate_limit_handler.tts = 2
-tts_divisor = 6
+# Headers expected by gamelist_to_df, games from other sources(bulk pgn dumps) may be missing some of them
+header_columns = ["Event", "Site", "Date", "Round", "White", "Black", "Result", "Timezone", "ECO", "ECOUrl", "UTCDate", "UTCTime",
+                  "WhiteElo", "BlackElo", "TimeControl", "Termination", "StartTime", "EndDate", "EndTime"]
 
-# These functions are used in order to request pgn files from chess.com for a given list of usernames
 
 
-async def gather_cors(cors: List[Coroutine]):
-    """Run gather for given list of coroutines, return result"""
-    responses = await asyncio.gather(*cors)
-    return responses
+class IngestCancelled(Exception):
+    """Raised when a download or parquet build is cancelled through its cancel event"""
 
 
-async def save_player_games_by_month(username: str, year: str, month: str, pgn_directory: str = global_pgn_directory, tts=0) -> None:
-    """Wrapper for get_player_games_by_month_pgn that saves the pgns directly to an appropriate directory.  It is assumed that the username directory exists."""
-    filepath = f"{pgn_directory}{username}/{year}-{month}.txt"
-    # This is an exceptionally bad handling of the possibility of a 429 error from chess.com, has worked so far though
-    try:
-        print(f"Start file {year}-{month} for {username}.")
-        data = await get_player_games_by_month_pgn(username=username, year=year, month=month, tts=tts)
-    except ChessDotComError:
-        print(f"Failure on {year}-{month} for {username}.  Trying again.")
-        data = await get_player_games_by_month_pgn(username=username, year=year, month=month)
+def check_cancel(cancel: Optional[Event]) -> None:
+    """Raise IngestCancelled if the cancel event has been set"""
+    if cancel is not None and cancel.is_set():
+        raise IngestCancelled()
 
-    # Write the result to appropriate file
-    with open(filepath, 'w') as fh:
-        fh.write(data.text)
-    print(f"Wrote file {year}-{month} for {username}.")
 
+def report(progress: Optional[Callable[[str], None]], message: str) -> None:
+    """Pass the progress message to the progress callback if there is one"""
+    if progress is not None:
+        progress(message)
 
-def make_player_games_by_month_coro(requests: Dict[str, Dict]) -> List[Coroutine]:
-    """Given requests dictionary, make coroutines for all dates"""
-    cors = []
-    for username, response in requests.items():
-        cors.extend([save_player_games_by_month(username, response["Dates"][i][:4], response["Dates"][i][-2:], tts=i/tts_divisor) for i in range(len(response["Dates"]))])
-        make_directory(username=username, pgn_directory=global_pgn_directory)
-    
-    return cors
 
+def write_month_file(filepath: str, pgn: str) -> None:
+    """Write the month pgn compressed to the store, through a temporary file so an interrupted write never leaves a partial month file"""
+    pgnstore.write_month(filepath, pgn)
 
-def alt_make_queries(coro: List[Coroutine]) -> None:
-    """Given list of coroutines, run them all, no return"""
-    asyncio.run(gather_cors(coro))
+
+# These functions are used in order to request pgn files from chess.com for a given list of usernames
+
+
+async def gather_cors(cors: List[Coroutine]):
+    """Run gather for given list of coroutines, return result"""
+    responses = await asyncio.gather(*cors)
+    return responses
 
 
 def get_player_months(usernames: List["str"]) -> Dict[str, Dict[str, List[str]]]:
     """Get a list of the month archives of a player by username"""
-    cors = [get_player_game_archives(name) for name in usernames]
-    responses = asyncio.run(gather_cors(cors))
+    client = get_client()
+    cors = [client.get_player_game_archives(name) for name in usernames]
+    responses = client.submit(gather_cors(cors)).result()
 
     return {username: {"Dates": [response.json['archives'][i][-7:].replace("/", "-") for i in range(len(response.json['archives']))]} for username, response in zip(usernames, responses)}
 
 
 def get_player_game_count(username: str) -> Optional[int]:
     """Given username, query chess.com for the stats, sum up the number of games played"""
-    # Create and run coroutine to get the response
-    stats_coro = get_player_stats(username=username)
+    # Submit coroutine to the client and wait on the response
+    client = get_client()
     try:
-        resp = asyncio.run(stats_coro)
+        resp = client.submit(client.get_player_stats(username=username)).result()
     except ChessDotComError:
         return None
     
@@ -89,12 +85,12 @@ def get_player_game_count(username: str) -> Optional[int]:
 def get_dates_not_downloaded(responses: Dict[str, Dict[str, List[str]]], pgn_directory: str = global_pgn_directory) -> Dict[str, Dict[str, List[str]]]:
     """Diff the dates given by archives and the dates of files already downloaded, return dict of lists of dates to be requested"""
     for username, response in responses.items():
-        if os.path.exists(pgn_directory + username) and os.listdir(pgn_directory + username): # If path exists and is not empty
-            # Make the list of archives into set and difference to the existing files.
+        stored_dates = pgnstore.list_dates(username, pgn_directory)
+        if stored_dates: # If months are already stored, plain files are compressed on listing
+            # Make the list of archives into set and difference to the stored months.
             # This results in just the archive dates that aren't present in the directory
             # - With a bonus of including the latest month so as to get the current month games
-            # - This line spits in the face of readability
-            responses[username]["Dates"] = list(set(response["Dates"]).difference(set(list(map(lambda x: x[:7], os.listdir(pgn_directory + username))))).union(set([response["Dates"][-1]])))
+            responses[username]["Dates"] = list(set(response["Dates"]).difference(set([date[:7] for date in stored_dates])).union(set([response["Dates"][-1]])))
     
     return responses
 
@@ -102,7 +98,7 @@ def get_dates_not_downloaded(responses: Dict[str, Dict[str, List[str]]], pgn_dir
 def create_archive_requests(requests: Dict[str, Dict[str, List[str]]]) -> Dict[str, Dict]:
     """Take the list of dates and return the dictionary with an additional list of coroutines matching the dates"""
     for username, response in requests.items():
-        requests[username]["Coroutines"] = [get_player_games_by_month_pgn(username, response["Dates"][i][:4], response["Dates"][i][-2:]) for i in range(len(response["Dates"]))]
+        requests[username]["Coroutines"] = [get_client().get_player_games_by_month_pgn(username, response["Dates"][i][:4], response["Dates"][i][-2:]) for i in range(len(response["Dates"]))]
     
     return requests
 
@@ -113,14 +109,13 @@ def make_directory(username: str, pgn_directory: str = global_pgn_directory) ->
 
 
 def make_queries(requests: Dict[str, Dict], pgn_directory: str = global_pgn_directory) -> Dict[str, Dict]:
-    """Compete the coroutines and save to their respective files"""
+    """Compete the coroutines on the client event loop and save to their respective files"""
     for username, data in requests.items():
-        requests[username]["PGNs"] = asyncio.run(gather_cors(data["Coroutines"]))
+        requests[username]["PGNs"] = get_client().submit(gather_cors(data["Coroutines"])).result()
         requests[username]["PGNs"] = [x.text for x in requests[username]["PGNs"]]
         for date, pgn in zip(data["Dates"], data["PGNs"]):
             make_directory(username, pgn_directory=pgn_directory)
-            with open(f"{pgn_directory}{username}/{date}.txt", 'w') as fh:
-                fh.write(pgn)
+            write_month_file(pgnstore.month_filepath(username, date, pgn_directory), pgn)
         print(f"Completed requests for {username}.")
     return requests
 
@@ -137,23 +132,30 @@ def download_by_username_list(usernames: List[str]):
     return response
 
 
-def download_by_username_list_better(usernames: List[str]) -> None:
-    """Given list of usernames will download and save to file async"""
-    
-    response = get_player_months(usernames)
-    response = get_dates_not_downloaded(response)
-    coro = make_player_games_by_month_coro(requests=response)
-    alt_make_queries(coro=coro)
+# The functions below are used to go from pgn to a dataframe, optionally saved as a parquet file, then the data can be read from the files
 
 
-# The functions below are used to go from pgn to a dataframe, optionally saved as a parquet file, then the data can be read from the files
+# Moves of a pgn without clock comments(local database exports), black moves may have no move number, comments,
+# variations and annotation glyphs are removed first
+plain_move = re.compile(r'(?:([0-9]+[.]+) ?)?([a-zA-Z][a-zA-Z0-9+#=/-]*)')
+comment = re.compile(r'\{[^}]*\}|;[^\n]*|\$[0-9]+')
+variation = re.compile(r'\([^()]*\)')
+
+
+def plain_pgn_moves(game: str) -> list:
+    """Return the move tuples of a game whose moves have no clock comments, with an empty clock"""
+    movetext = comment.sub(" ", "\n".join([line for line in game.split("\n") if not line.startswith("[")]))
+    while variation.search(movetext):
+        movetext = variation.sub(" ", movetext)
+
+    return [(number, move, "") for number, move in plain_move.findall(movetext)]
 
 
 def pgn_to_gamelist(pgn: str) -> list:
     """Take a pgn string and return a list containing a list of dictionaries containing the game information."""
     # Compile re expressions to detect header information and individual moves
     header = re.compile(r'\[(.*?) \"(.*?)\"\]')
-    moves = re.compile(r'([0-9]*[.]+) ([a-zA-Z0-9+#=/]*) \{\[%clk ([0-9:.]*)\]\}')
+    moves = re.compile(r'([0-9]*[.]+) ([a-zA-Z0-9+#=/-]*) \{[^}]*?\[%clk ([0-9:.]*)\][^}]*\}')
 
     # Split pgn into games and prep loop
     raw_game_list = pgn.split('\n\n\n')
@@ -163,20 +165,35 @@ def pgn_to_gamelist(pgn: str) -> list:
     for game in raw_game_list:
         game_list.append(dict(header.findall(game)))
         game_list[-1]["pgn"] = game
-        game_list[-1]['moves'] = moves.findall(game)
+        game_list[-1]['moves'] = moves.findall(game) or plain_pgn_moves(game)
     
     return game_list
 
 
-def gamelist_to_df(gamelist: list) -> pd.DataFrame:
-    """Take a list of game dictionaries(derived from pgn using pgn_to_gamelist and return a dataframe containing the formatted information."""
-    game_df = pd.DataFrame(data = gamelist)
+def locate_games(gamelist: list, key: str, frame: int) -> list:
+    """Record the month key, frame index and byte offset and length of each game of a frame in its game dictionary, in place"""
+    offset = 0
+    for game in gamelist:
+        length = len(game["pgn"].encode())
+        game.update(pgn_file=key, pgn_frame=frame, pgn_offset=offset, pgn_length=length)
+        offset += length + len(pgnstore.game_separator)
+
+    return gamelist
+
 
-    # Format columns
-    game_df[["UTCDate", "Date", "EndDate"]] = game_df[["UTCDate", "Date", "EndDate"]].apply(pd.to_datetime)
-    game_df[["UTCTime", "StartTime", "EndTime"]] = game_df[["UTCTime", "StartTime", "EndTime"]].apply(pd.to_timedelta)
-    game_df[["BlackElo", "WhiteElo"]] = game_df[["BlackElo", "WhiteElo"]].apply(pd.to_numeric)
-    for col in ["Event", "Site", "Timezone", "ECOUrl", "TimeControl"]:
+def game_id(game_df: pd.DataFrame) -> pd.Series:
+    """Hash the url of each game to a 64 bit game id, the url is the Link header, falling back to Site when it is a url and then to the pgn"""
+    key = game_df["Link"] if "Link" in game_df else pd.Series(np.nan, index=game_df.index, dtype=object)
+    if "Site" in game_df:
+        key = key.fillna(game_df["Site"].where(game_df["Site"].astype(str).str.startswith("http")))
+    key = key.fillna(game_df["pgn"])
+
+    return pd.Series(pd.util.hash_pandas_object(key, index=False).values, index=game_df.index, name="game_id")
+
+
+def format_categoricals(game_df: pd.DataFrame) -> pd.DataFrame:
+    """Make the header columns categorical, used on fresh dataframes and after concatenating dataframes"""
+    for col in ["Event", "Site", "Round", "White", "Black", "Timezone", "TimeControl", "Termination"]:
         game_df[col] = pd.Categorical(game_df[col])
     
     game_df["Result"] = pd.Categorical(game_df["Result"], categories=["1-0", "1/2-1/2", "0-1"])
@@ -187,53 +204,352 @@ def gamelist_to_df(gamelist: list) -> pd.DataFrame:
     return game_df
 
 
-def construct_parquet_by_username(username: str, base_directory_name: str = global_pgn_directory):
-    """Given username, reads all pgns in directory and creates a parquet"""
-    pgn_directory_name = base_directory_name + username + "/"
-    gamelist = []
+def gamelist_to_df(gamelist: list) -> pd.DataFrame:
+    """Take a list of game dictionaries(derived from pgn using pgn_to_gamelist and return a dataframe containing the formatted information, indexed by game id."""
+    game_df = pd.DataFrame(data = gamelist)
+    for col in header_columns:
+        if col not in game_df:
+            game_df[col] = np.nan
+
+    # Index by the hash of the game url, dropping repeated games, the pgn itself is read from the month file when needed
+    game_df.index = pd.Index(game_id(game_df))
+    game_df = game_df[~game_df.index.duplicated(keep='last')].drop(columns="pgn")
+
+    # Format columns, partial dates and times of local pgns('2023.??.??') are missing
+    game_df[["UTCDate", "Date", "EndDate"]] = game_df[["UTCDate", "Date", "EndDate"]].apply(pd.to_datetime, errors="coerce")
+    game_df[["UTCTime", "StartTime", "EndTime"]] = game_df[["UTCTime", "StartTime", "EndTime"]].apply(pd.to_timedelta, errors="coerce")
+    game_df[["BlackElo", "WhiteElo"]] = game_df[["BlackElo", "WhiteElo"]].apply(pd.to_numeric, errors="coerce", downcast="integer")
+
+    # Games of unrated players('?') have no elo difference and unfinished games('*') no player result, both are dropped
+    unrated = game_df[["BlackElo", "WhiteElo"]].isna().any(axis=1)
+    unfinished = ~game_df["Result"].isin(["1-0", "1/2-1/2", "0-1"])
+    if unrated.any() or unfinished.any():
+        logging.warning(f"Dropping {unrated.sum()} games with an unknown elo and {(unfinished & ~unrated).sum()} unfinished games.")
+        game_df = game_df[~(unrated | unfinished)].copy()
 
-    # For each pgn file in the directory, open/read and append to the list
-    for file in os.listdir(pgn_directory_name):
-       if file[-4:] == ".txt":
-            with open(pgn_directory_name + file) as fh:
-                data = fh.read(read_size)
-            gamelist.extend(pgn_to_gamelist(data))
+    # Local pgns often have no Termination header
+    game_df["Termination"] = game_df["Termination"].fillna("Unknown")
 
-    # Convert all collected games in listto dataframe
-    player_df = gamelist_to_df(gamelist=gamelist)
+    return format_categoricals(game_df)
 
-    # Perform some processing for the dfs
-    player_df = df_preprocessing(player_df, username)
-    player_df['Username'] = username
 
-    # Save df to parquet file
-    player_df.to_parquet(base_directory_name + username + ".parquet")
+def upsert_games(game_data: pd.DataFrame, new_game_data: pd.DataFrame) -> pd.DataFrame:
+    """Insert new games into the game dataframe by game id, a new game replaces a stored game with the same id"""
+    new_game_data = new_game_data[~new_game_data.index.duplicated(keep='last')]
+    game_data = pd.concat([game_data[~game_data.index.isin(new_game_data.index)], new_game_data])
 
-    return len(gamelist)
+    return format_categoricals(game_data)
+
+
+def parse_month_file(filepath: str) -> pd.DataFrame:
+    """Parse a compressed month file to a game dataframe one frame at a time, recording where each game is, empty if the file holds no games"""
+    key = pgnstore.month_key(filepath)
+    gamelist = [game for frame, text in enumerate(pgnstore.iter_frames(filepath)) for game in locate_games(pgn_to_gamelist(text), key, frame) if "White" in game and "Black" in game]
+
+    return gamelist_to_df(gamelist=gamelist) if len(gamelist) else pd.DataFrame()
+
+
+def game_pgns(game_data: pd.DataFrame, base_directory_name: str = global_pgn_directory) -> pd.Series:
+    """Read the pgns of the games in the dataframe from their month files, each month file is opened once, indexed like the dataframe"""
+    pgns = []
+    for key, locations in game_data[["pgn_file", "pgn_frame", "pgn_offset", "pgn_length"]].groupby("pgn_file", observed=True, sort=False):
+        games = pgnstore.read_games(pgnstore.key_filepath(key, base_directory_name), locations[["pgn_frame", "pgn_offset", "pgn_length"]].itertuples(index=False))
+        pgns.append(pd.Series(games, index=locations.index, dtype=object))
+
+    return pd.concat(pgns).reindex(game_data.index) if pgns else pd.Series(index=game_data.index, dtype=object)
+
+
+def game_pgn(game_data: pd.DataFrame, game_id: int, base_directory_name: str = global_pgn_directory) -> str:
+    """Read the pgn of one game of the dataframe by game id"""
+    return game_pgns(game_data.loc[[game_id]], base_directory_name=base_directory_name).iloc[0]
+
+
+def read_month_dfs(username: str, dates: List[str], base_directory_name: str = global_pgn_directory, progress: Optional[Callable[[str], None]] = None, cancel: Optional[Event] = None) -> List[pd.DataFrame]:
+    """Return the game dataframes of the given months for the username, only months whose file changed since the last read are parsed"""
+    manifest = pgncache.load_manifest(username=username, base_directory_name=base_directory_name)
+    month_dfs = []
+    parsed_count = 0
+    for i, date in enumerate(dates):
+        check_cancel(cancel)
+        report(progress, f"Reading {date} ({i + 1}/{len(dates)})...")
+        filepath = pgnstore.month_file(username, date, base_directory_name)
+        if filepath is not None:
+            month_df, parsed = pgncache.cached_parse(username=username, date=date, filepath=filepath, manifest=manifest, parse=parse_month_file, base_directory_name=base_directory_name)
+            month_dfs.append(month_df)
+            parsed_count += parsed
+    pgncache.save_manifest(username=username, manifest=manifest, base_directory_name=base_directory_name)
+    logging.warning(f"Parsed {parsed_count} of {len(month_dfs)} month files for {username}.")
+
+    return [month_df for month_df in month_dfs if len(month_df)]
+
+
+def combine_month_dfs(month_dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate month game dataframes, dropping repeated games and restoring the categorical columns"""
+    game_df = pd.concat(month_dfs)
+    game_df = game_df[~game_df.index.duplicated(keep='last')].copy()
+
+    return format_categoricals(game_df)
+
+
+def downloaded_dates(username: str, base_directory_name: str = global_pgn_directory) -> List[str]:
+    """Return the sorted dates of the month files downloaded for the username"""
+    return pgnstore.list_dates(username, base_directory_name)
+
+
+def write_player_parquet(username: str, month_dfs: List[pd.DataFrame], base_directory_name: str = global_pgn_directory, progress: Optional[Callable[[str], None]] = None, cancel: Optional[Event] = None) -> int:
+    """Combine the month dataframes of the username into the parquet of the username, replacing it, return the number of stored games"""
+    with user_lock(username, base_directory_name):
+        player_df = combine_month_dfs(month_dfs)
+
+        # Perform some processing for the dfs
+        report(progress, f"Processing {len(player_df)} games...")
+        player_df = df_preprocessing(player_df, username)
+        player_df['Username'] = username
+
+        # Save df to parquet file, schema is enforced on write
+        check_cancel(cancel)
+        report(progress, "Writing parquet...")
+        schema.write_parquet(player_df, base_directory_name + username + ".parquet")
+        cube.write_cube(username, cube.build_cube(player_df), base_directory_name)
+        openingtree.write_tree(username, openingtree.build_tree(player_df), base_directory_name)
+        gamestore.write_user_games(username, player_df, base_directory_name)
+        opponents.write_index(username, opponents.build_index(player_df), base_directory_name)
+
+        return len(player_df)
+
+
+def read_player_parquet(username: str, base_directory_name: str = global_pgn_directory) -> pd.DataFrame:
+    """Read the parquet of the username, computing the stale derived columns again and writing them back with the cube, tree and dataset"""
+    filename = base_directory_name + username + ".parquet"
+    if not schema.stale_derived(filename):
+        return schema.read_parquet(filename)
+
+    # Another writer may have written the columns while this one waited on the lock
+    with user_lock(username, base_directory_name):
+        stale = schema.stale_derived(filename)
+        player_df = schema.read_parquet(filename)
+        if stale:
+            logging.warning(f"Computing derived columns {stale} again for {username}.")
+            add_derived_columns(player_df, username, stale)
+            schema.write_parquet(player_df, filename)
+            cube.write_cube(username, cube.build_cube(player_df), base_directory_name)
+            openingtree.write_tree(username, openingtree.build_tree(player_df), base_directory_name)
+            gamestore.write_user_games(username, player_df, base_directory_name)
+            opponents.write_index(username, opponents.build_index(player_df), base_directory_name)
+
+    return player_df
+
+
+def upsert_player_parquet(username: str, month_dfs: List[pd.DataFrame], base_directory_name: str = global_pgn_directory, progress: Optional[Callable[[str], None]] = None, cancel: Optional[Event] = None) -> int:
+    """Upsert the games of the month dataframes into the existing parquet of the username, return the number of stored games"""
+    with user_lock(username, base_directory_name):
+        filename = base_directory_name + username + ".parquet"
+        player_df = read_player_parquet(username, base_directory_name)
+        if len(month_dfs):
+            report(progress, "Processing new games...")
+            new_df = df_preprocessing(combine_month_dfs(month_dfs), username)
+            new_df['Username'] = username
+            removed_df = player_df[player_df.index.isin(new_df.index)]
+            player_df = upsert_games(player_df, new_df)
+            check_cancel(cancel)
+            report(progress, "Writing parquet...")
+            schema.write_parquet(player_df, filename)
+            cube.update_cube(username, removed_df, new_df, base_directory_name)
+            openingtree.update_tree(username, removed_df, new_df, base_directory_name)
+            gamestore.write_user_games(username, player_df, base_directory_name)
+            opponents.write_index(username, opponents.build_index(player_df), base_directory_name)
+
+        return len(player_df)
+
+
+def has_current_parquet(username: str, base_directory_name: str = global_pgn_directory) -> bool:
+    """Check the username has a parquet written with the current schema version"""
+    filename = base_directory_name + username + ".parquet"
+    return os.path.isfile(filename) and schema.is_current(filename)
+
+
+def construct_parquet_by_username(username: str, base_directory_name: str = global_pgn_directory, progress: Optional[Callable[[str], None]] = None, cancel: Optional[Event] = None):
+    """Given username, reads all pgns in directory and creates a parquet"""
+    with user_lock(username, base_directory_name):
+        # Collect the dataframe of each pgn file in the directory, from the cache where the file is unchanged
+        dates = downloaded_dates(username=username, base_directory_name=base_directory_name)
+        month_dfs = read_month_dfs(username=username, dates=dates, base_directory_name=base_directory_name, progress=progress, cancel=cancel)
+
+        return write_player_parquet(username=username, month_dfs=month_dfs, base_directory_name=base_directory_name, progress=progress, cancel=cancel)
+
+
+def update_parquet_by_username(username: str, dates: List[str], base_directory_name: str = global_pgn_directory, progress: Optional[Callable[[str], None]] = None, cancel: Optional[Event] = None) -> int:
+    """Parse the pgns of the given dates and upsert the games into the parquet of the username, return the number of stored games"""
+    with user_lock(username, base_directory_name):
+        if not has_current_parquet(username=username, base_directory_name=base_directory_name):
+            return construct_parquet_by_username(username=username, base_directory_name=base_directory_name, progress=progress, cancel=cancel)
+
+        month_dfs = read_month_dfs(username=username, dates=dates, base_directory_name=base_directory_name, progress=progress, cancel=cancel)
+
+        return upsert_player_parquet(username=username, month_dfs=month_dfs, base_directory_name=base_directory_name, progress=progress, cancel=cancel)
+
+
+# The functions below pipeline the download and the parsing, each month is parsed as soon as it arrives
+
+
+async def download_and_parse_months(username: str, download_dates: List[str], read_dates: List[str], base_directory_name: str = global_pgn_directory, progress: Optional[Callable[[str], None]] = None, cancel: Optional[Event] = None, queue_size: int = 4, on_downloaded: Optional[Callable[[str, int], None]] = None) -> List[pd.DataFrame]:
+    """Download the months in download_dates while parsing them, together with the already downloaded months in read_dates.
+
+    Downloads feed a bounded queue consumed by a single parser running in the executor.  A download holds a slot
+    from when its request starts until the parser takes its month, so no more than queue_size downloaded months are
+    held in memory at once and downloads wait when parsing falls behind.  on_downloaded is called with the date and
+    size in bytes of each month's pgn once its file is written.  Return the month dataframes.
+    """
+    client = get_client()
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    slots = asyncio.Semaphore(queue_size)
+    manifest = pgncache.load_manifest(username=username, base_directory_name=base_directory_name)
+    total = len(download_dates) + len(read_dates)
+    downloads: List[asyncio.Future] = []
+
+    async def download(date: str) -> None:
+        """Request the month, save it and queue its pgn for parsing"""
+        await slots.acquire()
+        if cancel is not None and cancel.is_set():
+            slots.release()
+            return
+        try:
+            data = await client.get_player_games_by_month_pgn(username=username, year=date[:4], month=date[-2:])
+        except ChessDotComError:
+            print(f"Failure on {date} for {username}.  Trying again.")
+            data = await client.get_player_games_by_month_pgn(username=username, year=date[:4], month=date[-2:])
+        await loop.run_in_executor(None, write_month_file, pgnstore.month_filepath(username, date, base_directory_name), data.text)
+        report(progress, f"Downloaded {date} for {username}.")
+        if on_downloaded is not None:
+            on_downloaded(date, len(data.text.encode()))
+        await queue.put((date, True))
+
+    async def produce() -> None:
+        """Queue the downloaded months for parsing then the downloads as they arrive, end with a sentinel"""
+        try:
+            for date in read_dates:
+                await queue.put((date, False))
+            downloads.extend([asyncio.ensure_future(download(date)) for date in download_dates])
+            await asyncio.gather(*downloads)
+        finally:
+            await queue.put(None)
+
+    def parse(date: str, downloaded: bool) -> Tuple[pd.DataFrame, bool]:
+        """Parse a downloaded month and cache it, or read an existing month through the cache"""
+        filepath = pgnstore.month_filepath(username, date, base_directory_name)
+        if not downloaded:
+            return pgncache.cached_parse(username=username, date=date, filepath=filepath, manifest=manifest, parse=parse_month_file, base_directory_name=base_directory_name)
+        month_df = parse_month_file(filepath)
+        pgncache.store_parsed(username=username, date=date, filepath=filepath, manifest=manifest, month_df=month_df, base_directory_name=base_directory_name)
+        return month_df, True
+
+    producer = asyncio.ensure_future(produce())
+    month_dfs = []
+    try:
+        while (item := await queue.get()) is not None:
+            date, downloaded = item
+            if downloaded:
+                slots.release()
+            check_cancel(cancel)
+            month_df, _ = await loop.run_in_executor(None, parse, date, downloaded)
+            month_dfs.append(month_df)
+            report(progress, f"Parsed {date} ({len(month_dfs)}/{total})...")
+        await producer
+    finally:
+        # A failed download, parse or cancel stops every other download, including those waiting on a slot that the
+        # parser will no longer release, so none is left running on the client loop
+        for task in [producer] + downloads:
+            task.cancel()
+        await asyncio.gather(producer, *downloads, return_exceptions=True)
+        pgncache.save_manifest(username=username, manifest=manifest, base_directory_name=base_directory_name)
+
+    check_cancel(cancel)
+    return [month_df for month_df in month_dfs if len(month_df)]
+
+
+def ingest_by_username(username: str, base_directory_name: str = global_pgn_directory, progress: Optional[Callable[[str], None]] = None, cancel: Optional[Event] = None) -> int:
+    """Download the missing months of the username parsing each as it arrives, then create the parquet or upsert the new months into it"""
+    with user_lock(username, base_directory_name):
+        response = get_dates_not_downloaded(get_player_months([username]), pgn_directory=base_directory_name)
+        make_directory(username=username, pgn_directory=base_directory_name)
+        download_dates = sorted(response[username]["Dates"])
+        report(progress, f"Downloading {len(download_dates)} months...")
+
+        # With a current parquet only the downloaded months are upserted, otherwise it is rebuilt from every month
+        update = has_current_parquet(username=username, base_directory_name=base_directory_name)
+        read_dates = [] if update else [date for date in downloaded_dates(username=username, base_directory_name=base_directory_name) if date not in download_dates]
+        month_dfs = get_client().submit(download_and_parse_months(username=username, download_dates=download_dates, read_dates=read_dates, base_directory_name=base_directory_name, progress=progress, cancel=cancel)).result()
+
+        if update:
+            return upsert_player_parquet(username=username, month_dfs=month_dfs, base_directory_name=base_directory_name, progress=progress, cancel=cancel)
+        return write_player_parquet(username=username, month_dfs=month_dfs, base_directory_name=base_directory_name, progress=progress, cancel=cancel)
+
+
+def add_time_control_columns(game_data: pd.DataFrame, username: str) -> None:
+    game_data[["base_time", "increment", "time_class"]] = timecontrol.parse_time_controls(game_data["TimeControl"])
+
+
+def add_clocks_column(game_data: pd.DataFrame, username: str) -> None:
+    game_data["clocks"] = clocks.parse_clocks(game_data["moves"])
+
+
+# Columns derived from the parsed columns, by the name their version is recorded under(schema.derived_versions), in
+# the order they are added.  Each function adds its columns to the game dataframe of the username from stored columns.
+derived_columns: Dict[str, Callable[[pd.DataFrame, str], None]] = {
+    "player_result":   lambda game_data, username: dfproc.add_player_specific_series(game_data, username, dfproc.player_result),
+    "player_is_white": lambda game_data, username: dfproc.add_player_specific_series(game_data, username, dfproc.player_is_white),
+    "elo_difference":  lambda game_data, username: dfproc.add_player_specific_series(game_data, username, dfproc.elo_difference),
+    "game_length":     lambda game_data, username: dfproc.add_series(game_data, dfproc.game_length),
+    "clocks":          add_clocks_column,
+    "time_control":    add_time_control_columns,
+}
+
+
+def add_derived_columns(game_data: pd.DataFrame, username: str, names: Optional[List[str]] = None) -> None:
+    """Add the derived columns with the given names to the game dataframe, all of them if no names are given"""
+    for name, add_column in derived_columns.items():
+        if names is None or name in names:
+            add_column(game_data, username)
 
 
 def df_preprocessing(game_data: pd.DataFrame, username: str):
     """Preprocessing of dataframes before saving them to parquet files.  Add some columns."""
-    # Do some filtering for anomalies
-    game_data = game_data[game_data.Termination.notnull()]
+    # Do some filtering for anomalies, games without a result have no player result
+    game_data = game_data[game_data.Result.notnull()].copy()
     
-    # Add player specific columns
-    dfproc.add_player_specific_series(game_data, username, dfproc.player_result)
-    dfproc.add_player_specific_series(game_data, username, dfproc.player_colour)
-    dfproc.add_player_specific_series(game_data, username, dfproc.elo_difference)
+    # Add the derived columns, player specific and game specific(player agnostic)
+    add_derived_columns(game_data, username)
 
-    # Add game specific(player agnostic) columns
-    dfproc.add_series(game_data, dfproc.game_length)
-
-    return game_data
+    # Games the player is not part of have no elo difference
+    return game_data[game_data.elo_difference.notnull()]
 
 
 def get_parquet_by_username(username: str, base_directory_name: str = global_pgn_directory, force_refresh: bool = False) -> Optional[pd.DataFrame]:
+    """Read the parquet file of the username, constructing it if missing, forced or written with an old schema version, stale derived columns are computed again"""
     filename = base_directory_name + username + '.parquet'
-    if (force_refresh) or not os.path.isfile(filename):
-        construct_parquet_by_username(username=username, base_directory_name=base_directory_name)
+    if (force_refresh) or not os.path.isfile(filename) or not schema.is_current(filename):
+        with user_lock(username, base_directory_name):
+            # Constructed by another writer while this one waited on the lock
+            if (force_refresh) or not os.path.isfile(filename) or not schema.is_current(filename):
+                construct_parquet_by_username(username=username, base_directory_name=base_directory_name)
     
-    return pd.read_parquet(base_directory_name + username + '.parquet')
+    return read_player_parquet(username=username, base_directory_name=base_directory_name)
+
+
+def get_cube_by_username(username: str, game_data: pd.DataFrame, base_directory_name: str = global_pgn_directory) -> pd.DataFrame:
+    """Read the cube of game counts of the username, rebuilding it from the loaded games if it is missing or out of date"""
+    return cube.get_cube(username=username, game_data=game_data, base_directory_name=base_directory_name)
+
+
+def get_opponents_by_username(username: str, game_data: pd.DataFrame, base_directory_name: str = global_pgn_directory) -> pd.DataFrame:
+    """Read the opponent index of the username, rebuilding it from the loaded games if it is missing or out of date"""
+    return opponents.get_index(username=username, game_data=game_data, base_directory_name=base_directory_name)
+
+
+def get_tree_by_username(username: str, game_data: pd.DataFrame, base_directory_name: str = global_pgn_directory) -> pd.DataFrame:
+    """Read the opening tree of the username, rebuilding it from the loaded games if it is missing or out of date"""
+    return openingtree.get_tree(username=username, game_data=game_data, base_directory_name=base_directory_name)
 
 
 if __name__ == "__main__":
@@ -253,14 +569,4 @@ if __name__ == "__main__":
 
     # download_by_username_list(usernames) # Just calls the functions above in order
     
-    # Or
-
-    # This fetches and saves month archives in a 'single step'(async)
-    # response = get_player_months(usernames)
-    # response = get_dates_not_downloaded(response, pgn_directory="./../../pgns/")
-    # coro = make_player_games_by_month_coro(requests=response)
-    # alt_make_queries(coro=coro)
-
-    # Or
 
-    # download_by_username_list_better(usernames=usernames)
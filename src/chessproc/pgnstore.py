@@ -0,0 +1,243 @@
+
+# Compressed store of the month pgn files, each month is a file of zstd frames holding a few games each
+#
+# Usage: python -m chessproc.pgnstore [--pgn-directory pgns/] [--train-dictionary]
+#
+# A month file starts with a skippable frame holding the compressed length of every frame, so frames can be
+# decompressed one at a time and the file as a whole is still a valid zstd stream.  Frames are compressed with the
+# shared dictionary of the store when there is one, plain .txt month files are migrated the first time they are listed.
+# Every dictionary trained is also kept by its id, so frames written with an older dictionary can still be read.
+#
+# A game is located by its month key(username/month), the index of its frame and its byte offset and length in the
+# decompressed frame.  The frames of a month only depend on the pgn, so locations stay valid when a month is recompressed.
+
+import argparse
+from functools import lru_cache
+import logging
+import mmap
+import os
+import random
+import struct
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import zstandard
+
+month_suffix = ".pgn.zst"
+plain_suffix = ".txt"
+dictionary_name = "dictionary.zstd"
+dictionary_directory = ".dictionaries/"
+game_separator = "\n\n\n"
+frame_games = 32
+compression_level = 10
+dictionary_size = 112640
+dictionary_samples = 20000
+
+# Magic number of the skippable frame holding the frame table
+table_magic = 0x184D2A50
+
+
+def month_filepath(username: str, date: str, base_directory_name: str) -> str:
+    """Path of the compressed month file of the username"""
+    return f"{base_directory_name}{username}/{date}{month_suffix}"
+
+
+def month_key(filepath: str) -> str:
+    """Location of the month file relative to the store, username/month"""
+    return os.path.basename(os.path.dirname(filepath)) + "/" + os.path.basename(filepath)[:-len(month_suffix)]
+
+
+def key_filepath(key: str, base_directory_name: str) -> str:
+    """Path of the month file with the month key"""
+    return base_directory_name + key + month_suffix
+
+
+def store_directory(filepath: str) -> str:
+    """Base directory of the store holding the month file, two directories up"""
+    return os.path.dirname(os.path.dirname(os.path.abspath(filepath))) + "/"
+
+
+@lru_cache(maxsize=4)
+def _read_dictionary(filepath: str, mtime_ns: int) -> zstandard.ZstdCompressionDict:
+    with open(filepath, 'rb') as fh:
+        return zstandard.ZstdCompressionDict(fh.read())
+
+
+def load_dictionary(filepath: str, dict_id: Optional[int] = None) -> Optional[zstandard.ZstdCompressionDict]:
+    """Return the current shared dictionary of the store holding the month file, or the one with the given id, None if there is none"""
+    if dict_id is None:
+        dict_filepath = store_directory(filepath) + dictionary_name
+    else:
+        dict_filepath = f"{store_directory(filepath)}{dictionary_directory}{dict_id}.zstd"
+    try:
+        return _read_dictionary(dict_filepath, os.stat(dict_filepath).st_mtime_ns)
+    except OSError:
+        return None
+
+
+def split_frames(pgn: str) -> List[str]:
+    """Split the month pgn into frame texts of frame_games games each, concatenated they give back the pgn"""
+    games = pgn.split(game_separator)
+    groups = [games[i:i + frame_games] for i in range(0, len(games), frame_games)]
+    return [game_separator.join(group) + (game_separator if i < len(groups) - 1 else "") for i, group in enumerate(groups)]
+
+
+def compress_month(pgn: str, dictionary: Optional[zstandard.ZstdCompressionDict] = None) -> bytes:
+    """Compress the month pgn to the frame table followed by the frames"""
+    compressor = zstandard.ZstdCompressor(level=compression_level, dict_data=dictionary)
+    frames = [compressor.compress(text.encode()) for text in split_frames(pgn)]
+    table = struct.pack(f"<{len(frames)}I", *[len(frame) for frame in frames])
+
+    return struct.pack("<II", table_magic, len(table)) + table + b"".join(frames)
+
+
+def write_month(filepath: str, pgn: str) -> int:
+    """Write the compressed month to a temporary file and move it into place, return the compressed size"""
+    data = compress_month(pgn, dictionary=load_dictionary(filepath))
+    with open(filepath + ".part", 'wb') as fh:
+        fh.write(data)
+    os.replace(filepath + ".part", filepath)
+
+    return len(data)
+
+
+def frame_table(data: bytes) -> Optional[List[Tuple[int, int]]]:
+    """Return the offset and length of every frame in the month file data, None if the data has no frame table"""
+    if len(data) < 8:
+        return None
+    magic, table_size = struct.unpack_from("<II", data)
+    if magic != table_magic:
+        return None
+
+    offset = 8 + table_size
+    frames = []
+    for (length,) in struct.iter_unpack("<I", data[8:offset]):
+        frames.append((offset, length))
+        offset += length
+    return frames
+
+
+def decompress_frame(data: bytes, filepath: str) -> bytes:
+    """Decompress a frame of the month file, with the shared dictionary if the frame was compressed with one"""
+    dict_id = zstandard.get_frame_parameters(data).dict_id
+    decompressor = zstandard.ZstdDecompressor(dict_data=load_dictionary(filepath, dict_id)) if dict_id else zstandard.ZstdDecompressor()
+
+    # Read as a stream so a plain zstd file without frame table can be passed whole as a single frame
+    return decompressor.stream_reader(data, read_across_frames=True).read()
+
+
+def file_frames(data: bytes) -> List[Tuple[int, int]]:
+    """Return the offset and length of every frame in the month file data, the whole file if it has no frame table(a plain zstd file)"""
+    frames = frame_table(data)
+    return [(0, len(data))] if frames is None else frames
+
+
+def iter_frames(filepath: str) -> Iterator[str]:
+    """Decompress the month file one frame at a time, each frame holds whole games"""
+    with open(filepath, 'rb') as fh:
+        data = fh.read()
+
+    view = memoryview(data)
+    for offset, length in file_frames(data):
+        yield decompress_frame(view[offset:offset + length], filepath).decode()
+
+
+def read_games(filepath: str, locations: Iterable[Tuple[int, int, int]]) -> List[str]:
+    """Read games from the month file by frame index, offset and length, memory mapping the file and decompressing each frame once"""
+    games = []
+    frame_data: Dict[int, bytes] = {}
+    with open(filepath, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        frames = file_frames(data)
+        for frame, offset, length in locations:
+            if frame not in frame_data:
+                frame_offset, frame_length = frames[frame]
+                frame_data[frame] = decompress_frame(data[frame_offset:frame_offset + frame_length], filepath)
+            games.append(frame_data[frame][offset:offset + length].decode())
+
+    return games
+
+
+def read_month(filepath: str) -> str:
+    """Read the whole month pgn from the month file"""
+    return "".join(iter_frames(filepath))
+
+
+def migrate_month(plain_filepath: str) -> str:
+    """Compress a plain .txt month file into the store and remove it, return the path of the compressed file"""
+    filepath = plain_filepath[:-len(plain_suffix)] + month_suffix
+    with open(plain_filepath, encoding="utf-8", errors="replace") as fh:
+        write_month(filepath, fh.read())
+    os.remove(plain_filepath)
+
+    return filepath
+
+
+def month_file(username: str, date: str, base_directory_name: str) -> Optional[str]:
+    """Return the path of the month file of the username, migrating a plain file, None if the month is not stored"""
+    filepath = month_filepath(username, date, base_directory_name)
+    plain_filepath = f"{base_directory_name}{username}/{date}{plain_suffix}"
+    if os.path.isfile(plain_filepath):
+        return migrate_month(plain_filepath)
+
+    return filepath if os.path.isfile(filepath) else None
+
+
+def list_dates(username: str, base_directory_name: str) -> List[str]:
+    """Return the sorted dates of the stored month files of the username, migrating any plain files first"""
+    directory = base_directory_name + username + "/"
+    if not os.path.isdir(directory):
+        return []
+
+    files = os.listdir(directory)
+    plain_files = [file for file in files if file.endswith(plain_suffix)]
+    if plain_files:
+        logging.warning(f"Compressing {len(plain_files)} month files for {username}.")
+        for file in plain_files:
+            migrate_month(directory + file)
+        files = os.listdir(directory)
+
+    return sorted([file[:-len(month_suffix)] for file in files if file.endswith(month_suffix)])
+
+
+def store_usernames(base_directory_name: str) -> List[str]:
+    """Return the usernames with a directory of month files"""
+    return sorted([name for name in os.listdir(base_directory_name) if os.path.isdir(base_directory_name + name) and not name.startswith('.')])
+
+
+def train_dictionary(base_directory_name: str, size: int = dictionary_size, samples: int = dictionary_samples) -> Dict[str, int]:
+    """Train the shared dictionary on games sampled from every stored month and recompress the months with it one at a time.
+
+    Return the total size of the month files before and after recompressing.
+    """
+    filepaths = [month_file(username, date, base_directory_name) for username in store_usernames(base_directory_name) for date in list_dates(username, base_directory_name)]
+    per_month = samples // max(len(filepaths), 1) + 1
+    games = []
+    for filepath in filepaths:
+        month_games = [game.encode() for game in read_month(filepath).split(game_separator) if game.strip()]
+        games.extend(random.sample(month_games, min(per_month, len(month_games))))
+    dictionary = zstandard.train_dictionary(size, games)
+
+    # Keep the dictionary by id before making it current, months written with it are readable from then on
+    os.makedirs(base_directory_name + dictionary_directory, exist_ok=True)
+    for filepath in [f"{base_directory_name}{dictionary_directory}{dictionary.dict_id()}.zstd", base_directory_name + dictionary_name]:
+        with open(filepath + ".part", 'wb') as fh:
+            fh.write(dictionary.as_bytes())
+        os.replace(filepath + ".part", filepath)
+
+    before = sum(os.path.getsize(filepath) for filepath in filepaths)
+    after = sum(write_month(filepath, read_month(filepath)) for filepath in filepaths)
+
+    return {"before": before, "after": after}
+
+
+if __name__ == "__main__":
+    from .pgnproc import global_pgn_directory
+
+    parser = argparse.ArgumentParser(description="Compress the stored month pgn files, optionally with a dictionary trained on the stored games.")
+    parser.add_argument("--pgn-directory", default=global_pgn_directory, help="Directory for the pgn and parquet files")
+    parser.add_argument("--train-dictionary", action="store_true", help="Train the shared dictionary and recompress every month with it")
+    args = parser.parse_args()
+
+    if args.train_dictionary:
+        print(train_dictionary(args.pgn_directory))
+    else:
+        print({username: len(list_dates(username, args.pgn_directory)) for username in store_usernames(args.pgn_directory)})
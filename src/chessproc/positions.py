@@ -0,0 +1,164 @@
+
+# Position index of a username, the polyglot zobrist hash of every position reached in its games
+#
+# Usage: python -m chessproc.positions username "<fen>" [--pgn-directory pgns/] [--workers 4]
+#
+# The moves of each cached month are replayed in a process pool and the hashes of each month are kept, so only new or
+# changed months are replayed.  The index of the username is the hashes of all months sorted, with the game id and ply
+# of each position, stored as .npy files read memory mapped so a lookup is a binary search.
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import os
+from typing import Callable, Dict, Optional, Tuple
+
+import chess
+import chess.polyglot
+import numpy as np
+import pandas as pd
+
+from . import pgncache
+from .locks import user_lock
+
+positions_directory = ".positions/"
+manifest_name = "manifest.json"
+index_arrays = ["hashes", "game_ids", "plies"]
+
+
+def positions_path(username: str, base_directory_name: str) -> str:
+    return f"{base_directory_name}{positions_directory}{username}/"
+
+
+def position_hash(fen: str) -> np.uint64:
+    """Polyglot zobrist hash of the position given as FEN"""
+    return np.uint64(chess.polyglot.zobrist_hash(chess.Board(fen)))
+
+
+def game_hashes(moves: np.ndarray, fen: Optional[str] = None, chess960: bool = False) -> np.ndarray:
+    """Replay the SAN moves of a game and return the hash of the start position and of the position after each ply"""
+    board = chess.Board(fen, chess960=chess960) if isinstance(fen, str) else chess.Board()
+    hashes = [chess.polyglot.zobrist_hash(board)]
+    try:
+        for move in moves:
+            board.push_san(move[1])
+            hashes.append(chess.polyglot.zobrist_hash(board))
+    except ValueError:
+        # Moves the parser could not read fully stop the replay, the positions up to there are kept
+        pass
+    return np.array(hashes, dtype=np.uint64)
+
+
+def month_positions(filepath: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Replay every game of a cached month dataframe, return the hashes with the game id and ply of each"""
+    month_df = pd.read_parquet(filepath)
+    if "moves" not in month_df:
+        month_df = pd.DataFrame({"moves": []})
+    hashes, game_ids, plies = [], [], []
+    fens = month_df["FEN"] if "FEN" in month_df else pd.Series(None, index=month_df.index, dtype=object)
+    variants = month_df["Variant"] if "Variant" in month_df else pd.Series(None, index=month_df.index, dtype=object)
+    for game_id, moves, fen, variant in zip(month_df.index, month_df["moves"], fens, variants):
+        game = game_hashes(moves, fen=fen, chess960=variant == "Chess960")
+        hashes.append(game)
+        game_ids.append(np.full(len(game), game_id, dtype=np.uint64))
+        plies.append(np.arange(len(game), dtype=np.uint16))
+
+    if not hashes:
+        return np.array([], dtype=np.uint64), np.array([], dtype=np.uint64), np.array([], dtype=np.uint16)
+    return np.concatenate(hashes), np.concatenate(game_ids), np.concatenate(plies)
+
+
+def load_manifest(username: str, base_directory_name: str) -> Dict[str, str]:
+    """Month hashes the stored month positions were replayed from, by date"""
+    try:
+        with open(positions_path(username, base_directory_name) + manifest_name) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(username: str, manifest: Dict[str, str], base_directory_name: str) -> None:
+    filepath = positions_path(username, base_directory_name) + manifest_name
+    with open(filepath + ".tmp", 'w') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def update_index(username: str, base_directory_name: str, workers: Optional[int] = None, progress: Optional[Callable[[str], None]] = None) -> int:
+    """Replay the months cached since the last update in a process pool and rewrite the sorted index, return the number of positions"""
+    directory = positions_path(username, base_directory_name)
+    os.makedirs(directory + "months/", exist_ok=True)
+    month_manifest = pgncache.load_manifest(username=username, base_directory_name=base_directory_name)
+    manifest = load_manifest(username, base_directory_name)
+    cache_directory = pgncache.cache_directory(username, base_directory_name)
+
+    stale = [date for date, entry in month_manifest.items() if manifest.get(date) != entry["hash"] or not os.path.isfile(f"{directory}months/{date}.npz")]
+    removed = [date for date in manifest if date not in month_manifest]
+    if not stale and not removed and all(os.path.isfile(f"{directory}{name}.npy") for name in index_arrays):
+        return len(np.load(directory + "hashes.npy", mmap_mode='r'))
+
+    with user_lock(username, base_directory_name):
+        if stale:
+            logging.warning(f"Replaying {len(stale)} months for {username}.")
+            if progress is not None:
+                progress(f"Replaying {len(stale)} months...")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for date, (hashes, game_ids, plies) in zip(stale, executor.map(month_positions, [cache_directory + date + ".parquet" for date in stale])):
+                    np.savez(f"{directory}months/{date}.npz", hashes=hashes, game_ids=game_ids, plies=plies)
+                    manifest[date] = month_manifest[date]["hash"]
+        for date in removed:
+            del manifest[date]
+            os.remove(f"{directory}months/{date}.npz")
+
+        # Merge the months into one index sorted by hash, written beside the old one and moved into place
+        months = [np.load(f"{directory}months/{date}.npz") for date in sorted(manifest)]
+        arrays = {name: np.concatenate([month[name] for month in months]) if months else np.array([], dtype=np.uint64) for name in index_arrays}
+        order = np.argsort(arrays["hashes"], kind="stable")
+        for name in index_arrays:
+            np.save(f"{directory}{name}.tmp.npy", arrays[name][order])
+            os.replace(f"{directory}{name}.tmp.npy", f"{directory}{name}.npy")
+        save_manifest(username, manifest, base_directory_name)
+
+    return len(order)
+
+
+def open_index(username: str, base_directory_name: str) -> Dict[str, np.ndarray]:
+    """Open the index arrays of the username memory mapped"""
+    directory = positions_path(username, base_directory_name)
+    return {name: np.load(f"{directory}{name}.npy", mmap_mode='r') for name in index_arrays}
+
+
+def find_position(index: Dict[str, np.ndarray], fen: str) -> pd.DataFrame:
+    """Return the game ids reaching the position and the first ply each reached it at, by binary search on the hashes"""
+    key = position_hash(fen)
+    start, end = np.searchsorted(index["hashes"], key, side="left"), np.searchsorted(index["hashes"], key, side="right")
+    found = pd.DataFrame({"game_id": np.asarray(index["game_ids"][start:end]), "ply": np.asarray(index["plies"][start:end])})
+
+    # A game can pass through a position more than once, keep the first time
+    return found.groupby("game_id")["ply"].min().reset_index()
+
+
+def games_reaching(username: str, fen: str, base_directory_name: str, game_data: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Return the games of the username reaching the position, with the ply it was reached at, limited to game_data if given"""
+    update_index(username, base_directory_name)
+    found = find_position(open_index(username, base_directory_name), fen).set_index("game_id")
+    if game_data is None:
+        return found
+    found = found[found.index.isin(game_data.index)]
+    return game_data.loc[found.index].assign(position_ply=found["ply"].to_numpy())
+
+
+if __name__ == "__main__":
+    from .pgnproc import global_pgn_directory
+
+    parser = argparse.ArgumentParser(description="Find the games of a username that reached a position, including transpositions.")
+    parser.add_argument("username", help="Username to search the games of")
+    parser.add_argument("fen", help="Position to search for, as FEN")
+    parser.add_argument("--pgn-directory", default=global_pgn_directory, help="Directory for the pgn and parquet files")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes replaying months")
+    args = parser.parse_args()
+
+    print(f"{update_index(args.username, args.pgn_directory, workers=args.workers)} positions indexed.")
+    with pd.option_context("display.max_rows", None):
+        print(find_position(open_index(args.username, args.pgn_directory), args.fen))
@@ -0,0 +1,169 @@
+
+# Background refresh of every tracked username, new games are picked up without anyone pressing Refresh
+#
+# Usage: python -m chessproc.scheduler [--interval 3600] [--concurrency 2] [--requests-per-second 2] [--pgn-directory pgns/]
+#
+# The scheduler runs on the event loop of the chess.com client.  Every username with a parquet file is checked once
+# per interval at a fixed phase of the interval taken from the hash of the username, so the checks are spread over the
+# interval and keep their times however many users there are or however long a check takes.  A check requests the
+# archive list and downloads, parses and upserts only the missing months and the current month(ingest_by_username).
+# Checks run in a bounded thread pool and every request waits on one request budget, and the on_refreshed callback is
+# called from the pool with the username and game count whenever the game count of the username changed.
+
+import argparse
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import logging
+import math
+import os
+from threading import Event
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+import pyarrow.parquet as pq
+
+from .chessclient import RequestBudget, get_client
+from .locks import user_lock
+from .pgnproc import IngestCancelled, global_pgn_directory, ingest_by_username
+
+# Longest sleep of the scheduler, new parquet files(added users) are picked up at least this often
+poll_seconds = 60
+
+def tracked_usernames(base_directory_name: str) -> List[str]:
+    """Usernames with a parquet file"""
+    return sorted([file[:-8] for file in os.listdir(base_directory_name) if file.endswith('.parquet')])
+
+
+def stored_game_count(username: str, base_directory_name: str) -> Optional[int]:
+    """Number of games in the parquet file of the username from its footer, None if it has none"""
+    try:
+        return pq.read_metadata(base_directory_name + username + ".parquet").num_rows
+    except OSError:
+        return None
+
+
+class RefreshScheduler:
+
+    """
+    Checks every tracked username for new games once per interval in the background.
+
+    Started with start and stopped with stop from any thread, refresh_now moves the check of a username to now.
+    """
+
+    def __init__(self, base_directory_name: str = global_pgn_directory, interval: float = 3600, concurrency: int = 2,
+                 requests_per_second: float = 2, on_refreshed: Optional[Callable[[str, int], None]] = None) -> None:
+        self.base_directory_name = base_directory_name
+        self.interval = interval
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.on_refreshed = on_refreshed
+
+        # Next check of each username, monotonic time, and the usernames being checked
+        self.start_time = time.monotonic()
+        self.due: Dict[str, float] = {}
+        self.running: Set[str] = set()
+
+        self.cancel = Event()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="refresh")
+        self.task: Optional[Future] = None
+        self.wake = asyncio.Event()
+
+    def phase(self, username: str) -> float:
+        """Offset of the checks of the username in the interval, the same on every run"""
+        return int(hashlib.sha1(username.encode()).hexdigest()[:8], 16) / 16 ** 8 * self.interval
+
+    def next_due(self, username: str, now: float) -> float:
+        """First check time of the username after now"""
+        first = self.start_time + self.phase(username)
+        return first if now < first else first + (math.floor((now - first) / self.interval) + 1) * self.interval
+
+    def start(self) -> None:
+        """Run the scheduler on the client event loop, every request of the client waits on the request budget from now on"""
+        client = get_client()
+        client.budget = RequestBudget(rate=self.requests_per_second, burst=self.concurrency)
+        self.task = client.submit(self.run())
+
+    def stop(self) -> None:
+        """Cancel the running checks and wait for them, the months already downloaded are kept"""
+        self.cancel.set()
+        if self.task is not None:
+            get_client().loop.call_soon_threadsafe(self.wake.set)
+            self.task.result()
+        self.executor.shutdown(wait=True)
+
+    def refresh_now(self, username: str) -> None:
+        """Check the username as soon as a thread is free, its later checks keep their times"""
+        if self.task is None:
+            return
+
+        def bring_forward() -> None:
+            self.due[username] = 0
+            self.wake.set()
+
+        get_client().loop.call_soon_threadsafe(bring_forward)
+
+    async def run(self) -> None:
+        """Start the checks that are due, then sleep until the next one is due or a check is brought forward"""
+        loop = asyncio.get_running_loop()
+        while not self.cancel.is_set():
+            now = time.monotonic()
+            usernames = tracked_usernames(self.base_directory_name)
+            for username in usernames:
+                self.due.setdefault(username, self.next_due(username, now))
+            for username in [username for username in self.due if username not in usernames]:
+                del self.due[username]
+
+            for username, due in list(self.due.items()):
+                if due <= now and username not in self.running:
+                    self.running.add(username)
+                    self.due[username] = self.next_due(username, now)
+                    loop.run_in_executor(self.executor, self.refresh, username).add_done_callback(lambda _, username=username: self.check_done(username))
+
+            self.wake.clear()
+            sleep = min([poll_seconds] + [due - now for username, due in self.due.items() if username not in self.running])
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=max(sleep, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def check_done(self, username: str) -> None:
+        """Let the username be checked again, a check brought forward while it ran starts now"""
+        self.running.discard(username)
+        self.wake.set()
+
+    def refresh(self, username: str) -> None:
+        """Pick up the new games of the username, run in the thread pool"""
+        # Held over the count and the ingest, so a manual refresh or another process writing the username never overlaps
+        with user_lock(username, self.base_directory_name):
+            if self.cancel.is_set():
+                return
+            before = stored_game_count(username, self.base_directory_name)
+            try:
+                games = ingest_by_username(username=username, base_directory_name=self.base_directory_name, cancel=self.cancel)
+            except IngestCancelled:
+                return
+            except Exception as err:
+                logging.warning(f"Scheduled refresh of {username} failed with {err!r}.")
+                return
+
+        logging.warning(f"Scheduled refresh of {username}: {games} games, {before} before.")
+        if games != before and self.on_refreshed is not None:
+            self.on_refreshed(username, games)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the games of every stored user up to date.")
+    parser.add_argument("--pgn-directory", default=global_pgn_directory, help="Directory for the pgn and parquet files")
+    parser.add_argument("--interval", type=float, default=3600, help="Seconds between two checks of a user")
+    parser.add_argument("--concurrency", type=int, default=2, help="Number of users checked at once")
+    parser.add_argument("--requests-per-second", type=float, default=2, help="Requests per second to chess.com over all users")
+    args = parser.parse_args()
+
+    scheduler = RefreshScheduler(args.pgn_directory, interval=args.interval, concurrency=args.concurrency, requests_per_second=args.requests_per_second,
+                                 on_refreshed=lambda username, games: print(f"{username}: {games} games."))
+    scheduler.start()
+    try:
+        scheduler.task.result()
+    except KeyboardInterrupt:
+        scheduler.stop()
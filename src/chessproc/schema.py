@@ -0,0 +1,129 @@
+
+# Explicit dtype schema for the game dataframe, enforced when writing parquet files and checked when reading them
+
+import json
+import logging
+import os
+from typing import Dict, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Bump the version whenever a parsed column is added, removed or changes dtype, parquet files with another version are rebuilt
+schema_version = 6
+schema_version_key = b"chessplotter.schema_version"
+
+# Versions of the columns derived from the parsed columns(pgnproc.derived_columns), bump the version of a derived column
+# when the way it is computed changes, only the derived columns with another version are computed again on read
+derived_versions: Dict[str, int] = {"player_result": 1, "player_is_white": 1, "elo_difference": 1, "game_length": 1, "clocks": 1, "time_control": 1}
+derived_versions_key = b"chessplotter.derived_versions"
+
+# Derived columns of parquet files written before derived versions were recorded, all at version 1
+unversioned_derived = ["player_result", "player_is_white", "elo_difference", "game_length", "clocks", "time_control"]
+
+# Dtypes of the known columns, columns not listed(dates, times, moves) keep the dtype given by gamelist_to_df
+# - The index is the uint64 game id, the hash of the game url
+game_schema: Dict[str, str] = {"Event":             "category",
+                               "Site":              "category",
+                               "Round":             "category",
+                               "White":             "category",
+                               "Black":             "category",
+                               "Result":            "category",
+                               "Timezone":          "category",
+                               "ECO":               "category",
+                               "ECOUrl":            "category",
+                               "TimeControl":       "category",
+                               "Termination":       "category",
+                               "Username":          "category",
+                               "WhiteElo":          "int16",
+                               "BlackElo":          "int16",
+                               "player_result":     "int8",
+                               "player_is_white":   "bool",
+                               "elo_difference":    "int16",
+                               "game_length":       "int16",
+                               "base_time":         "float32",
+                               "increment":         "float32",
+                               "time_class":        "int8",
+                               "pgn_file":          "category",
+                               "pgn_frame":         "int32",
+                               "pgn_offset":        "int32",
+                               "pgn_length":        "int32"}
+
+# Columns that are unique per game(or per opening tree node) and are left as strings or arrays, any other string column(extra headers) is made categorical
+string_columns = ["CurrentPosition", "Link", "moves", "clocks", "prefix"]
+
+
+def enforce_schema(game_data: pd.DataFrame) -> pd.DataFrame:
+    """Cast the columns of the game dataframe to the schema dtypes, existing categoricals keep their categories and order"""
+    for col in game_data.columns:
+        dtype = game_schema.get(col)
+        if dtype is None:
+            if col not in string_columns and game_data[col].dtype == object:
+                game_data[col] = game_data[col].astype("category")
+        elif dtype == "category":
+            if not isinstance(game_data[col].dtype, pd.CategoricalDtype):
+                game_data[col] = game_data[col].astype("category")
+        elif game_data[col].dtype != dtype:
+            game_data[col] = game_data[col].astype(dtype)
+
+    return game_data
+
+
+def schema_mismatches(game_data: pd.DataFrame) -> List[str]:
+    """Return the list of schema columns whose dtype does not match the schema, all null columns(headers missing from every game) have no dtype in parquet and are not counted"""
+    mismatches = []
+    for col, dtype in game_schema.items():
+        if col not in game_data.columns or game_data[col].isna().all():
+            continue
+        if dtype == "category":
+            if not isinstance(game_data[col].dtype, pd.CategoricalDtype):
+                mismatches.append(col)
+        elif game_data[col].dtype != dtype:
+            mismatches.append(col)
+
+    return mismatches
+
+
+def write_parquet(game_data: pd.DataFrame, filename: str) -> None:
+    """Enforce the schema and write the dataframe to a parquet file tagged with the schema and derived versions, replacing any existing file in one step"""
+    table = pa.Table.from_pandas(enforce_schema(game_data))
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), schema_version_key: str(schema_version).encode(),
+                                           derived_versions_key: json.dumps(derived_versions, sort_keys=True).encode()})
+    pq.write_table(table, filename + ".tmp")
+    os.replace(filename + ".tmp", filename)
+
+
+def parquet_schema_version(filename: str) -> int:
+    """Return the schema version recorded in the parquet file, 0 if it predates the schema"""
+    metadata = pq.read_schema(filename).metadata or {}
+    return int(metadata.get(schema_version_key, b"0"))
+
+
+def is_current(filename: str) -> bool:
+    """Check that the parquet file was written with the current schema version"""
+    return parquet_schema_version(filename) == schema_version
+
+
+def parquet_derived_versions(filename: str) -> Dict[str, int]:
+    """Return the derived column versions recorded in the parquet file"""
+    metadata = pq.read_schema(filename).metadata or {}
+    if derived_versions_key not in metadata:
+        return {name: 1 for name in unversioned_derived}
+    return json.loads(metadata[derived_versions_key])
+
+
+def stale_derived(filename: str) -> List[str]:
+    """Return the derived columns of the parquet file computed with another version than the current one, or missing"""
+    stored = parquet_derived_versions(filename)
+    return [name for name, version in derived_versions.items() if stored.get(name) != version]
+
+
+def read_parquet(filename: str) -> pd.DataFrame:
+    """Read parquet file written with write_parquet, re-enforcing the schema on any column that comes back with another dtype"""
+    game_data = pd.read_parquet(filename)
+    mismatches = schema_mismatches(game_data)
+    if mismatches:
+        logging.warning(f"Columns {mismatches} in {filename} do not match the schema, casting.")
+
+    return enforce_schema(game_data)
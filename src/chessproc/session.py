@@ -0,0 +1,80 @@
+
+# Snapshot of the last GUI session, so a relaunch shows the last plot before any games are read
+#
+# On exit the selected user, the filters, the plot choice, the drawn plot as png and the positions of the filtered
+# games in the sorted games of the user are written to .session/ in the pgn directory.  On launch the png is shown at
+# once while the games are read in the background, and the positions stand in for filtering the games again.  The
+# png and the positions are only used while the parquet file of the user is the one they were made from.
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+from matplotlib.figure import Figure
+import numpy as np
+
+session_directory = ".session/"
+state_name = "session.json"
+image_name = "plot.png"
+positions_name = "filtered.npy"
+
+
+def session_path(base_directory_name: str) -> str:
+    return base_directory_name + session_directory
+
+
+def parquet_stamp(username: str, base_directory_name: str) -> Optional[List[int]]:
+    """Modification time and size of the parquet file of the username, None if it is missing"""
+    try:
+        stat = os.stat(base_directory_name + username + ".parquet")
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def save_session(state: Dict, figure: Optional[Figure], positions: Optional[np.ndarray], base_directory_name: str) -> None:
+    """Write the session state, with the png of the figure and the filtered positions, a figure of None keeps the last png"""
+    directory = session_path(base_directory_name)
+    os.makedirs(directory, exist_ok=True)
+    state = dict(state, parquet=parquet_stamp(state["username"], base_directory_name))
+
+    # Each file is written beside the old one and moved into place, the state last
+    if figure is not None:
+        figure.savefig(directory + "plot.tmp.png", format="png")
+        os.replace(directory + "plot.tmp.png", directory + image_name)
+    if positions is not None:
+        np.save(directory + "filtered.tmp.npy", positions)
+        os.replace(directory + "filtered.tmp.npy", directory + positions_name)
+    elif os.path.isfile(directory + positions_name):
+        os.remove(directory + positions_name)
+    with open(directory + "session.tmp.json", 'w') as fh:
+        json.dump(state, fh, indent=1, sort_keys=True)
+    os.replace(directory + "session.tmp.json", directory + state_name)
+
+
+def load_session(base_directory_name: str) -> Optional[Dict]:
+    """Read the last session, None if there is none or its user has no parquet file.
+
+    The image path and the filtered positions are added when the parquet file of the user is unchanged, else they are None.
+    """
+    directory = session_path(base_directory_name)
+    try:
+        with open(directory + state_name) as fh:
+            state = json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+    stamp = parquet_stamp(state.get("username", ""), base_directory_name)
+    if stamp is None:
+        return None
+    fresh = stamp == state.get("parquet")
+    if not fresh:
+        logging.warning(f"Games of {state['username']} changed since the last session, the session plot is not shown.")
+
+    state["image"] = directory + image_name if fresh and os.path.isfile(directory + image_name) else None
+    try:
+        state["positions"] = np.load(directory + positions_name) if fresh else None
+    except (OSError, ValueError):
+        state["positions"] = None
+    return state
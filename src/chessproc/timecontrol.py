@@ -0,0 +1,34 @@
+
+# Time controls of the games, parsed from the TimeControl header into base time, increment and time class
+#
+# TimeControl is categorical with few distinct values, so each category is parsed once with vectorized string
+# operations and the results are taken by the category codes of the games.
+
+import numpy as np
+import pandas as pd
+
+# Time class names by code, games with an unreadable time control have code -1
+time_classes = ["Bullet", "Blitz", "Rapid", "Daily"]
+
+# Upper limits in seconds of the estimated game duration(base time plus 40 increments) of bullet and blitz games
+bullet_limit = 180
+blitz_limit = 600
+
+
+def parse_time_controls(time_controls: pd.Series) -> pd.DataFrame:
+    """Parse the TimeControl of each game to base_time and increment in seconds and a time_class code, base and increment are NaN for daily games"""
+    time_controls = time_controls.astype("category")
+    categories = time_controls.cat.categories.astype(str)
+    parts = categories.str.extract(r'^([0-9]+)(?:\+([0-9]+))?$').astype(np.float64)
+    base = parts[0].to_numpy()
+    increment = np.where(np.isnan(base), np.nan, parts[1].fillna(0).to_numpy())
+
+    # Daily time controls are written as moves/seconds per move, like 1/86400
+    estimate = base + 40 * increment
+    time_class = np.select([estimate < bullet_limit, estimate < blitz_limit, estimate >= blitz_limit, categories.str.match(r'^[0-9]+/[0-9]+$')], [0, 1, 2, 3], -1)
+
+    # Games without a time control have code -1, they take the appended missing values
+    codes = time_controls.cat.codes.to_numpy()
+    return pd.DataFrame({"base_time": np.append(base, np.nan)[codes].astype(np.float32),
+                         "increment": np.append(increment, np.nan)[codes].astype(np.float32),
+                         "time_class": np.append(time_class, -1)[codes].astype(np.int8)}, index=time_controls.index)